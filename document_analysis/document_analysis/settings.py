@@ -81,9 +81,148 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'timeout': 20,
+        },
     }
 }
 
+# Applied to every new SQLite connection. In WAL mode readers are not
+# blocked while ingestion writes, and synchronous = normal is safe with WAL.
+# The page cache size is in KiB when negative, the mmap size in bytes.
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -64 * 1024,
+    'mmap_size': 256 * 1024 ** 2,
+    'temp_store': 'memory',
+}
+
+# Set to True to serve the read views from a separate read-only connection,
+# so they never queue behind ingestion on the same connection.
+
+DATABASE_READ_REPLICA = False
+
+if DATABASE_READ_REPLICA:
+    DATABASES['replica'] = dict(
+        DATABASES['default'],
+        TEST={'MIRROR': 'default'}
+    )
+    DATABASE_ROUTERS = ['word_sentences.database.ReadReplicaRouter']
+
+
+# spaCy pipeline used by the analyser
+# The analyser only needs lemmas and sentence boundaries, so the
+# named entity recogniser is not loaded. Set SPACY_SENTENCIZER to
+# split sentences with the rule-based sentencizer instead of the parser.
+
+SPACY_MODEL = 'en_core_web_sm'
+
+SPACY_DISABLE = ['ner']
+
+SPACY_SENTENCIZER = False
+
+# Which tokens are counted as words, only alphabetic tokens ever are.
+# Stop words default to spaCy's English list, set TOKEN_STOP_WORDS to a list
+# of words or the path of a file with one word per line to replace it.
+# TOKEN_POS keeps only these parts of speech, e.g. ['NOUN', 'VERB'].
+# Lengths are of the lemma, at most the length of Word.text.
+# Allowed words are kept even if they are stop words or another part of
+# speech, denied words never are; both match the lowercase token or lemma.
+
+TOKEN_STOP_WORDS = None
+
+TOKEN_POS = None
+
+TOKEN_MIN_LENGTH = 1
+
+TOKEN_MAX_LENGTH = 45
+
+TOKEN_ALLOW = []
+
+TOKEN_DENY = []
+
+# Size in characters of the chunks large documents are streamed in
+
+ANALYSER_CHUNK_SIZE = 100000
+
+# How worker processes are started: 'fork', 'spawn' or 'forkserver',
+# or None for the platform's default. Workers work with any of them.
+
+WORKER_START_METHOD = None
+
+# On-disk cache of parse results, disabled while the directory is None.
+# Set it to a directory outside the source tree to enable it.
+# Least recently used entries are removed above the size in bytes.
+
+ANALYSER_CACHE_DIR = None
+
+ANALYSER_CACHE_SIZE = 512 * 1024 ** 2
+
+
+# Seconds without a heartbeat after which a job still parsing or saving
+# is assumed to have lost its worker and is queued again. Workers send
+# one for their whole batch after each document they parse.
+
+INGEST_JOB_TIMEOUT = 60 * 60
+
+
+# Word associations kept per word after each ingestion,
+# and the number of sentences a pair needs to be considered.
+
+ASSOCIATION_TOP_K = 20
+
+ASSOCIATION_MIN_COUNT = 2
+
+# Number of TF-IDF keywords stored per document.
+# Keywords of new documents are added after each ingestion,
+# all are recomputed once the corpus grows by the rebuild growth.
+
+KEYWORD_TOP_N = 10
+
+KEYWORD_REBUILD_GROWTH = 0.25
+
+# Exports of all word data, written after each ingestion.
+# Set the compression to 'gzip' to compress the text formats.
+
+EXPORT_DIR = BASE_DIR / 'exports'
+
+EXPORT_COMPRESSION = None
+
+
+# Read views are cached per corpus version, in files so that
+# every process sees the version bumped by ingestion.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'view_cache',
+    }
+}
+
+VIEW_CACHE_TIMEOUT = 60 * 60
+
+
+# Ingestion reports are logged to the console.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'word_sentences': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -122,3 +261,7 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.1/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# Uploaded documents waiting for, or processed by, the ingest worker
+
+MEDIA_ROOT = BASE_DIR / 'media'
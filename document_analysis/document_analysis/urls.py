@@ -15,12 +15,25 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from word_sentences import views
+from word_sentences import api, views
 
 urlpatterns = [
     path('', views.WordListView.as_view(), name='word-list'),
     path('words/', views.WordListView.as_view(), name='word-list'),
     path('documents/', views.DocumentListView.as_view(), name='document-list'),
     path('document-words/<int:doc_id>', views.DocumentWordListView.as_view(), name='document-word-list'),
+    path('words/<int:word_id>/related/', views.word_related, name='word-related'),
+    path('documents/<int:doc_id>/similar/', views.document_similar, name='document-similar'),
     path('download/<int:doc_id>/', views.download, name='download'),
+    path('search/', views.search_view, name='search'),
+    path('search/json/', views.search_json, name='search-json'),
+    path('upload/', views.upload, name='upload'),
+    path('jobs/<int:job_id>/', views.job_status, name='job-status'),
+    path('api/words/', api.WordApiView.as_view(), name='api-words'),
+    path('api/documents/', api.DocumentApiView.as_view(), name='api-documents'),
+    path('api/documents/<int:doc_id>/words/', api.DocumentWordApiView.as_view(), name='api-document-words'),
+    path('api/documents/<int:doc_id>/keywords/', api.document_keywords_api, name='api-document-keywords'),
+    path('api/documents/<int:doc_id>/similar/', api.similar_documents_api, name='api-similar-documents'),
+    path('api/words/<int:word_id>/related/', api.related_words_api, name='api-related-words'),
+    path('api/sentences/', api.SentenceApiView.as_view(), name='api-sentences'),
 ]
@@ -1,35 +1,175 @@
+import functools
+import hashlib
+import numpy
 import os
+import re
 import spacy
+from array import array
+from bisect import bisect_left
 from collections import defaultdict
+from contextlib import ExitStack
 from datetime import datetime
-from spacy.lang.en.stop_words import STOP_WORDS
+from itertools import islice
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Max
+from spacy.attrs import (
+    IS_ALPHA,
+    LEMMA,
+    LENGTH,
+    LOWER,
+    POS,
+    SENT_START,
+    SPACY,
+)
+from . import caching, filters, processes, search, staging
+from .instrumentation import Instrumentation
+from .parse_cache import ParseCache, parse_mode
 from .models import (
     Word,
     Sentence,
     Document,
-    DocumentWord
+    DocumentWord,
+    SentenceOccurrence,
+    CorpusStats
+)
+
+# Rows per query, kept under SQLite's limit on query parameters.
+BATCH_SIZE = 500
+
+
+def chunked(iterable, size=BATCH_SIZE):
+    """
+    Yields lists of at most size items from an iterable.
+    """
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+# A line break followed by a blank line.
+PARAGRAPH_BREAK = re.compile(r'\n[^\S\n]*\n')
+
+# The end of a sentence: a full stop, question or exclamation mark,
+# maybe closing quotes or brackets, then whitespace and the capital
+# letter of the next sentence.
+SENTENCE_END = re.compile(
+    r'[.!?]["\'\u201d\u2019)\]]*\s+(?=["\'\u201c\u2018(\[]*[A-Z])'
 )
 
 
+def chunk_end(text, chunk_size):
+    """
+    Returns where a chunk of text should end: after the first paragraph
+    break past chunk_size characters, or else after the last sentence
+    end within chunk_size * 4 characters. Only text without either
+    is cut at the last line break or space, or else at chunk_size * 4.
+    The text after the end is carried over to the next chunk.
+    """
+    limit = chunk_size * 4
+    match = PARAGRAPH_BREAK.search(text, max(chunk_size - 1, 0), limit)
+    if match:
+        return match.end()
+    end = None
+    for match in SENTENCE_END.finditer(text, 0, limit):
+        end = match.end()
+    if end:
+        return end
+    for separator in ('\n', ' '):
+        end = text.rfind(separator, 0, limit) + 1
+        if end:
+            return end
+    return limit
+
+
+# spaCy pipelines loaded in this process, keyed by their configuration.
+pipelines = {}
+
+
+def get_nlp():
+    """
+    Returns the spaCy pipeline configured in settings.
+    It is loaded on first use and shared by every Analyser in the process.
+    """
+    name = getattr(settings, 'SPACY_MODEL', 'en_core_web_sm')
+    disable = list(getattr(settings, 'SPACY_DISABLE', ['ner']))
+    sentencizer = getattr(settings, 'SPACY_SENTENCIZER', False)
+    key = (name, tuple(disable), sentencizer)
+    if key not in pipelines:
+        if sentencizer:
+            disable.append('parser')
+        nlp = spacy.load(name, disable=disable)
+        if sentencizer:
+            nlp.add_pipe(nlp.create_pipe('sentencizer'), first=True)
+        pipelines[key] = nlp
+    return pipelines[key]
+
+
+def worker_pool(workers):
+    """
+    Returns a process pool whose workers each hold an Analyser.
+    The workers run processes.parse, which works whether they are
+    started with fork or spawn.
+    """
+    return processes.pool(workers, initializer=processes.init_parser)
+
+
 class TempWord:
     """
     Temporary container for word data
+    Sentences are ids in the Analyser's sentence table,
+    kept sorted in a compact array without duplicates.
     """
+    __slots__ = ('text', 'sentences', 'frequency')
 
     def __init__(self):
         self.text = None
-        self.sentences = set()
+        self.sentences = array('I')
         self.frequency = 0
 
+    def add_sentence(self, sentence_id):
+        """
+        Adds a sentence id if the word doesn't have it yet.
+        Ids mostly arrive in increasing order, so usually
+        only the last one needs checking, otherwise the array
+        is bisected rather than scanned.
+        """
+        sentences = self.sentences
+        if not sentences or sentences[-1] < sentence_id:
+            sentences.append(sentence_id)
+            return
+        i = bisect_left(sentences, sentence_id)
+        if sentences[i] != sentence_id:
+            sentences.insert(i, sentence_id)
+
+    def add_sentences(self, sentence_ids):
+        """
+        Adds sorted, distinct sentence ids, at once
+        if they all come after the word's last one.
+        """
+        if not sentence_ids:
+            return
+        if not self.sentences or self.sentences[-1] < sentence_ids[0]:
+            self.sentences.extend(sentence_ids)
+            return
+        for sentence_id in sentence_ids:
+            self.add_sentence(sentence_id)
+
 
 class TempDoc:
     """
     Temporary container for document data
+    Sentences map ids in the Analyser's sentence table
+    to the number of times they occur in the document.
     """
+    __slots__ = ('text', 'content_hash', 'sentences', 'word_frequency')
 
     def __init__(self):
         self.text = None
-        self.sentences = set()
+        self.content_hash = ''
+        self.sentences = defaultdict(int)
         self.word_frequency = defaultdict(int)
 
 
@@ -38,22 +178,72 @@ class Analyser:
     Deconstructs documents into words and corresponding sentences.
     Can be run for one document or more, accumulates the results.
     Saves the results to a database.
+    Time spent in each stage and counts of what was processed
+    are collected in self.instrumentation.
+    A compiled TokenFilter can be passed in to share it between Analysers.
     """
 
-    def __init__(self):
-        self.nlp = spacy.load('en_core_web_sm')
+    def __init__(
+            self, nlp=None, cache=False, instrumentation=None,
+            token_filter=None):
+        self._nlp = nlp
+        self._token_filter = token_filter
+        if cache is False:
+            cache = ParseCache.from_settings()
+        self.cache = cache
+        self.instrumentation = instrumentation or Instrumentation()
+        self.clear()
+
+    def clear(self):
+        """
+        Forgets all accumulated results.
+        """
         self.words = defaultdict(TempWord)
         self.document_data = defaultdict(TempDoc)
+        # Each sentence text is stored once and referred to by its index.
+        self.sentences = []
+        self.sentence_ids = {}
+        # TempWords by the StringStore hash of the token's lemma,
+        # so the lemma string is only built once per distinct lemma.
+        self.lemmas = {}
+
+    @property
+    def nlp(self):
+        """
+        The spaCy pipeline, loaded the first time it is needed.
+        """
+        if self._nlp is None:
+            self._nlp = get_nlp()
+        return self._nlp
 
-    def parse_token(self, token):
+    def intern_sentence(self, text):
+        """
+        Returns the id of a sentence text, adding it to the table if new.
+        """
+        sentence_id = self.sentence_ids.get(text)
+        if sentence_id is None:
+            sentence_id = len(self.sentences)
+            self.sentences.append(text)
+            self.sentence_ids[text] = sentence_id
+        return sentence_id
+
+    def sentence_texts(self, sentence_ids):
+        """
+        Returns the set of texts for some sentence ids.
+        """
+        return set(self.sentences[i] for i in sentence_ids)
+
+    def parse_token(self, token, sentence_id=None):
         """
         Creates or modifies a TempWord object from a token.
+        Pass the id of the token's sentence if it is already known.
         """
-        word = token.lemma_.lower()
-        self.words[word].text = word
-        self.words[word].frequency += 1
-        self.words[word].sentences.add(token.sent.text.strip())
-        return self.words[word]
+        temp_word = self.lemma_word(token.lemma)
+        if sentence_id is None:
+            sentence_id = self.intern_sentence(token.sent.text.strip())
+        temp_word.frequency += 1
+        temp_word.add_sentence(sentence_id)
+        return temp_word
 
     def parse_sentence(self, sentence):
         """
@@ -63,8 +253,7 @@ class Analyser:
         words = set(
             self.parse_token(token).text
             for token in doc
-            if token.is_alpha
-            and token.lower_ not in STOP_WORDS
+            if self.token_filter.keep_token(token)
         )
         return words
 
@@ -88,55 +277,571 @@ class Analyser:
         filename = os.path.basename(path)
         return text, filename
 
-    def parse_document(self, path):
+    def file_hash(self, path):
+        """
+        Returns the SHA-256 hex digest of a file's contents.
+        """
+        if not os.path.isabs(path):
+            path = self.absolute_path(path)
+        digest = hashlib.sha256()
+        with open(path, 'rb') as d:
+            for block in iter(lambda: d.read(65536), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def changed_documents(self, paths):
+        """
+        Returns the paths of documents that are new,
+        or whose contents changed since they were saved.
+        """
+        hashes = {}
+        for path in paths:
+            filename = os.path.basename(path)
+            hashes[filename] = self.file_hash(path)
+        saved = set()
+        for names in chunked(hashes):
+            saved.update(
+                Document.objects.filter(
+                    name__in=names
+                ).values_list('name', 'content_hash')
+            )
+        return [
+            path for path in paths
+            if (os.path.basename(path), hashes[os.path.basename(path)])
+            not in saved
+        ]
+
+    def get_document_chunks(self, path, chunk_size=None):
+        """
+        Yields the document text in chunks of about chunk_size characters.
+        Chunks end on paragraph breaks where possible, on sentence ends
+        otherwise, so sentences are not split between them.
+        The file is read in blocks of chunk_size characters and no chunk
+        is longer than chunk_size * 4, even without either.
+        """
+        if chunk_size is None:
+            chunk_size = getattr(settings, 'ANALYSER_CHUNK_SIZE', 100000)
+        if not os.path.isabs(path):
+            path = self.absolute_path(path)
+
+        buffer = ''
+        with open(path, encoding='utf8') as d:
+            while True:
+                block = d.read(chunk_size)
+                buffer += block
+                while len(buffer) >= chunk_size * 4:
+                    end = chunk_end(buffer, chunk_size)
+                    yield buffer[:end]
+                    buffer = buffer[end:]
+                if not block:
+                    break
+        if buffer:
+            yield buffer
+
+    def parse_document(self, path, stream=None):
         """
         Deconstructs a document into TempWord and TempDoc objects.
+        Returns the name of the file.
+        Documents longer than the model's max_length are streamed in chunks,
+        set stream to True or False to choose explicitly.
+        Results found in the parse cache are used without running the model.
+        """
+        if not os.path.isabs(path):
+            path = self.absolute_path(path)
+        instrumentation = self.instrumentation
+        instrumentation.count('documents')
+        if self.cache is None:
+            return self.parse_file(path, stream)
+
+        filename = os.path.basename(path)
+        with instrumentation.stage('hash'):
+            content_hash = self.file_hash(path)
+        mode = parse_mode(stream)
+        with instrumentation.stage('cache'):
+            cached = self.cache.get(content_hash, mode)
+        if cached is None:
+            instrumentation.count('cache_misses')
+            single = Analyser(
+                nlp=self.nlp,
+                cache=None,
+                instrumentation=instrumentation,
+                token_filter=self.token_filter
+            )
+            single.parse_file(path, stream)
+            _, _, sentences, counts, words = single.partial(filename)
+            with instrumentation.stage('cache'):
+                self.cache.set(content_hash, sentences, counts, words, mode)
+        else:
+            instrumentation.count('cache_hits')
+            sentences, counts, words = cached
+        self.merge_partial(
+            (filename, content_hash, sentences, counts, words)
+        )
+        return filename
+
+    def parse_file(self, path, stream=None):
+        """
+        Runs the model over a document, see parse_document.
+        """
+        instrumentation = self.instrumentation
+        filename = os.path.basename(path)
+        if stream is None:
+            stream = os.path.getsize(path) > self.nlp.max_length
+
+        if stream:
+            chunks = instrumentation.timed('read', (
+                (chunk, chunk) for chunk in self.get_document_chunks(path)
+            ))
+            docs = instrumentation.timed(
+                'nlp',
+                self.nlp.pipe(chunks, as_tuples=True, batch_size=1)
+            )
+        else:
+            with instrumentation.stage('read'):
+                text, filename = self.get_document_data(path)
+            with instrumentation.stage('nlp'):
+                docs = [(self.nlp(text), text)]
+        for doc, text in docs:
+            instrumentation.count('characters', len(text))
+            instrumentation.count('tokens', len(doc))
+            with instrumentation.stage('accumulate'):
+                self.parse_doc(doc, filename, text)
+        with instrumentation.stage('hash'):
+            self.document_data[filename].content_hash = self.file_hash(path)
+        return filename
+
+    def lemma_word(self, lemma):
+        """
+        Returns the TempWord for a lemma's StringStore hash.
+        """
+        temp_word = self.lemmas.get(lemma)
+        if temp_word is None:
+            word = self.nlp.vocab.strings[lemma].lower()
+            temp_word = self.words[word]
+            temp_word.text = word
+            self.lemmas[lemma] = temp_word
+        return temp_word
+
+    @property
+    def token_filter(self):
+        """
+        The filter for the tokens counted as words,
+        compiled from settings the first time it is needed.
+        """
+        if self._token_filter is None:
+            self._token_filter = filters.TokenFilter(self.nlp.vocab.strings)
+        return self._token_filter
+
+    def parse_doc(self, doc, filename, text=None):
+        """
+        Adds the tokens of a parsed spaCy Doc to the document's data.
+        Pass the text the Doc was made from to save rebuilding it.
+        Token attributes are read into arrays with Doc.to_array,
+        filtering and counting are done with numpy,
+        so Python only loops over distinct lemmas and sentences.
         """
-        text, filename = self.get_document_data(path)
-        doc = self.nlp(text)
         temp_doc = self.document_data[filename]
+        if not len(doc):
+            return
+        token_filter = self.token_filter
+        attributes = [LEMMA, LOWER, IS_ALPHA, SENT_START, LENGTH, SPACY]
+        if token_filter.pos is not None:
+            attributes.append(POS)
+        columns = doc.to_array(attributes).T
+        lemmas, lowers, alpha, sent_starts = columns[:4]
+        lengths = columns[4].astype(numpy.int64)
+        spaces = columns[5].astype(numpy.int64)
+
+        # Sentence index of each token, counting sentence starts.
+        starts = sent_starts == 1
+        starts[0] = True
+        sent_index = numpy.cumsum(starts) - 1
+        first = numpy.flatnonzero(starts)
+        self.instrumentation.count('sentences', len(first))
+        last = numpy.append(first[1:] - 1, len(doc) - 1)
+        # The text is each token followed by its whitespace,
+        # so character offsets are running sums of their lengths.
+        offsets = numpy.cumsum(lengths + spaces) - lengths - spaces
+        begins = offsets[first]
+        ends = offsets[last] + lengths[last]
+
+        keep = token_filter.keep(
+            lemmas, lowers, alpha, columns[6] if len(columns) > 6 else None
+        )
+        if not keep.any():
+            return
+        lemmas = lemmas[keep]
+        sent_index = sent_index[keep]
+
+        # Intern the sentences that have words, in document order.
+        used = numpy.unique(sent_index)
+        sentence_ids = numpy.zeros(len(first), dtype=numpy.int64)
+        if text is None:
+            text = doc.text
+        for i, begin, end in zip(
+            used.tolist(),
+            begins[used].tolist(),
+            ends[used].tolist()
+        ):
+            sentence_id = self.intern_sentence(text[begin:end].strip())
+            sentence_ids[i] = sentence_id
+            temp_doc.sentences[sentence_id] += 1
+
+        unique_lemmas, lemma_index = numpy.unique(lemmas, return_inverse=True)
+        counts = numpy.bincount(lemma_index)
+        temp_words = [
+            self.lemma_word(lemma) for lemma in unique_lemmas.tolist()
+        ]
+        for temp_word, count in zip(temp_words, counts.tolist()):
+            temp_word.frequency += count
+            temp_doc.word_frequency[temp_word.text] += count
+
+        # Distinct (lemma, sentence id) pairs, sorted by lemma then sentence.
+        width = int(sentence_ids.max()) + 1
+        pairs = numpy.unique(lemma_index * width + sentence_ids[sent_index])
+        pair_lemmas = pairs // width
+        pair_sentences = (pairs % width).tolist()
+        bounds = (numpy.flatnonzero(numpy.diff(pair_lemmas)) + 1).tolist()
+        group_lemmas = pair_lemmas[[0] + bounds].tolist()
+        for lemma, start, end in zip(
+            group_lemmas,
+            [0] + bounds,
+            bounds + [len(pair_sentences)]
+        ):
+            temp_words[lemma].add_sentences(pair_sentences[start:end])
+
+    def parse_documents(
+            self, paths, workers=1, batch_size=1, stream=None, pool=None):
+        """
+        Parses several documents, in worker processes if workers > 1.
+        A pool from worker_pool can be passed in to reuse its workers.
+        Yields each path once its results are merged in.
+        """
+        if pool is None and workers <= 1:
+            for path in paths:
+                self.parse_document(path, stream=stream)
+                yield path
+            return
+        if pool is None:
+            with worker_pool(workers) as pool:
+                yield from self.parse_documents(
+                    paths,
+                    batch_size=batch_size,
+                    stream=stream,
+                    pool=pool
+                )
+            return
 
-        for token in doc:
-            if token.is_alpha and token.lower_ not in STOP_WORDS:
-                temp_word = self.parse_token(token)
-                temp_doc.sentences.add(token.sent.text.strip())
-                temp_doc.word_frequency[temp_word.text] += 1
+        partials = pool.map(
+            functools.partial(processes.parse, stream=stream),
+            paths,
+            chunksize=batch_size
+        )
+        for path, (result, report) in zip(paths, partials):
+            self.instrumentation.merge(report)
+            self.merge_partial(result)
+            yield path
 
-    def save_data(self):
+    def partial(self, filename):
+        """
+        Returns the results for one document as (filename, content_hash,
+        sentences, sentence counts, {word: (frequency, sentence ids)}),
+        where the ids are indexes into the sentences list.
+        Only valid while the analyser holds that single document.
+        """
+        data = self.document_data[filename]
+        counts = [data.sentences[i] for i in range(len(self.sentences))]
+        words = {
+            text: (frequency, self.words[text].sentences)
+            for text, frequency in data.word_frequency.items()
+        }
+        return filename, data.content_hash, self.sentences, counts, words
+
+    def merge_partial(self, partial):
+        """
+        Adds the results of a partial to TempWord and TempDoc objects.
+        """
+        with self.instrumentation.stage('merge'):
+            filename, content_hash, sentences, counts, words = partial
+            sentence_ids = [self.intern_sentence(text) for text in sentences]
+            temp_doc = self.document_data[filename]
+            temp_doc.content_hash = content_hash
+            for sentence_id, count in zip(sentence_ids, counts):
+                temp_doc.sentences[sentence_id] += count
+            for text, (frequency, word_sentences) in words.items():
+                temp_word = self.words[text]
+                temp_word.text = text
+                temp_word.frequency += frequency
+                temp_word.add_sentences(
+                    sorted(sentence_ids[i] for i in word_sentences)
+                )
+                temp_doc.word_frequency[text] += frequency
+
+    def save_data(self, shards=1, pool=None):
         """
         Writes TempWord and TempDoc objects to a db.
+        Everything is written in batches inside one transaction,
+        text to id maps are kept in memory so nothing is looked up twice.
+        Documents saved before under the same name are replaced.
+        With more than one shard on SQLite, the rows are first staged
+        in parallel, one file per shard, then merged with set-based
+        statements, so the transaction is much shorter.
         """
-        #  create and assign senteces to words:
-        for text, word in self.words.items():
-            word_record, created = Word.objects.get_or_create(
-                text=text
-            )
-            if created:
-                word_record.total_frequency = word.frequency
+        self.check_words()
+        stage = self.instrumentation.stage
+        shards = shards if shards > 1 and staging.is_supported() else 1
+        with ExitStack() as stack:
+            schemas = None
+            if shards > 1:
+                directory = stack.enter_context(staging.staging_directory())
+                with stage('save:stage'):
+                    paths = staging.stage(self, directory, shards, pool)
+                schemas = stack.enter_context(staging.attached(paths))
+            stack.enter_context(self.instrumentation.database())
+            stack.enter_context(transaction.atomic())
+
+            with stage('save:remove'):
+                self.remove_documents(self.document_data)
+            last_word_id = Word.objects.aggregate(id=Max('id'))['id'] or 0
+            last_sentence_id = \
+                Sentence.objects.aggregate(id=Max('id'))['id'] or 0
+            if schemas is not None:
+                with stage('save:merge'):
+                    staging.merge(schemas, staging.create_documents(self))
             else:
-                word_record.total_frequency += word.frequency
-            word_record.save()
-            for sentence_text in word.sentences:
-                s, _ = Sentence.objects.get_or_create(
-                    text=sentence_text
+                with stage('save:words'):
+                    word_ids = self.save_words()
+                with stage('save:sentences'):
+                    sentence_ids = self.save_sentences()
+                with stage('save:sentence_words'):
+                    self.save_sentence_words(word_ids, sentence_ids)
+                with stage('save:documents'):
+                    self.save_documents(word_ids, sentence_ids)
+            with stage('save:stats'):
+                self.save_corpus_stats()
+            with stage('save:index'):
+                if search.is_enabled():
+                    search.index(Word.objects.filter(id__gt=last_word_id))
+                    search.index(
+                        Sentence.objects.filter(id__gt=last_sentence_id)
+                    )
+
+    def check_words(self):
+        """
+        Raises ValueError if a word is too long for Word.text,
+        e.g. results parsed with a longer TOKEN_MAX_LENGTH.
+        """
+        max_length = Word._meta.get_field('text').max_length
+        too_long = [text for text in self.words if len(text) > max_length]
+        if too_long:
+            raise ValueError('Words longer than {} characters: {}'.format(
+                max_length, ', '.join(too_long[:5])
+            ))
+
+    def remove_documents(self, names):
+        """
+        Removes saved documents with the given names,
+        subtracting what they added to word frequencies and corpus totals.
+        Words and sentences left without a document are deleted,
+        sentences still in other documents are kept.
+        """
+        documents = []
+        for chunk in chunked(names):
+            documents.extend(Document.objects.filter(name__in=chunk))
+        if not documents:
+            return
+        search_enabled = search.is_enabled()
+
+        frequencies = defaultdict(int)
+        document_frequency = defaultdict(int)
+        for chunk in chunked(documents):
+            rows = DocumentWord.objects.filter(
+                document__in=chunk
+            ).values_list('word_id', 'frequency')
+            for word_id, frequency in rows:
+                frequencies[word_id] += frequency
+                document_frequency[word_id] += 1
+        for word_ids in chunked(frequencies):
+            self.add_word_frequencies(
+                (
+                    -frequencies[word_id],
+                    -document_frequency[word_id],
+                    word_id
+                )
+                for word_id in word_ids
+            )
+            unused = Word.objects.filter(
+                id__in=word_ids,
+                total_frequency__lte=0
+            )
+            if search_enabled:
+                search.unindex(unused)
+            unused.delete()
+
+        sentence_ids = set()
+        for chunk in chunked(documents):
+            sentence_ids.update(
+                SentenceOccurrence.objects.filter(
+                    document__in=chunk
+                ).values_list('sentence_id', flat=True)
+            )
+            Document.objects.filter(id__in=[d.id for d in chunk]).delete()
+        for chunk in chunked(sentence_ids):
+            unused = Sentence.objects.filter(
+                id__in=chunk,
+                occurrences__isnull=True
+            )
+            if search_enabled:
+                search.unindex(unused)
+            Sentence.objects.filter(
+                id__in=unused.values('id')
+            ).delete()
+
+        CorpusStats.objects.filter(pk=CorpusStats.PK).update(
+            documents=F('documents') - len(documents),
+            tokens=F('tokens') - sum(d.token_count for d in documents),
+            words=Word.objects.count(),
+            sentences=Sentence.objects.count()
+        )
+
+    def save_words(self):
+        """
+        Creates missing Word records and adds to the frequency
+        and document frequency of all of them.
+        Frequencies are incremented in place,
+        so concurrent saves don't overwrite each other.
+        Returns a dict of word text to id.
+        """
+        document_frequency = defaultdict(int)
+        for data in self.document_data.values():
+            for text in data.word_frequency:
+                document_frequency[text] += 1
+
+        word_ids = {}
+        for texts in chunked(self.words):
+            Word.objects.bulk_create(
+                [Word(text=text) for text in texts],
+                ignore_conflicts=True
+            )
+            ids = Word.objects.filter(text__in=texts).values_list('text', 'id')
+            word_ids.update(ids)
+            self.add_word_frequencies(
+                (
+                    self.words[text].frequency,
+                    document_frequency[text],
+                    word_ids[text]
                 )
-                s.words.add(word_record)
+                for text in texts
+            )
+        return word_ids
+
+    def add_word_frequencies(self, rows):
+        """
+        Adds (frequency, document frequency, word id) rows to Word records
+        with one executemany, rather than bulk_update, whose CASE WHEN
+        expressions are slow to build for thousands of words.
+        """
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'UPDATE {} SET total_frequency = total_frequency + %s, '
+                'document_frequency = document_frequency + %s '
+                'WHERE id = %s'.format(Word._meta.db_table),
+                list(rows)
+            )
+
+    def save_sentences(self):
+        """
+        Creates the Sentence records that don't exist yet.
+        Sentences are looked up by the hash of their text.
+        Returns a list of record ids, indexed by sentence id.
+        """
+        sentence_ids = []
+        for chunk in chunked(self.sentences):
+            hashes = [Sentence.hash_text(text) for text in chunk]
+            Sentence.objects.bulk_create(
+                [
+                    Sentence(text=text, text_hash=text_hash)
+                    for text, text_hash in zip(chunk, hashes)
+                ],
+                ignore_conflicts=True
+            )
+            ids = dict(
+                Sentence.objects.filter(
+                    text_hash__in=hashes
+                ).values_list('text_hash', 'id')
+            )
+            sentence_ids.extend(ids[text_hash] for text_hash in hashes)
+        return sentence_ids
+
+    def save_sentence_words(self, word_ids, sentence_ids):
+        """
+        Links sentences to words through the Sentence.words table.
+        """
+        SentenceWord = Sentence.words.through
+        rows = (
+            SentenceWord(
+                sentence_id=sentence_ids[sentence],
+                word_id=word_ids[text]
+            )
+            for text, word in self.words.items()
+            for sentence in word.sentences
+        )
+        for chunk in chunked(rows):
+            SentenceWord.objects.bulk_create(chunk, ignore_conflicts=True)
 
-        #  assign sentences and words to documents:
+    def save_documents(self, word_ids, sentence_ids):
+        """
+        Creates Document records, records which sentences occur in them
+        and writes the DocumentWord frequencies.
+        """
         for document_name, data in self.document_data.items():
             d = Document.objects.create(
-                name=document_name
+                name=document_name,
+                content_hash=data.content_hash,
+                word_count=len(data.word_frequency),
+                token_count=sum(data.word_frequency.values()),
+                sentence_count=len(data.sentences)
             )
-            for sentence in data.sentences:
-                s = Sentence.objects.get(
-                    text=sentence
+            occurrences = (
+                SentenceOccurrence(
+                    document=d,
+                    sentence_id=sentence_ids[sentence],
+                    count=count
                 )
-                s.document = d
-                s.save()
-            for word, frequency in data.word_frequency.items():
-                w = Word.objects.get(text=word)
-                dw = DocumentWord.objects.create(
-                    word=w,
+                for sentence, count in data.sentences.items()
+            )
+            for chunk in chunked(occurrences):
+                SentenceOccurrence.objects.bulk_create(chunk)
+            rows = (
+                DocumentWord(
+                    word_id=word_ids[word],
                     document=d,
                     frequency=frequency
                 )
+                for word, frequency in data.word_frequency.items()
+            )
+            for chunk in chunked(rows):
+                DocumentWord.objects.bulk_create(chunk)
+
+    def save_corpus_stats(self):
+        """
+        Updates the corpus-wide totals in place.
+        Word and sentence totals are recounted, since saved words
+        and sentences may already have existed.
+        The corpus version is bumped, and published to the cache
+        once the data is committed.
+        """
+        CorpusStats.objects.get_or_create(pk=CorpusStats.PK)
+        stats = CorpusStats.objects.filter(pk=CorpusStats.PK)
+        stats.update(
+            documents=F('documents') + len(self.document_data),
+            tokens=F('tokens') + sum(
+                sum(data.word_frequency.values())
+                for data in self.document_data.values()
+            ),
+            words=Word.objects.count(),
+            sentences=Sentence.objects.count(),
+            version=F('version') + 1
+        )
+        version = stats.values_list('version', flat=True).get()
+        transaction.on_commit(lambda: caching.set_corpus_version(version))
@@ -0,0 +1,206 @@
+import abc
+from django.http import Http404, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.generic.list import ListView
+from .caching import versioned
+from . import tfidf
+from .models import CorpusStats, Document, Sentence, Word
+from .views import (
+    KeysetPaginationMixin,
+    WordListView,
+    DocumentListView,
+    DocumentWordListView,
+    document_keywords,
+    related_words,
+)
+
+
+class JsonListMixin(abc.ABC):
+    """
+    Renders a ListView as JSON instead of a template.
+    Page size is set with ?limit=, up to max_limit.
+    Pass next as ?after= to get the following page.
+    Responses are cached like the HTML views they extend.
+    Subclasses must define serialize.
+    """
+    paginate_by = 50
+    max_limit = 500
+
+    def get_paginate_by(self, queryset):
+        try:
+            limit = int(self.request.GET.get('limit', self.paginate_by))
+        except ValueError:
+            return self.paginate_by
+        return max(1, min(limit, self.max_limit))
+
+    @abc.abstractmethod
+    def serialize(self, obj):
+        """
+        Returns the JSON data of an object of the list.
+        """
+
+    def get_data(self, context):
+        return {
+            'results': [self.serialize(o) for o in context['object_list']],
+            'next': context.get('next_cursor'),
+        }
+
+    def render_to_response(self, context, **kwargs):
+        return JsonResponse(self.get_data(context))
+
+
+def word_data(word):
+    return {
+        'id': word.id,
+        'text': word.text,
+        'total_frequency': word.total_frequency,
+        'document_frequency': word.document_frequency,
+    }
+
+
+class WordApiView(JsonListMixin, WordListView):
+    """
+    All words, sorted like WordListView.
+    """
+
+    def get_queryset(self):
+        return self.model.objects.order_by(*self.get_ordering())
+
+    def serialize(self, word):
+        return word_data(word)
+
+
+class DocumentApiView(JsonListMixin, DocumentListView):
+    """
+    All documents with their totals, and the corpus totals.
+    """
+
+    def get_paginate_by(self, queryset):
+        return None
+
+    def serialize(self, document):
+        return {
+            'id': document.id,
+            'name': document.name,
+            'word_count': document.word_count,
+            'token_count': document.token_count,
+            'sentence_count': document.sentence_count,
+        }
+
+    def get_data(self, context):
+        data = super().get_data(context)
+        corpus = context['corpus'] or CorpusStats()
+        data['corpus'] = {
+            'documents': corpus.documents,
+            'words': corpus.words,
+            'tokens': corpus.tokens,
+            'sentences': corpus.sentences,
+            'version': corpus.version,
+        }
+        return data
+
+
+class DocumentWordApiView(JsonListMixin, DocumentWordListView):
+    """
+    The words of a document with their frequency in it,
+    sorted like DocumentWordListView.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().prefetch_related(None)
+
+    def serialize(self, document_word):
+        data = word_data(document_word.word)
+        data['frequency'] = document_word.frequency
+        return data
+
+
+@method_decorator(versioned, name='dispatch')
+class SentenceApiView(JsonListMixin, KeysetPaginationMixin, ListView):
+    """
+    Sentences in id order, filtered with ?word=<id> and ?document=<id>.
+    """
+    model = Sentence
+    sort_options = {'id': 'id'}
+    default_sort = 'id'
+
+    def get_queryset(self):
+        sentences = Sentence.objects.order_by('id')
+        for field in ('word', 'document'):
+            value = self.request.GET.get(field)
+            if value is None:
+                continue
+            try:
+                value = int(value)
+            except ValueError:
+                return sentences.none()
+            sentences = sentences.filter(**{field + 's': value})
+        return sentences
+
+    def serialize(self, sentence):
+        return {'id': sentence.id, 'text': sentence.text}
+
+
+@versioned
+def related_words_api(request, word_id):
+    """
+    The words most associated with a word, best first.
+    """
+    associations = related_words(word_id)
+    if not associations and not Word.objects.filter(id=word_id).exists():
+        raise Http404('No such word')
+    return JsonResponse({
+        'word': word_id,
+        'results': [
+            {
+                'id': a.other.id,
+                'text': a.other.text,
+                'sentence_count': a.sentence_count,
+                'document_count': a.document_count,
+                'pmi': a.pmi,
+            }
+            for a in associations
+        ],
+    })
+
+
+@versioned
+def document_keywords_api(request, doc_id):
+    """
+    The most distinctive words of a document by TF-IDF, best first.
+    """
+    keywords = document_keywords(doc_id)
+    if not keywords and not Document.objects.filter(id=doc_id).exists():
+        raise Http404('No such document')
+    return JsonResponse({
+        'document': doc_id,
+        'results': [
+            {
+                'id': k.word.id,
+                'text': k.word.text,
+                'score': k.score,
+            }
+            for k in keywords
+        ],
+    })
+
+
+@versioned
+def similar_documents_api(request, doc_id):
+    """
+    The documents most similar to a document by cosine similarity
+    of their TF-IDF vectors, best first.
+    """
+    if not Document.objects.filter(id=doc_id).exists():
+        raise Http404('No such document')
+    return JsonResponse({
+        'document': doc_id,
+        'results': [
+            {
+                'id': document.id,
+                'name': document.name,
+                'similarity': similarity,
+            }
+            for document, similarity in tfidf.similar_documents(doc_id)
+        ],
+    })
@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class WordSentencesConfig(AppConfig):
     name = 'word_sentences'
+
+    def ready(self):
+        from .database import configure_connection
+        from .search import create_tables, forget_tables
+        connection_created.connect(configure_connection)
+        connection_created.connect(forget_tables)
+        post_migrate.connect(create_tables, sender=self)
@@ -0,0 +1,121 @@
+import os
+import random
+import time
+import tracemalloc
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+# Metrics where a higher value in a later run is a regression.
+COMPARED_METRICS = ('seconds', 'queries', 'peak_memory')
+
+
+def sample_paths():
+    """
+    Returns the paths of the sample documents the corpus is made from.
+    """
+    directories = [
+        os.path.join(
+            settings.BASE_DIR, 'document_analysis', 'eigen_test_docs'
+        ),
+        os.path.join(os.path.dirname(__file__), 'test_docs'),
+    ]
+    return sorted(
+        os.path.join(directory, name)
+        for directory in directories
+        for name in os.listdir(directory)
+    )
+
+
+def sample_paragraphs():
+    paragraphs = []
+    for path in sample_paths():
+        with open(path, encoding='utf8') as d:
+            text = d.read()
+        paragraphs.extend(p.strip() for p in text.split('\n\n') if p.strip())
+    return paragraphs
+
+
+def generate_corpus(directory, documents=10, size=20000, seed=0):
+    """
+    Writes documents of about size characters into directory,
+    made of paragraphs drawn at random from the sample documents.
+    The same seed always gives the same corpus.
+    Returns the paths written.
+    """
+    paragraphs = sample_paragraphs()
+    rng = random.Random(seed)
+    paths = []
+    for i in range(documents):
+        parts = []
+        length = 0
+        while length < size:
+            paragraph = rng.choice(paragraphs)
+            parts.append(paragraph)
+            length += len(paragraph) + 2
+        path = os.path.join(directory, 'bench{}.txt'.format(i))
+        with open(path, 'w', encoding='utf8') as d:
+            d.write('\n\n'.join(parts) + '\n')
+        paths.append(path)
+    return paths
+
+
+class Measurement:
+    """
+    Times a block of code and records the queries it issues.
+    With trace_memory the peak memory allocated by Python while it runs
+    is recorded instead. Tracing slows the code down a lot, so memory
+    is measured in a separate run from the one that is timed.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.peak_memory = None
+
+    def __enter__(self):
+        self.queries = CaptureQueriesContext(connection)
+        self.queries.__enter__()
+        if self.trace_memory:
+            tracemalloc.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.start
+        if self.trace_memory:
+            _, self.peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        self.queries.__exit__(*exc_info)
+
+    def result(self, memory=None, **extra):
+        """
+        Returns the time and queries of the run, and the peak memory
+        of memory, the traced run of the same code.
+        """
+        result = {
+            'seconds': round(self.seconds, 6),
+            'queries': len(self.queries),
+            'peak_memory': memory.peak_memory if memory else None,
+        }
+        result.update(extra)
+        return result
+
+
+def compare(old, new, threshold=0.2):
+    """
+    Returns (operation, metric, old value, new value) for every
+    compared metric that grew by more than threshold between two runs.
+    """
+    regressions = []
+    for operation, result in new['results'].items():
+        previous = old['results'].get(operation)
+        if previous is None:
+            continue
+        for metric in COMPARED_METRICS:
+            before = previous.get(metric)
+            after = result.get(metric)
+            if before is None or after is None:
+                continue
+            if after > before * (1 + threshold):
+                regressions.append((operation, metric, before, after))
+    return regressions
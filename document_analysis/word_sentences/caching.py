@@ -0,0 +1,88 @@
+import functools
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils.cache import get_conditional_response, patch_cache_control
+from .database import reading_replica, replica_content
+from .models import CorpusStats
+
+VERSION_KEY = 'corpus-version'
+# The cached version expires so a missed update can't outlive it.
+VERSION_TIMEOUT = 60
+
+
+def corpus_version():
+    """
+    Returns the corpus version, from the cache once it has been read.
+    The version read from the database is only cached if no newer one
+    was published meanwhile, so a slow reader can't hide it.
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = CorpusStats.objects.filter(
+            pk=CorpusStats.PK
+        ).values_list('version', flat=True).first() or 0
+        if not cache.add(VERSION_KEY, version, VERSION_TIMEOUT):
+            version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def set_corpus_version(version):
+    cache.set(VERSION_KEY, version, VERSION_TIMEOUT)
+
+
+def bump_corpus_version():
+    """
+    Moves the corpus to a new version, for changes made outside save_data.
+    Returns the new version.
+    """
+    with transaction.atomic():
+        CorpusStats.objects.get_or_create(pk=CorpusStats.PK)
+        stats = CorpusStats.objects.filter(pk=CorpusStats.PK)
+        stats.update(version=F('version') + 1)
+        version = stats.values_list('version', flat=True).get()
+        transaction.on_commit(lambda: set_corpus_version(version))
+    return version
+
+
+def versioned(view):
+    """
+    Caches a read-only view's responses for the current corpus version.
+    Each response gets a strong ETag made from the version and the url,
+    and clients are told to revalidate with If-None-Match for a 304.
+    Repeat requests are answered from the cache without database queries,
+    until the next ingestion bumps the version.
+    Streaming responses get the ETag but are not cached.
+    The view only reads, so its queries go to the read replica
+    if one is configured.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        key = '{}:{}'.format(corpus_version(), request.get_full_path())
+        etag = '"{}"'.format(hashlib.md5(key.encode('utf8')).hexdigest())
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            return response
+
+        cache_key = 'view:{}'.format(etag)
+        response = cache.get(cache_key)
+        if response is None:
+            with reading_replica():
+                response = view(request, *args, **kwargs)
+                if hasattr(response, 'render'):
+                    response.render()
+            replica_content(response)
+            if response.status_code == 200 and not response.streaming:
+                cache.set(
+                    cache_key,
+                    response,
+                    getattr(settings, 'VIEW_CACHE_TIMEOUT', 3600)
+                )
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        return response
+    return wrapper
@@ -0,0 +1,154 @@
+import numpy
+from array import array
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from scipy import sparse
+from .analyser import BATCH_SIZE
+from .models import (
+    Word,
+    Sentence,
+    DocumentWord,
+    SentenceOccurrence,
+    WordAssociation,
+)
+
+
+def id_columns(queryset, fields):
+    """
+    Reads integer columns of a queryset into numpy arrays, one per field.
+    """
+    columns = [array('q') for _ in fields]
+    for row in queryset.values_list(*fields).iterator(chunk_size=10000):
+        for column, value in zip(columns, row):
+            column.append(value)
+    return tuple(numpy.array(column, dtype=numpy.int64) for column in columns)
+
+
+def incidence(row_ids, word_ids, words):
+    """
+    Returns the binary matrix of which words are in which rows,
+    and the distinct row ids in the order of its rows.
+    """
+    rows, row_index = numpy.unique(row_ids, return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (
+            numpy.ones(len(row_index)),
+            (row_index, numpy.searchsorted(words, word_ids))
+        ),
+        shape=(len(rows), len(words))
+    )
+    return matrix, rows
+
+
+def sentence_weights(sentences):
+    """
+    Returns how many times each sentence occurs across all documents.
+    """
+    ids, totals = id_columns(
+        SentenceOccurrence.objects.values('sentence_id').annotate(
+            total=Sum('count')
+        ).order_by(),
+        ('sentence_id', 'total')
+    )
+    weights = numpy.ones(len(sentences))
+    index = numpy.searchsorted(sentences, ids)
+    found = index < len(sentences)
+    found[found] = sentences[index[found]] == ids[found]
+    weights[index[found]] = totals[found]
+    return weights
+
+
+def top_k(rows, scores, counts, k):
+    """
+    Returns the positions of the k best pairs of each row,
+    by score and then count.
+    """
+    order = numpy.lexsort((-counts, -scores, rows))
+    sorted_rows = rows[order]
+    rank = numpy.arange(len(order)) - numpy.searchsorted(
+        sorted_rows, sorted_rows
+    )
+    return order[rank < k]
+
+
+def build(top=None, min_count=None):
+    """
+    Recomputes the word associations of the whole corpus.
+    Words co-occur when they are in the same sentence,
+    counted once per occurrence of the sentence in a document.
+    Pairs seen in fewer than min_count sentences are skipped,
+    the top pairs of each word by PMI are stored.
+    Returns the number of associations stored.
+    """
+    if top is None:
+        top = getattr(settings, 'ASSOCIATION_TOP_K', 20)
+    if min_count is None:
+        min_count = getattr(settings, 'ASSOCIATION_MIN_COUNT', 2)
+
+    words = numpy.array(
+        Word.objects.order_by('id').values_list('id', flat=True),
+        dtype=numpy.int64
+    )
+    associations = []
+    if len(words):
+        sentence_ids, word_ids = id_columns(
+            Sentence.words.through.objects.all(),
+            ('sentence_id', 'word_id')
+        )
+        sentences_words, sentences = incidence(sentence_ids, word_ids, words)
+        weights = sentence_weights(sentences)
+        cooccurrence = (
+            sentences_words.T @ sparse.diags(weights) @ sentences_words
+        ).tocoo()
+        word_counts = cooccurrence.diagonal()
+        total = weights.sum()
+
+        rows = cooccurrence.row
+        cols = cooccurrence.col
+        counts = cooccurrence.data
+        keep = (rows != cols) & (counts >= min_count)
+        rows, cols, counts = rows[keep], cols[keep], counts[keep]
+        pmi = numpy.log(
+            counts * total / (word_counts[rows] * word_counts[cols])
+        )
+        best = top_k(rows, pmi, counts, top)
+        rows, cols = rows[best], cols[best]
+        counts, pmi = counts[best], pmi[best]
+
+        # Documents with both words, only for the pairs kept:
+        # the full word x word product over documents would be dense.
+        document_ids, word_ids = id_columns(
+            DocumentWord.objects.all(),
+            ('document_id', 'word_id')
+        )
+        documents_words, _ = incidence(document_ids, word_ids, words)
+        words_documents = documents_words.T.tocsr()
+        document_counts = numpy.asarray(
+            words_documents[rows].multiply(words_documents[cols]).sum(axis=1)
+        ).ravel()
+
+        associations = [
+            WordAssociation(
+                word_id=word_id,
+                other_id=other_id,
+                sentence_count=count,
+                document_count=document_count,
+                pmi=score
+            )
+            for word_id, other_id, count, document_count, score in zip(
+                words[rows].tolist(),
+                words[cols].tolist(),
+                counts.astype(numpy.int64).tolist(),
+                document_counts.astype(numpy.int64).tolist(),
+                pmi.tolist()
+            )
+        ]
+
+    with transaction.atomic():
+        WordAssociation.objects.all().delete()
+        WordAssociation.objects.bulk_create(
+            associations,
+            batch_size=BATCH_SIZE
+        )
+    return len(associations)
@@ -0,0 +1,87 @@
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import FileResponse
+
+# Alias of the read-only connection read views use, if configured.
+REPLICA = 'replica'
+
+state = threading.local()
+
+
+def configure_connection(sender, connection, **kwargs):
+    """
+    Applies SQLITE_PRAGMAS to every new SQLite connection.
+    The replica connection is also made read-only.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = dict(getattr(settings, 'SQLITE_PRAGMAS', {}))
+    if connection.alias == REPLICA:
+        pragmas['query_only'] = 'on'
+    for name, value in pragmas.items():
+        connection.connection.execute('PRAGMA {} = {}'.format(name, value))
+
+
+def replica_enabled():
+    return REPLICA in connections.databases
+
+
+@contextmanager
+def reading_replica():
+    """
+    Sends the reads made in the block to the replica, if configured.
+    """
+    previous = getattr(state, 'replica', False)
+    state.replica = True
+    try:
+        yield
+    finally:
+        state.replica = previous
+
+
+def replica_content(response):
+    """
+    Keeps reading from the replica while a streaming response
+    is iterated, after the view has returned.
+    Files are left alone so they can still be sent by the server.
+    """
+    if not response.streaming or isinstance(response, FileResponse):
+        return response
+    content = iter(response.streaming_content)
+
+    def iterate():
+        while True:
+            with reading_replica():
+                try:
+                    part = next(content)
+                except StopIteration:
+                    return
+            yield part
+
+    response.streaming_content = iterate()
+    return response
+
+
+class ReadReplicaRouter:
+    """
+    Routes reads made in reading_replica() to the replica connection,
+    everything else goes to the default database.
+    Reads elsewhere, e.g. during ingestion, must see the writes
+    of their own transaction, so they stay on the default connection.
+    """
+
+    def db_for_read(self, model, **hints):
+        if getattr(state, 'replica', False) and replica_enabled():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
@@ -0,0 +1,219 @@
+import csv
+import gzip
+import io
+import json
+import numpy
+import os
+import shutil
+from django.conf import settings
+from django.db.models import Prefetch
+from .cooccurrence import id_columns
+from .models import Word, Document, DocumentWord, Sentence
+
+# Extension and content type of each export format.
+FORMATS = {
+    'txt': 'text/plain',
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'npz': 'application/octet-stream',
+}
+
+
+def iterate_in_chunks(queryset, chunk_size=500):
+    """
+    Yields the objects of a queryset in pk order, one query per chunk.
+    Unlike QuerySet.iterator(), prefetch_related still applies.
+    """
+    last_pk = 0
+    while True:
+        chunk = list(
+            queryset.filter(pk__gt=last_pk).order_by('pk')[:chunk_size]
+        )
+        if not chunk:
+            return
+        yield from chunk
+        last_pk = chunk[-1].pk
+
+
+def word_prefetches():
+    """
+    Prefetches the documents and sentences of words in id order,
+    so the text is the same on every run and every database.
+    """
+    return (
+        Prefetch('document_set', queryset=Document.objects.order_by('id')),
+        Prefetch('sentence_set', queryset=Sentence.objects.order_by('id')),
+    )
+
+
+def all_word_data():
+    """
+    Yields the download text for all words, one word at a time.
+    """
+    yield 'All word data:\n\n'
+    words = Word.objects.prefetch_related(*word_prefetches())
+    for w in iterate_in_chunks(words):
+        out = w.text + '\n'
+        out += '\tFrequency: ' + str(w.total_frequency) + '\n'
+        out += '\t' + w.documents() + '\n'
+        out += '\tSentences:\n'
+        for s in w.sentence_set.all():
+            out += '\t\t' + s.text.strip() + '\n'
+        out += '\n'
+        yield out
+
+
+def csv_rows():
+    """
+    Yields the CSV export, a row per word and document it occurs in.
+    """
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['word', 'document', 'frequency'])
+    rows = DocumentWord.objects.values_list(
+        'word__text', 'document__name', 'frequency'
+    ).order_by('word_id', 'document_id')
+    for row in rows.iterator(chunk_size=2000):
+        writer.writerow(row)
+        if out.tell() > 65536:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue()
+
+
+def json_lines():
+    """
+    Yields the JSON Lines export, a line per word with all its data.
+    """
+    words = Word.objects.prefetch_related(*word_prefetches())
+    for w in iterate_in_chunks(words):
+        yield json.dumps({
+            'word': w.text,
+            'total_frequency': w.total_frequency,
+            'document_frequency': w.document_frequency,
+            'documents': [d.name for d in w.document_set.all()],
+            'sentences': [s.text.strip() for s in w.sentence_set.all()],
+        }) + '\n'
+
+
+def write_matrix(f):
+    """
+    Writes the word x document frequency matrix as compressed NumPy arrays.
+    The matrix is sparse, so it is stored as coordinate columns:
+    frequency[i] is the count of words[word_index[i]]
+    in documents[document_index[i]].
+    """
+    words = list(Word.objects.order_by('id').values_list('id', 'text'))
+    documents = list(
+        Document.objects.order_by('id').values_list('id', 'name')
+    )
+    word_ids = numpy.array([i for i, _ in words], dtype=numpy.int64)
+    document_ids = numpy.array([i for i, _ in documents], dtype=numpy.int64)
+    pair_words, pair_documents, frequency = id_columns(
+        DocumentWord.objects.all(),
+        ['word_id', 'document_id', 'frequency']
+    )
+    numpy.savez_compressed(
+        f,
+        words=numpy.array([text for _, text in words], dtype=str),
+        documents=numpy.array([name for _, name in documents], dtype=str),
+        word_index=numpy.searchsorted(word_ids, pair_words).astype(
+            numpy.uint32
+        ),
+        document_index=numpy.searchsorted(
+            document_ids, pair_documents
+        ).astype(numpy.uint32),
+        frequency=frequency.astype(numpy.uint32),
+    )
+
+
+def export_dir():
+    return str(getattr(settings, 'EXPORT_DIR', None) or '')
+
+
+def file_name(export_format):
+    """
+    Text exports are gzipped if EXPORT_COMPRESSION is 'gzip',
+    the matrix is always zip compressed by NumPy.
+    """
+    name = 'words.' + export_format
+    compression = getattr(settings, 'EXPORT_COMPRESSION', None)
+    if compression == 'gzip' and export_format != 'npz':
+        name += '.gz'
+    return name
+
+
+def export_path(version, export_format):
+    """
+    Returns the path of an export of a corpus version,
+    or None if it has not been written.
+    Until the exports of a version are written, those of the newest
+    earlier version are returned, so downloads don't go missing
+    while the corpus is being rebuilt.
+    """
+    directory = export_dir()
+    if not directory or export_format not in FORMATS:
+        return None
+    if not os.path.isdir(directory):
+        return None
+    versions = sorted(
+        (int(name) for name in os.listdir(directory) if name.isdigit()),
+        reverse=True
+    )
+    for written in versions:
+        if written > version:
+            continue
+        path = os.path.join(directory, str(written), file_name(export_format))
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def open_export(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wb')
+    return open(path, 'wb')
+
+
+def write_exports(version):
+    """
+    Writes every export format for a corpus version.
+    Files are written to a temporary directory that is renamed
+    into place, so downloads never see half-written exports.
+    """
+    directory = export_dir()
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    target = os.path.join(directory, str(version))
+    temp = '{}.{}.tmp'.format(target, os.getpid())
+    shutil.rmtree(temp, ignore_errors=True)
+    os.makedirs(temp)
+
+    text_exports = {
+        'txt': all_word_data,
+        'csv': csv_rows,
+        'jsonl': json_lines,
+    }
+    for export_format, generate in text_exports.items():
+        with open_export(os.path.join(temp, file_name(export_format))) as f:
+            for part in generate():
+                f.write(part.encode('utf8'))
+    with open_export(os.path.join(temp, file_name('npz'))) as f:
+        write_matrix(f)
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(temp, target)
+
+
+def remove_exports(keep):
+    """
+    Removes the exports of every corpus version but keep.
+    """
+    directory = export_dir()
+    if not directory or not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name != str(keep) and not name.endswith('.tmp'):
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
@@ -0,0 +1,121 @@
+import numpy
+import os
+from django.conf import settings
+from spacy.lang.en.stop_words import STOP_WORDS
+from .models import Word
+
+
+def word_list(value):
+    """
+    Returns the words of a list, or of a file with one word per line.
+    """
+    if isinstance(value, (str, os.PathLike)):
+        with open(value, encoding='utf8') as f:
+            value = [line.strip() for line in f if line.strip()]
+    return sorted(set(word.lower() for word in value))
+
+
+def config():
+    """
+    Returns the token filter settings with their defaults,
+    in a form that can be compared and hashed.
+    """
+    stop_words = getattr(settings, 'TOKEN_STOP_WORDS', None)
+    pos = getattr(settings, 'TOKEN_POS', None)
+    field_length = Word._meta.get_field('text').max_length
+    return {
+        'stop_words': word_list(
+            STOP_WORDS if stop_words is None else stop_words
+        ),
+        'pos': sorted(pos) if pos is not None else None,
+        'min_length': getattr(settings, 'TOKEN_MIN_LENGTH', 1),
+        'max_length': min(
+            getattr(settings, 'TOKEN_MAX_LENGTH', field_length),
+            field_length
+        ),
+        'allow': word_list(getattr(settings, 'TOKEN_ALLOW', [])),
+        'deny': word_list(getattr(settings, 'TOKEN_DENY', [])),
+    }
+
+
+class TokenFilter:
+    """
+    Decides which tokens are counted as words.
+    Tokens must be alphabetic and not stop words, have an allowed
+    part of speech and a lemma of an allowed length.
+    Allowed words are kept even if they are stop words or another
+    part of speech, denied words never are; both lists match the
+    lowercase token or its lemma.
+    Word lists are compiled once into sorted arrays of StringStore
+    hashes, so tokens are filtered with numpy on Doc.to_array columns,
+    and lemma lengths are checked once per distinct lemma.
+    """
+
+    def __init__(self, strings, options=None):
+        if options is None:
+            options = config()
+        self.strings = strings
+        self.stop_words = self.hashes(options['stop_words'])
+        self.allow = self.hashes(options['allow'])
+        self.deny = self.hashes(options['deny'])
+        self.pos = None
+        if options['pos'] is not None:
+            self.pos = self.hashes(options['pos'])
+        self.min_length = options['min_length']
+        self.max_length = options['max_length']
+        # Whether each lemma seen so far has an allowed length.
+        self.lemma_lengths = {}
+
+    def hashes(self, words):
+        return numpy.array(
+            sorted(self.strings.add(word) for word in words),
+            dtype=numpy.uint64
+        )
+
+    def valid_lemma(self, lemma):
+        valid = self.lemma_lengths.get(lemma)
+        if valid is None:
+            length = len(self.strings[lemma].lower())
+            valid = self.min_length <= length <= self.max_length
+            self.lemma_lengths[lemma] = valid
+        return valid
+
+    def keep(self, lemmas, lowers, alpha, pos=None):
+        """
+        Returns a boolean mask of the tokens to keep,
+        given their LEMMA, LOWER, IS_ALPHA and POS columns.
+        POS is only needed when filtering by part of speech.
+        """
+        alpha = alpha == 1
+        keep = alpha & ~numpy.isin(lowers, self.stop_words)
+        if self.pos is not None:
+            keep &= numpy.isin(pos, self.pos)
+        if len(self.allow):
+            keep |= alpha & (
+                numpy.isin(lowers, self.allow)
+                | numpy.isin(lemmas, self.allow)
+            )
+        if len(self.deny):
+            keep &= ~(
+                numpy.isin(lowers, self.deny)
+                | numpy.isin(lemmas, self.deny)
+            )
+        if keep.any():
+            unique, index = numpy.unique(lemmas[keep], return_inverse=True)
+            valid = numpy.array(
+                [self.valid_lemma(lemma) for lemma in unique.tolist()],
+                dtype=bool
+            )
+            keep[keep] = valid[index]
+        return keep
+
+    def keep_token(self, token):
+        """
+        The same decision for a single spaCy Token.
+        """
+        return bool(self.keep(
+            numpy.array([token.lemma], dtype=numpy.uint64),
+            numpy.array([token.lower], dtype=numpy.uint64),
+            numpy.array([token.is_alpha]),
+            numpy.array([token.pos], dtype=numpy.uint64),
+        )[0])
@@ -0,0 +1,29 @@
+import os
+from django import forms
+from django.core.files.storage import default_storage
+from .models import Document
+
+
+class UploadForm(forms.Form):
+    files = forms.FileField(
+        widget=forms.ClearableFileInput(attrs={'multiple': True})
+    )
+
+    def clean_files(self):
+        """
+        Checks every uploaded file, not only the last one.
+        Documents are plain UTF-8 text named like Document.name.
+        """
+        files = self.files.getlist('files')
+        max_length = Document._meta.get_field('name').max_length
+        for f in files:
+            name = default_storage.get_valid_name(os.path.basename(f.name))
+            if not name.endswith('.txt'):
+                raise forms.ValidationError(
+                    '"%s" is not a .txt file.' % f.name
+                )
+            if len(name) > max_length:
+                raise forms.ValidationError(
+                    '"%s" is longer than %d characters.' % (name, max_length)
+                )
+        return files
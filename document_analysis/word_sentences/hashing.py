@@ -0,0 +1,10 @@
+import hashlib
+
+
+def hash_text(text):
+    """
+    Returns the fixed-width hash sentences are deduplicated by.
+    Kept apart from the models so worker processes can use it
+    before Django is set up.
+    """
+    return hashlib.blake2b(text.encode('utf8'), digest_size=16).hexdigest()
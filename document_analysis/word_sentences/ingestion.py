@@ -0,0 +1,190 @@
+import os
+import traceback
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from . import caching, cooccurrence, exports, tfidf
+from .analyser import Analyser
+from .models import CorpusStats, IngestionJob, IngestionRun
+
+
+def enqueue(uploaded_file):
+    """
+    Stores an uploaded document and queues it for the ingest worker.
+    """
+    job = IngestionJob()
+    job.file.save(uploaded_file.name, uploaded_file, save=False)
+    job.name = os.path.basename(job.file.name)
+    job.save()
+    return job
+
+
+def requeue_stale_jobs():
+    """
+    Queues again the jobs parsing or saving whose worker hasn't sent
+    a heartbeat for INGEST_JOB_TIMEOUT seconds, as left behind by
+    a worker that was killed. Their save was rolled back, so they
+    can safely be processed again.
+    Returns the number of jobs queued again.
+    """
+    timeout = getattr(settings, 'INGEST_JOB_TIMEOUT', 60 * 60)
+    return IngestionJob.objects.filter(
+        status__in=[IngestionJob.PARSING, IngestionJob.SAVING],
+        heartbeat__lt=timezone.now() - timedelta(seconds=timeout)
+    ).update(status=IngestionJob.QUEUED, started=None, heartbeat=None)
+
+
+def claim_jobs(limit):
+    """
+    Marks up to limit queued jobs as parsing and returns them, oldest first.
+    A job is only claimed if its status was still queued,
+    so several workers can share the queue.
+    Stale jobs are queued again first.
+    Jobs for a name already in the batch wait for the next batch,
+    as the analyser keys documents by name.
+    """
+    requeue_stale_jobs()
+    claimed = []
+    names = set()
+    queued = IngestionJob.objects.filter(
+        status=IngestionJob.QUEUED
+    ).order_by('id')
+    for job in queued[:limit]:
+        if job.name in names:
+            continue
+        if IngestionJob.objects.filter(
+            id=job.id,
+            status=IngestionJob.QUEUED
+        ).update(
+            status=IngestionJob.PARSING,
+            started=timezone.now(),
+            heartbeat=timezone.now()
+        ):
+            job.status = IngestionJob.PARSING
+            claimed.append(job)
+            names.add(job.name)
+    return claimed
+
+
+def set_status(jobs, status, **kwargs):
+    IngestionJob.objects.filter(
+        id__in=[job.id for job in jobs]
+    ).update(status=status, **kwargs)
+
+
+def heartbeat(jobs):
+    """
+    Records that the worker processing some jobs is still alive.
+    """
+    IngestionJob.objects.filter(
+        id__in=[job.id for job in jobs]
+    ).update(heartbeat=timezone.now())
+
+
+def process_jobs(
+    jobs,
+    workers=1,
+    batch_size=1,
+    stream=None,
+    pool=None,
+    save_shards=1
+):
+    """
+    Parses and saves a batch of claimed jobs with a single Analyser.
+    If the batch fails its jobs are retried one at a time,
+    so a bad document only fails its own job.
+    With more than one save shard, rows are staged in parallel.
+    A heartbeat is sent for the batch after each document is parsed,
+    so the jobs are not requeued while it runs.
+    If a process of the pool dies the pool can't be used again,
+    so BrokenProcessPool is raised for the caller to replace it,
+    leaving the jobs claimed.
+    Returns the jobs that failed.
+    """
+    analyser = Analyser()
+    paths = {job.file.path: job for job in jobs}
+    try:
+        for path in analyser.parse_documents(
+            list(paths),
+            workers=workers,
+            batch_size=batch_size,
+            stream=stream,
+            pool=pool
+        ):
+            set_status([paths[path]], IngestionJob.SAVING)
+            heartbeat(jobs)
+        analyser.save_data(shards=save_shards, pool=pool)
+    except BrokenProcessPool:
+        raise
+    except Exception:
+        if len(jobs) > 1:
+            failed = []
+            for job in jobs:
+                failed.extend(
+                    process_jobs(
+                        [job], workers, batch_size, stream, pool, save_shards
+                    )
+                )
+            return failed
+        set_status(
+            jobs,
+            IngestionJob.FAILED,
+            error=traceback.format_exc(),
+            finished=timezone.now()
+        )
+        return jobs
+    set_status(jobs, IngestionJob.DONE, finished=timezone.now())
+    record_run(
+        'ingest_worker',
+        analyser.instrumentation,
+        jobs=[job.id for job in jobs]
+    )
+    return []
+
+
+def after_ingestion(force=False):
+    """
+    Runs once ingested data is committed.
+    Recomputes the word associations of the whole corpus from scratch
+    and updates document keywords, then moves to a new corpus version
+    so no cached page mixes old associations with new data.
+    The exports of the new version are written before it is published,
+    so its downloads never find them missing, and older ones removed after.
+    Nothing is done if the corpus hasn't changed since the last rebuild,
+    unless force is set.
+    Returns whether anything was rebuilt.
+    """
+    stats = CorpusStats.load()
+    if not force and stats.version == stats.rebuilt_version:
+        return False
+    cooccurrence.build()
+    tfidf.update_keywords()
+    version = caching.corpus_version() + 1
+    exports.write_exports(version)
+    published = caching.bump_corpus_version()
+    if published != version:
+        # Another process moved the version in the meantime,
+        # so its changes may be missing and are rebuilt next time.
+        exports.write_exports(published)
+    else:
+        CorpusStats.objects.filter(pk=CorpusStats.PK).update(
+            rebuilt_version=published
+        )
+    exports.remove_exports(published)
+    return True
+
+
+def record_run(command, instrumentation, **extra):
+    """
+    Logs the instrumentation report of a run and stores it
+    as an IngestionRun, with any extra values added to the report.
+    """
+    report = instrumentation.log(command)
+    report.update(extra)
+    return IngestionRun.objects.create(
+        command=command,
+        documents=report['counters'].get('documents', 0),
+        seconds=report['seconds'],
+        report=report
+    )
@@ -0,0 +1,104 @@
+import json
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+
+class Instrumentation:
+    """
+    Collects per-stage timers and counters for an ingestion run.
+    Stage times are exclusive: time spent in a nested stage,
+    e.g. reading a file while spaCy asks for the next chunk,
+    is only counted for the nested one.
+    """
+
+    def __init__(self):
+        self.stages = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.stack = []
+        self.since = None
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        now = time.perf_counter()
+        if self.stack:
+            self.stages[self.stack[-1]] += now - self.since
+        self.stack.append(name)
+        self.since = now
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.stages[self.stack.pop()] += now - self.since
+            self.calls[name] += 1
+            self.since = now
+
+    def timed(self, name, iterable):
+        """
+        Yields from an iterable, timing each step as the named stage.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    @contextmanager
+    def database(self, using=DEFAULT_DB_ALIAS):
+        """
+        Counts the queries issued and the rows they write.
+        """
+        def wrapper(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            self.counters['queries'] += 1
+            if sql.lstrip()[:6].upper() != 'SELECT':
+                rowcount = context['cursor'].rowcount
+                if rowcount > 0:
+                    self.counters['rows_written'] += rowcount
+            return result
+
+        with connections[using].execute_wrapper(wrapper):
+            yield
+
+    def merge(self, report):
+        """
+        Adds the stages and counters of a report from another process.
+        """
+        for name, stage in report['stages'].items():
+            self.stages[name] += stage['seconds']
+            self.calls[name] += stage['calls']
+        for name, value in report['counters'].items():
+            self.counters[name] += value
+
+    def report(self):
+        return {
+            'seconds': round(time.perf_counter() - self.started, 6),
+            'stages': {
+                name: {
+                    'seconds': round(seconds, 6),
+                    'calls': self.calls[name],
+                }
+                for name, seconds in sorted(
+                    self.stages.items(),
+                    key=lambda item: -item[1]
+                )
+            },
+            'counters': dict(self.counters),
+        }
+
+    def log(self, label='ingestion'):
+        report = self.report()
+        logger.info('%s report: %s', label, json.dumps(report))
+        return report
@@ -0,0 +1,237 @@
+import json
+import os
+import platform
+import statistics
+import tempfile
+import spacy
+from datetime import datetime
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from word_sentences import analyser as analysers, benchmark
+from word_sentences.analyser import Analyser
+from word_sentences.models import Document, Sentence, Word
+
+
+class Command(BaseCommand):
+    help = (
+        'Times ingestion and the read views on a generated corpus, '
+        'in a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--documents',
+            type=int,
+            default=10,
+            help='Number of documents in the generated corpus.'
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=20000,
+            help='Approximate size of each document in characters.'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Seed for the corpus, the same seed gives the same corpus.'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of processes parsing documents in parallel.'
+        )
+        parser.add_argument(
+            '--save-shards',
+            type=int,
+            default=1,
+            help='Number of shards whose rows are staged in parallel '
+                 'before being merged into the database.'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Number of requests per view, the median time is kept.'
+        )
+        parser.add_argument(
+            '--output',
+            default='benchmark.json',
+            help='File the results are written to.'
+        )
+        parser.add_argument(
+            '--compare',
+            help='Results of an earlier run to check for regressions.'
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.2,
+            help='Relative increase reported as a regression.'
+        )
+
+    def handle(self, **kwargs):
+        previous = None
+        if kwargs['compare']:
+            with open(kwargs['compare']) as f:
+                previous = json.load(f)
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            ANALYSER_CACHE_DIR=None,
+            EXPORT_DIR=None,
+            CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache'
+            }}
+        ):
+            paths = benchmark.generate_corpus(
+                directory,
+                documents=kwargs['documents'],
+                size=kwargs['size'],
+                seed=kwargs['seed']
+            )
+            characters = sum(os.path.getsize(path) for path in paths)
+            setup_test_environment()
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, serialize=False)
+            try:
+                results = self.run_benchmarks(paths, characters, kwargs)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        data = {
+            'meta': {
+                'date': datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'spacy': spacy.__version__,
+                'documents': kwargs['documents'],
+                'size': kwargs['size'],
+                'seed': kwargs['seed'],
+                'characters': characters,
+                'workers': kwargs['workers'],
+                'save_shards': kwargs['save_shards'],
+            },
+            'results': results,
+        }
+        with open(kwargs['output'], 'w') as f:
+            json.dump(data, f, indent=2)
+        for operation, result in results.items():
+            self.stdout.write(
+                '{:<28} {:>10.3f}s {:>6} queries {:>12} bytes'.format(
+                    operation,
+                    result['seconds'],
+                    result['queries'],
+                    result['peak_memory']
+                )
+            )
+        self.stdout.write('Results written to %s.' % kwargs['output'])
+
+        if previous is not None:
+            regressions = benchmark.compare(
+                previous, data, kwargs['threshold']
+            )
+            for operation, metric, before, after in regressions:
+                self.stdout.write('Regression in %s %s: %s -> %s' % (
+                    operation, metric, before, after
+                ))
+            if regressions:
+                raise CommandError(
+                    '%d regressions against %s.' % (
+                        len(regressions), kwargs['compare']
+                    )
+                )
+            self.stdout.write('No regressions against %s.' % kwargs['compare'])
+
+    def run_benchmarks(self, paths, characters, kwargs):
+        """
+        Times each operation and measures its memory in a separate,
+        traced run: the model is loaded again, the documents are parsed
+        and saved once more, the copy removed before the timed save,
+        and each view is requested once more.
+        """
+        results = {}
+        analyser = Analyser()
+        with benchmark.Measurement() as m:
+            analyser.nlp
+        analysers.pipelines.clear()
+        with benchmark.Measurement(trace_memory=True) as memory:
+            Analyser().nlp
+        results['load_model'] = m.result(memory)
+
+        with benchmark.Measurement(trace_memory=True) as memory:
+            traced = Analyser(nlp=analyser.nlp)
+            for _ in traced.parse_documents(
+                paths,
+                workers=kwargs['workers']
+            ):
+                pass
+        with benchmark.Measurement() as m:
+            for _ in analyser.parse_documents(
+                paths,
+                workers=kwargs['workers']
+            ):
+                pass
+        tokens = sum(
+            sum(data.word_frequency.values())
+            for data in analyser.document_data.values()
+        )
+        results['parse_document'] = m.result(
+            memory,
+            documents=len(paths),
+            tokens=tokens,
+            tokens_per_second=round(tokens / m.seconds),
+            characters_per_second=round(characters / m.seconds)
+        )
+
+        with benchmark.Measurement(trace_memory=True) as memory:
+            traced.save_data(shards=kwargs['save_shards'])
+        # Saving twice would replace the documents, so remove them.
+        with transaction.atomic():
+            traced.remove_documents(traced.document_data)
+        with benchmark.Measurement() as m:
+            analyser.save_data(shards=kwargs['save_shards'])
+        results['save_data'] = m.result(
+            memory,
+            words=Word.objects.count(),
+            sentences=Sentence.objects.count(),
+            tokens_per_second=round(tokens / m.seconds)
+        )
+
+        document = Document.objects.order_by('id').first()
+        views = {
+            'word_list': reverse('word-list'),
+            'word_list_frequency': reverse('word-list') + '?sort=frequency',
+            'document_list': reverse('document-list'),
+            'document_word_list': reverse(
+                'document-word-list', args=[document.id]
+            ),
+            'download': reverse('download', args=[0]),
+            'download_document': reverse('download', args=[document.id]),
+            'api_words': reverse('api-words'),
+        }
+        client = Client()
+
+        def get(url):
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+
+        for name, url in views.items():
+            measurements = []
+            for _ in range(kwargs['repeat']):
+                with benchmark.Measurement() as m:
+                    get(url)
+                measurements.append(m)
+            with benchmark.Measurement(trace_memory=True) as memory:
+                get(url)
+            result = measurements[-1].result(memory)
+            result['seconds'] = round(
+                statistics.median(m.seconds for m in measurements), 6
+            )
+            results['view:' + name] = result
+        return results
@@ -0,0 +1,167 @@
+import time
+import traceback
+from concurrent.futures.process import BrokenProcessPool
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+from word_sentences import ingestion, processes
+from word_sentences.analyser import worker_pool
+from word_sentences.models import IngestionJob
+
+
+class Command(BaseCommand):
+    help = 'Processes uploaded documents queued for ingestion.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of processes parsing documents in parallel.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=20,
+            help='Number of queued documents parsed and saved together.'
+        )
+        parser.add_argument(
+            '--stream',
+            action='store_true',
+            default=None,
+            help='Parse every document in chunks to keep memory flat.'
+        )
+        parser.add_argument(
+            '--save-shards',
+            type=int,
+            default=1,
+            help='Number of shards whose rows are staged in parallel '
+                 'before being merged into the database.'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2,
+            help='Seconds to wait before checking an empty queue again.'
+        )
+        parser.add_argument(
+            '--rebuild-interval',
+            type=float,
+            default=300,
+            help='Minimum seconds between rebuilds of the word associations, '
+                 'keywords and exports while the queue is busy. '
+                 'They are always rebuilt once the queue is empty.'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the queue is empty instead of waiting for uploads.'
+        )
+
+    def check_pool(self, jobs=()):
+        """
+        Raises CommandError if the workers of the pool can't start,
+        e.g. Django can't be set up in them, rather than failing jobs
+        that have nothing to do with it. Claimed jobs are queued again.
+        """
+        try:
+            self.pool.submit(processes.ready).result()
+        except BrokenProcessPool:
+            ingestion.set_status(
+                jobs,
+                IngestionJob.QUEUED,
+                started=None,
+                heartbeat=None
+            )
+            raise CommandError('Worker processes could not be started.')
+
+    def process(self, jobs, **kwargs):
+        """
+        Processes claimed jobs in the pool, replacing it if one of its
+        processes dies. The jobs of a batch that broke the pool are
+        retried one at a time in a new pool, once its workers are known
+        to start, so only a document that kills its worker fails.
+        Returns the failed jobs.
+        """
+        try:
+            return ingestion.process_jobs(
+                jobs,
+                batch_size=max(1, len(jobs) // (self.workers * 4)),
+                stream=kwargs['stream'],
+                pool=self.pool,
+                save_shards=kwargs['save_shards']
+            )
+        except BrokenProcessPool:
+            error = traceback.format_exc()
+            self.stderr.write('Worker process died, restarting the pool.')
+            # Without a shared pool, staging made its own for this save.
+            if self.pool is not None:
+                self.pool.shutdown(wait=False)
+                self.pool = worker_pool(self.workers)
+                self.check_pool(jobs)
+            if len(jobs) == 1:
+                ingestion.set_status(
+                    jobs,
+                    IngestionJob.FAILED,
+                    error=error,
+                    finished=timezone.now()
+                )
+                return jobs
+        # Jobs processed before the pool broke keep their status.
+        statuses = dict(
+            IngestionJob.objects.filter(
+                id__in=[job.id for job in jobs]
+            ).values_list('id', 'status')
+        )
+        failed = []
+        for job in jobs:
+            if statuses[job.id] == IngestionJob.FAILED:
+                failed.append(job)
+            elif statuses[job.id] != IngestionJob.DONE:
+                failed.extend(self.process([job], **kwargs))
+        return failed
+
+    def rebuild(self):
+        self.stdout.write('Writing exports...')
+        ingestion.after_ingestion()
+        self.last_rebuild = time.monotonic()
+
+    def handle(self, **kwargs):
+        self.workers = kwargs['workers']
+        # The pool is kept for the life of the command,
+        # so each worker loads the spaCy model only once.
+        self.pool = worker_pool(self.workers) if self.workers > 1 else None
+        # The associations, keywords and exports cover the whole corpus,
+        # so they are rebuilt at most once per interval while busy.
+        pending = False
+        self.last_rebuild = time.monotonic()
+        try:
+            if self.pool is not None:
+                self.check_pool()
+            while True:
+                jobs = ingestion.claim_jobs(kwargs['batch_size'])
+                if not jobs:
+                    if pending:
+                        self.rebuild()
+                        pending = False
+                    if kwargs['once']:
+                        break
+                    time.sleep(kwargs['poll_interval'])
+                    continue
+                failed = self.process(jobs, **kwargs)
+                for job in jobs:
+                    self.stdout.write('File "%s" %s.' % (
+                        job.name,
+                        'failed' if job in failed else 'processed'
+                    ))
+                if len(failed) < len(jobs):
+                    pending = True
+                if pending and (
+                    time.monotonic() - self.last_rebuild
+                    >= kwargs['rebuild_interval']
+                ):
+                    self.rebuild()
+                    pending = False
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+        self.stdout.write('Queue empty.')
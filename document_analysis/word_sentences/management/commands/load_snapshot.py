@@ -0,0 +1,46 @@
+from django.core.management import BaseCommand, CommandError
+from word_sentences import ingestion, snapshots
+from word_sentences.analyser import Analyser
+
+
+class Command(BaseCommand):
+    help = (
+        'Saves snapshots written by read_eigen --snapshot to the database, '
+        'merging them first if there are several.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'snapshots',
+            nargs='+',
+            help='Snapshot files to load.'
+        )
+        parser.add_argument(
+            '--save-shards',
+            type=int,
+            default=1,
+            help='Number of shards whose rows are staged in parallel '
+                 'before being merged into the database.'
+        )
+
+    def handle(self, **kwargs):
+        analyser = Analyser(cache=None)
+        try:
+            snapshots.load_all(kwargs['snapshots'], analyser)
+        except ValueError as e:
+            raise CommandError(e)
+        self.stdout.write('Loaded %d documents, saving to database...' % (
+            len(analyser.document_data)
+        ))
+        analyser.save_data(shards=kwargs['save_shards'])
+        self.stdout.write('Writing exports...')
+        with analyser.instrumentation.stage('exports'):
+            ingestion.after_ingestion()
+        run = ingestion.record_run(
+            'load_snapshot',
+            analyser.instrumentation,
+            snapshots=kwargs['snapshots']
+        )
+        for name, stage in run.report['stages'].items():
+            self.stdout.write('%-20s %10.3fs' % (name, stage['seconds']))
+        self.stdout.write('Setup complete!')
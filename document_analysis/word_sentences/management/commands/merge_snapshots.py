@@ -0,0 +1,21 @@
+from django.core.management import BaseCommand, CommandError
+from word_sentences import snapshots
+
+
+class Command(BaseCommand):
+    help = 'Merges snapshots written by read_eigen --snapshot into one.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Snapshot file to write.')
+        parser.add_argument(
+            'snapshots',
+            nargs='+',
+            help='Snapshot files to merge.'
+        )
+
+    def handle(self, **kwargs):
+        try:
+            snapshots.merge(kwargs['snapshots'], kwargs['output'])
+        except ValueError as e:
+            raise CommandError(e)
+        self.stdout.write('Snapshot written to %s.' % kwargs['output'])
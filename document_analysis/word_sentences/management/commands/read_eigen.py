@@ -1,19 +1,151 @@
+import cProfile
 import os
-from django.core.management import BaseCommand
+import pstats
+import tracemalloc
+from django.core.management import BaseCommand, CommandError
 from document_analysis import settings
+from word_sentences import ingestion, snapshots
 from word_sentences.analyser import Analyser
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of processes parsing documents in parallel.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1,
+            help='Number of documents sent to a worker at a time.'
+        )
+        parser.add_argument(
+            '--stream',
+            action='store_true',
+            default=None,
+            help='Parse every document in chunks to keep memory flat.'
+        )
+        parser.add_argument(
+            '--save-shards',
+            type=int,
+            default=1,
+            help='Number of shards whose rows are staged in parallel '
+                 'before being merged into the database.'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Parse documents again even if they are unchanged.'
+        )
+        parser.add_argument(
+            '--snapshot',
+            metavar='FILE',
+            help='Write the results to a snapshot file instead of the '
+                 'database, to be merged with merge_snapshots and saved '
+                 'with load_snapshot. The database is not used.'
+        )
+        parser.add_argument(
+            '--part',
+            metavar='K/N',
+            help='Only parse the K-th of N equal parts of the documents, '
+                 'counting from 1, to split the corpus between machines.'
+        )
+        parser.add_argument(
+            '--profile',
+            metavar='FILE',
+            help='Profile the run with cProfile and write the stats to FILE. '
+                 'Only this process is profiled, not parsing workers.'
+        )
+        parser.add_argument(
+            '--trace-memory',
+            action='store_true',
+            help='Trace memory allocations and add the peak '
+                 'and the largest allocation sites to the run report.'
+        )
+
     def handle(self, **kwargs):
+        profiler = None
+        if kwargs['profile']:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        if kwargs['trace_memory']:
+            tracemalloc.start()
+
         analyser = Analyser()
         path = settings.BASE_DIR.name + '/eigen_test_docs/'
         full_path = os.path.abspath(path)
+        paths = []
         for filename in os.listdir(full_path):
             path = os.path.join(full_path, filename)
             assert os.path.isabs(path)
-            analyser.parse_document(path)
-            self.stdout.write('File "%s" processed.' % (filename))
-        self.stdout.write('Saving to database...')
-        analyser.save_data()
+            paths.append(path)
+        if kwargs['part']:
+            try:
+                part, parts = (int(n) for n in kwargs['part'].split('/'))
+            except ValueError:
+                raise CommandError('--part must look like 1/4.')
+            if not 1 <= part <= parts:
+                raise CommandError('--part must be between 1/N and N/N.')
+            paths = sorted(paths)[part - 1::parts]
+        if not kwargs['force'] and not kwargs['snapshot']:
+            changed = analyser.changed_documents(paths)
+            for path in set(paths) - set(changed):
+                self.stdout.write(
+                    'File "%s" unchanged, skipped.' % (os.path.basename(path))
+                )
+            paths = changed
+        for path in analyser.parse_documents(
+            paths,
+            workers=kwargs['workers'],
+            batch_size=kwargs['batch_size'],
+            stream=kwargs['stream']
+        ):
+            self.stdout.write(
+                'File "%s" processed.' % (os.path.basename(path))
+            )
+        if kwargs['snapshot']:
+            self.stdout.write('Writing snapshot...')
+            snapshots.write(analyser, kwargs['snapshot'])
+        elif not paths:
+            # Saving nothing would still move the corpus version,
+            # dropping every cached page, and rebuild all exports.
+            self.stdout.write('No documents changed, nothing to save.')
+        else:
+            self.stdout.write('Saving to database...')
+            analyser.save_data(shards=kwargs['save_shards'])
+            self.stdout.write('Writing exports...')
+            with analyser.instrumentation.stage('exports'):
+                ingestion.after_ingestion()
+
+        extra = {}
+        if kwargs['trace_memory']:
+            _, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+            tracemalloc.stop()
+            extra['memory'] = {
+                'peak': peak,
+                'top': [
+                    {'location': str(stat.traceback), 'size': stat.size}
+                    for stat in top
+                ],
+            }
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(kwargs['profile'])
+            pstats.Stats(profiler, stream=self.stdout).sort_stats(
+                'cumulative'
+            ).print_stats(20)
+        if kwargs['snapshot']:
+            report = analyser.instrumentation.log('read_eigen')
+        else:
+            report = ingestion.record_run(
+                'read_eigen',
+                analyser.instrumentation,
+                **extra
+            ).report
+        for name, stage in report['stages'].items():
+            self.stdout.write('%-20s %10.3fs' % (name, stage['seconds']))
         self.stdout.write('Setup complete!')
\ No newline at end of file
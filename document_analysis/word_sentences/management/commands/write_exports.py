@@ -0,0 +1,10 @@
+from django.core.management import BaseCommand
+from word_sentences import ingestion
+
+
+class Command(BaseCommand):
+    help = 'Writes the exports of all word data for the current corpus.'
+
+    def handle(self, **kwargs):
+        ingestion.after_ingestion(force=True)
+        self.stdout.write('Exports written.')
@@ -1,9 +1,19 @@
+import os
+import uuid
 from django.db import models
+from .hashing import hash_text
 
 
 class Word(models.Model):
     text = models.CharField(max_length=45, unique=True)
     total_frequency = models.IntegerField(default=0)
+    document_frequency = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-total_frequency', 'id']),
+            models.Index(fields=['-document_frequency', 'id']),
+        ]
 
     def __str__(self):
         return self.text
@@ -16,14 +26,18 @@ class Word(models.Model):
 
 
 class Document(models.Model):
-    name = models.CharField(max_length=16)
+    name = models.CharField(max_length=16, db_index=True)
+    content_hash = models.CharField(max_length=64, blank=True)
     words = models.ManyToManyField(Word, through='DocumentWord')
+    word_count = models.IntegerField(default=0)
+    token_count = models.IntegerField(default=0)
+    sentence_count = models.IntegerField(default=0)
 
     def __str__(self):
         return self.name
 
     def word_total(self):
-        return len(self.words.all())
+        return self.word_count
 
 
 class DocumentWord(models.Model):
@@ -39,12 +53,172 @@ class DocumentWord(models.Model):
     )
     frequency = models.IntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['document', '-frequency', 'id']),
+        ]
+
+
+class DocumentKeyword(models.Model):
+    """
+    One of the most distinctive words of a document, by TF-IDF score.
+    """
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.CASCADE,
+        related_name='keywords'
+    )
+    word = models.ForeignKey(Word, on_delete=models.CASCADE)
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [models.Index(fields=['document', '-score'])]
+
+
+class WordAssociation(models.Model):
+    """
+    A word that often occurs with another, computed after ingestion.
+    Counts are of the sentences and documents both words are in,
+    pmi is their pointwise mutual information over sentences.
+    """
+    word = models.ForeignKey(
+        Word,
+        on_delete=models.CASCADE,
+        related_name='associations'
+    )
+    other = models.ForeignKey(
+        Word,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    sentence_count = models.IntegerField()
+    document_count = models.IntegerField()
+    pmi = models.FloatField()
+
+    class Meta:
+        indexes = [models.Index(fields=['word', '-pmi'])]
+
 
 class Sentence(models.Model):
-    text = models.TextField(unique=True)
+    """
+    A distinct sentence, deduplicated by the fixed-width hash of its text
+    so the text itself isn't indexed. Words link to it through a plain
+    table of (sentence, word) ids; which words a sentence has is stored,
+    not where they are in it.
+    """
+    text = models.TextField()
+    text_hash = models.CharField(max_length=32, unique=True)
     words = models.ManyToManyField(Word)
+    documents = models.ManyToManyField(Document, through='SentenceOccurrence')
+
+    hash_text = staticmethod(hash_text)
+
+    def save(self, *args, **kwargs):
+        self.text_hash = self.hash_text(self.text)
+        super().save(*args, **kwargs)
+
+
+class SentenceOccurrence(models.Model):
+    """
+    The number of times a sentence occurs in a document.
+    Positions of the occurrences are not stored.
+    """
     document = models.ForeignKey(
         Document,
         on_delete=models.CASCADE,
-        null=True
+        related_name='occurrences'
+    )
+    sentence = models.ForeignKey(
+        Sentence,
+        on_delete=models.CASCADE,
+        related_name='occurrences'
     )
+    count = models.IntegerField(default=1)
+
+    class Meta:
+        unique_together = [['document', 'sentence']]
+
+
+class CorpusStats(models.Model):
+    """
+    Corpus-wide totals, kept in a single row updated by the Analyser.
+    The version goes up every time the Analyser saves.
+    keyword_documents is the number of documents when all keywords
+    were last computed, rebuilt_version the version whose associations,
+    keywords and exports were last rebuilt.
+    """
+    PK = 1
+
+    documents = models.IntegerField(default=0)
+    words = models.IntegerField(default=0)
+    tokens = models.IntegerField(default=0)
+    sentences = models.IntegerField(default=0)
+    version = models.IntegerField(default=0)
+    keyword_documents = models.IntegerField(default=0)
+    rebuilt_version = models.IntegerField(default=0)
+
+    @classmethod
+    def load(cls):
+        stats, _ = cls.objects.get_or_create(pk=cls.PK)
+        return stats
+
+
+def upload_path(instance, filename):
+    """
+    Stores each upload in its own directory,
+    so the file keeps its name and becomes the document name.
+    """
+    return os.path.join('uploads', uuid.uuid4().hex, filename)
+
+
+class IngestionJob(models.Model):
+    QUEUED = 'queued'
+    PARSING = 'parsing'
+    SAVING = 'saving'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (PARSING, 'Parsing'),
+        (SAVING, 'Saving'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=16)
+    file = models.FileField(upload_to=upload_path)
+    status = models.CharField(
+        max_length=8,
+        choices=STATUS_CHOICES,
+        default=QUEUED,
+        db_index=True
+    )
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    # Updated by the worker while it processes the job.
+    heartbeat = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class IngestionRun(models.Model):
+    """
+    Instrumentation report of an ingestion run:
+    where its time went, what it processed and what it wrote.
+    """
+    command = models.CharField(max_length=32)
+    finished = models.DateTimeField(auto_now_add=True)
+    documents = models.IntegerField(default=0)
+    seconds = models.FloatField(default=0)
+    report = models.JSONField(default=dict)
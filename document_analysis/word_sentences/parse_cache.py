@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import zlib
+import spacy
+from array import array
+from django.conf import settings
+from . import filters
+
+
+# Bumped whenever the layout of cached results changes.
+FORMAT = 3
+
+
+def pipeline_version():
+    """
+    Returns a string identifying everything the parse depends on,
+    without loading the model.
+    """
+    name = getattr(settings, 'SPACY_MODEL', 'en_core_web_sm')
+    parts = [
+        str(FORMAT),
+        spacy.__version__,
+        name,
+        str(spacy.util.get_package_version(name)),
+        ','.join(getattr(settings, 'SPACY_DISABLE', ['ner'])),
+        str(getattr(settings, 'SPACY_SENTENCIZER', False)),
+        json.dumps(filters.config(), sort_keys=True),
+    ]
+    return '\n'.join(parts)
+
+
+def parse_mode(stream):
+    """
+    Returns how a document is parsed with a parse_document stream option.
+    Streamed results depend on where chunks end, so on the chunk size.
+    """
+    if stream is False:
+        return 'whole'
+    return '{}:{}'.format(
+        'stream' if stream else 'auto',
+        getattr(settings, 'ANALYSER_CHUNK_SIZE', 100000)
+    )
+
+
+class ParseCache:
+    """
+    On-disk cache of document parse results.
+    Entries are keyed by the document's content hash, the parse mode
+    and everything that changes the parse: spaCy and model versions,
+    the pipeline and the stop words. Once the cache grows over max_size
+    bytes the least recently used entries are removed.
+    Entries are compressed JSON, so a file put in the cache directory
+    can't run code when it is read.
+    The size is kept as a running total, so the directory is only
+    walked on the first write, when the total goes over max_size,
+    and after a tenth of max_size has been written, which counts
+    what other processes sharing the cache wrote meanwhile.
+    Eviction frees a tenth of max_size so it isn't walked again
+    on the next write.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = str(directory)
+        self.max_size = max_size
+        self.pipeline = pipeline_version()
+        # Bytes in the cache, counted on the first write.
+        self.size = None
+        # Bytes written since the cache was last walked.
+        self.written = 0
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Returns the cache configured in settings, or None if it is disabled.
+        """
+        directory = getattr(settings, 'ANALYSER_CACHE_DIR', None)
+        if not directory:
+            return None
+        max_size = getattr(settings, 'ANALYSER_CACHE_SIZE', 512 * 1024 ** 2)
+        return cls(directory, max_size)
+
+    def key(self, content_hash, mode=None):
+        """
+        Returns the cache key for a document's content hash
+        and the parse mode from parse_mode.
+        """
+        key = '{}\n{}\n{}'.format(content_hash, mode, self.pipeline)
+        return hashlib.sha256(key.encode('utf8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, content_hash, mode=None):
+        """
+        Returns the cached
+        (sentences, sentence counts, {word: (frequency, sentence ids)})
+        for a document, or None if it is not cached.
+        """
+        path = self.path(self.key(content_hash, mode))
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        try:
+            sentences, counts, words = json.loads(zlib.decompress(data))
+            words = {
+                word: (frequency, array('I', sentence_ids))
+                for word, (frequency, sentence_ids) in words.items()
+            }
+        except (zlib.error, ValueError, TypeError, AttributeError):
+            return None
+        return sentences, counts, words
+
+    def set(self, content_hash, sentences, counts, words, mode=None):
+        """
+        Stores the sentences, sentence counts
+        and {word: (frequency, sentence ids)} of a document,
+        as returned by Analyser.partial.
+        """
+        data = zlib.compress(json.dumps((
+            sentences,
+            counts,
+            {
+                word: (frequency, list(sentence_ids))
+                for word, (frequency, sentence_ids) in words.items()
+            },
+        )).encode('utf8'))
+
+        path = self.path(self.key(content_hash, mode))
+        if self.size is None:
+            self.size = self.scan()[1]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        try:
+            self.size -= os.path.getsize(path)
+        except OSError:
+            pass
+        os.replace(temp_path, path)
+        self.size += len(data)
+        self.written += len(data)
+        if self.size > self.max_size or self.written > self.max_size // 10:
+            self.evict()
+
+    def scan(self):
+        """
+        Returns the (mtime, size, directory, name) of every entry,
+        least recently used first, and their total size.
+        """
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, root, name))
+                total += stat.st_size
+        entries.sort()
+        return entries, total
+
+    def evict(self):
+        """
+        Walks the cache to count entries written by other processes,
+        and if it is over max_size removes the least recently used
+        entries until it is no larger than nine tenths of max_size.
+        """
+        entries, total = self.scan()
+        self.written = 0
+        if total > self.max_size:
+            target = self.max_size * 9 // 10
+            for _, size, root, name in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(os.path.join(root, name))
+                except OSError:
+                    pass
+                total -= size
+        self.size = total
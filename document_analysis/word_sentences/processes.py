@@ -0,0 +1,155 @@
+import multiprocessing
+import sqlite3
+import django
+from concurrent.futures import ProcessPoolExecutor
+from django.apps import apps
+from django.conf import settings
+from .hashing import hash_text
+from .instrumentation import Instrumentation
+
+# Nothing here imports models at module level: a process started with
+# spawn imports this module to find its work before Django is set up.
+
+# Settings a parse depends on, copied into each worker process.
+PARSE_SETTINGS = (
+    'SPACY_MODEL',
+    'SPACY_DISABLE',
+    'SPACY_SENTENCIZER',
+    'TOKEN_STOP_WORDS',
+    'TOKEN_POS',
+    'TOKEN_MIN_LENGTH',
+    'TOKEN_MAX_LENGTH',
+    'TOKEN_ALLOW',
+    'TOKEN_DENY',
+    'ANALYSER_CHUNK_SIZE',
+    'ANALYSER_CACHE_DIR',
+    'ANALYSER_CACHE_SIZE',
+)
+
+# Tables of a staging file, merged into the main tables by staging.merge.
+STAGING_TABLES = (
+    'CREATE TABLE staged_word ('
+    'text TEXT PRIMARY KEY, frequency INTEGER, document_frequency INTEGER)',
+    'CREATE TABLE staged_sentence ('
+    'id INTEGER PRIMARY KEY, text TEXT, text_hash TEXT)',
+    'CREATE TABLE staged_sentence_word (sentence INTEGER, text TEXT)',
+    'CREATE TABLE staged_document_word ('
+    'document TEXT, text TEXT, frequency INTEGER)',
+    'CREATE TABLE staged_occurrence ('
+    'document TEXT, sentence INTEGER, count INTEGER)',
+)
+
+
+def parse_settings():
+    """
+    Returns the parse settings of this process that are set.
+    """
+    return {
+        name: getattr(settings, name)
+        for name in PARSE_SETTINGS
+        if hasattr(settings, name)
+    }
+
+
+def setup(values):
+    """
+    Sets up Django in a worker process. A spawned process starts
+    from nothing, so the apps are loaded here, and settings are copied
+    from the parent, which may have overridden them.
+    """
+    if not apps.ready:
+        django.setup()
+    for name, value in values.items():
+        setattr(settings, name, value)
+
+
+def pool(size, initializer=setup):
+    """
+    Returns a process pool of size workers, started with
+    WORKER_START_METHOD, or the platform's default if it is None.
+    The initializer is passed the parse settings of this process.
+    """
+    context = multiprocessing.get_context(
+        getattr(settings, 'WORKER_START_METHOD', None)
+    )
+    return ProcessPoolExecutor(
+        max_workers=size,
+        mp_context=context,
+        initializer=initializer,
+        initargs=(parse_settings(),)
+    )
+
+
+def ready():
+    """
+    Does nothing, submitted to check that a pool's workers start.
+    """
+    return True
+
+
+def init_parser(values):
+    """
+    Sets up a worker process and gives it its own Analyser,
+    so the spaCy model is loaded once per process.
+    """
+    global parser
+    setup(values)
+    # The analyser imports models, so only once Django is set up.
+    from .analyser import Analyser
+    parser = Analyser()
+
+
+def parse(path, stream=None):
+    """
+    Parses a single document in a worker process.
+    Returns the compact partial result for the parent to merge,
+    and the worker's instrumentation report for the document.
+    """
+    parser.clear()
+    parser.instrumentation = Instrumentation()
+    filename = parser.parse_document(path, stream=stream)
+    return parser.partial(filename), parser.instrumentation.report()
+
+
+def stage_shard(path, payload):
+    """
+    Writes the rows of one shard to a new SQLite file.
+    Runs in a worker process, so the main database is not touched.
+    """
+    staging = sqlite3.connect(path)
+    try:
+        staging.execute('PRAGMA journal_mode = off')
+        staging.execute('PRAGMA synchronous = off')
+        for sql in STAGING_TABLES:
+            staging.execute(sql)
+        staging.executemany(
+            'INSERT INTO staged_word VALUES (?, ?, ?)',
+            (word[:3] for word in payload['words'])
+        )
+        staging.executemany(
+            'INSERT INTO staged_sentence_word VALUES (?, ?)',
+            (
+                (sentence, text)
+                for text, _, _, sentences in payload['words']
+                for sentence in sentences
+            )
+        )
+        staging.executemany(
+            'INSERT INTO staged_sentence VALUES (?, ?, ?)',
+            (
+                (sentence, text, hash_text(text))
+                for sentence, text in payload['sentences']
+            )
+        )
+        staging.executemany(
+            'INSERT INTO staged_document_word VALUES (?, ?, ?)',
+            payload['document_words']
+        )
+        staging.executemany(
+            'INSERT INTO staged_occurrence VALUES (?, ?, ?)',
+            payload['occurrences']
+        )
+        staging.commit()
+    finally:
+        staging.close()
+    return path
@@ -0,0 +1,155 @@
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, router
+from .models import Word, Sentence
+
+# Word substrings are matched with trigrams, which need 3 characters.
+MIN_SUBSTRING = 3
+
+
+def fts_table(model):
+    return '{}_fts'.format(model._meta.db_table)
+
+
+def fts_tables():
+    """
+    Yields (model, tokenizer) for each full-text index.
+    Both index the text of an existing table without storing a copy.
+    """
+    yield Word, 'trigram'
+    yield Sentence, 'unicode61'
+
+
+def create_tables(using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Creates the SQLite FTS5 tables and fills any that are new.
+    Connected to post_migrate, does nothing on other databases
+    or if SQLite was built without FTS5.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for model, tokenizer in fts_tables():
+            table = fts_table(model)
+            if table in connection.introspection.table_names(cursor):
+                continue
+            try:
+                cursor.execute(
+                    "CREATE VIRTUAL TABLE {} USING fts5("
+                    "text, content='{}', content_rowid='id', tokenize='{}')"
+                    .format(table, model._meta.db_table, tokenizer)
+                )
+            except OperationalError:
+                return
+            cursor.execute(
+                "INSERT INTO {0}({0}) VALUES('rebuild')".format(table)
+            )
+    forget_tables(sender=None, connection=connection)
+
+
+def forget_tables(sender, connection, **kwargs):
+    """
+    Forgets whether a connection has the full-text tables.
+    Connected to connection_created, so they are looked up
+    once per connection rather than on every request.
+    """
+    connection.search_enabled = None
+
+
+def is_enabled(using=DEFAULT_DB_ALIAS):
+    """
+    Returns True if the full-text tables exist.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    if getattr(connection, 'search_enabled', None) is None:
+        table_names = connection.introspection.table_names()
+        connection.search_enabled = all(
+            fts_table(model) in table_names for model, _ in fts_tables()
+        )
+    return connection.search_enabled
+
+
+def index(queryset):
+    """
+    Adds the rows of a Word or Sentence queryset to its full-text index.
+    Rows must not be in the index already.
+    """
+    table = fts_table(queryset.model)
+    sql, params = queryset.values_list('id', 'text').query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {}(rowid, text) {}'.format(table, sql),
+            params
+        )
+
+
+def unindex(queryset):
+    """
+    Removes the rows of a Word or Sentence queryset from its full-text index.
+    Has to run before the rows themselves are deleted.
+    """
+    table = fts_table(queryset.model)
+    sql, params = queryset.values_list('id', 'text').query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO {0}({0}, rowid, text) SELECT 'delete', * FROM ({1})"
+            .format(table, sql),
+            params
+        )
+
+
+def phrase(query):
+    """
+    Quotes a query as an FTS5 phrase.
+    """
+    return '"{}"'.format(query.replace('"', '""'))
+
+
+def match_ids(model, query, limit):
+    """
+    Returns the ids of model rows matching an FTS5 phrase, best first.
+    The index is read from the database model rows are read from.
+    """
+    table = fts_table(model)
+    with connections[router.db_for_read(model)].cursor() as cursor:
+        cursor.execute(
+            'SELECT rowid FROM {0} WHERE {0} MATCH %s ORDER BY rank LIMIT %s'
+            .format(table),
+            [phrase(query), limit]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def in_order(queryset, ids):
+    """
+    Returns the objects with the given ids, in the order of ids.
+    """
+    objects = queryset.in_bulk(ids)
+    return [objects[i] for i in ids if i in objects]
+
+
+def search_words(query, substring=False, limit=50):
+    """
+    Returns words starting with query, or containing it if substring is True.
+    Prefix lookups are a range scan on the unique index of Word.text.
+    """
+    query = query.lower()
+    enabled = is_enabled(router.db_for_read(Word))
+    if substring and len(query) >= MIN_SUBSTRING and enabled:
+        ids = match_ids(Word, query, limit)
+        return sorted(in_order(Word.objects, ids), key=lambda w: w.text)
+    if substring:
+        words = Word.objects.filter(text__contains=query)
+    else:
+        words = Word.objects.filter(text__gte=query, text__lt=query + '\uffff')
+    return list(words.order_by('text')[:limit])
+
+
+def search_sentences(query, limit=50):
+    """
+    Returns sentences containing the phrase, best matches first.
+    """
+    if is_enabled(router.db_for_read(Sentence)):
+        return in_order(Sentence.objects, match_ids(Sentence, query, limit))
+    return list(Sentence.objects.filter(text__icontains=query)[:limit])
@@ -0,0 +1,200 @@
+import numpy
+from array import array
+from .analyser import Analyser
+from .parse_cache import pipeline_version
+
+# Bumped whenever the layout of snapshot files changes.
+FORMAT = 1
+
+
+def encode_strings(strings):
+    """
+    Packs strings into one UTF-8 byte array and the offsets
+    where each one starts, with the total length last.
+    """
+    encoded = [s.encode('utf8') for s in strings]
+    offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return numpy.frombuffer(b''.join(encoded), dtype=numpy.uint8), offsets
+
+
+def decode_strings(data, offsets):
+    data = data.tobytes()
+    return [
+        data[start:end].decode('utf8')
+        for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())
+    ]
+
+
+def ragged(lists, dtype):
+    """
+    Packs lists of numbers into one array and the offsets
+    where each list starts, with the total length last.
+    """
+    values = array(numpy.dtype(dtype).char)
+    offsets = numpy.zeros(len(lists) + 1, dtype=numpy.int64)
+    for i, items in enumerate(lists):
+        values.extend(items)
+        offsets[i + 1] = len(values)
+    return numpy.frombuffer(values, dtype=dtype), offsets
+
+
+def write(analyser, path, pipeline=None):
+    """
+    Writes the results held by an Analyser as compressed NumPy arrays.
+    Strings are stored as UTF-8 tables, the sentences of each word
+    and the words and sentences of each document as ragged arrays
+    of indexes into those tables.
+    """
+    if pipeline is None:
+        pipeline = pipeline_version()
+    with analyser.instrumentation.stage('snapshot:write'):
+        words = list(analyser.words)
+        word_index = {text: i for i, text in enumerate(words)}
+        documents = list(analyser.document_data.values())
+
+        arrays = {}
+        arrays['word_text'], arrays['word_offsets'] = encode_strings(words)
+        arrays['word_frequency'] = numpy.array(
+            [w.frequency for w in analyser.words.values()],
+            dtype=numpy.int64
+        )
+        arrays['word_sentences'], arrays['word_sentence_offsets'] = ragged(
+            [w.sentences for w in analyser.words.values()],
+            numpy.uint32
+        )
+        arrays['sentence_text'], arrays['sentence_offsets'] = \
+            encode_strings(analyser.sentences)
+        arrays['document_name'], arrays['document_offsets'] = \
+            encode_strings(analyser.document_data)
+        arrays['content_hash'], arrays['content_hash_offsets'] = \
+            encode_strings([d.content_hash for d in documents])
+        arrays['document_words'], arrays['document_word_offsets'] = ragged(
+            [[word_index[t] for t in d.word_frequency] for d in documents],
+            numpy.uint32
+        )
+        arrays['document_word_frequency'], _ = ragged(
+            [d.word_frequency.values() for d in documents],
+            numpy.int64
+        )
+        arrays['document_sentences'], arrays['document_sentence_offsets'] = \
+            ragged([d.sentences for d in documents], numpy.uint32)
+        arrays['document_sentence_count'], _ = ragged(
+            [d.sentences.values() for d in documents],
+            numpy.int64
+        )
+        # Given a name, NumPy would add .npz to it.
+        with open(path, 'wb') as f:
+            numpy.savez_compressed(
+                f,
+                format=numpy.array([FORMAT]),
+                pipeline=numpy.array(pipeline),
+                **arrays
+            )
+
+
+def read_pipeline(path):
+    """
+    Returns the pipeline a snapshot was parsed with,
+    raising ValueError if the file is not a snapshot of this format.
+    """
+    with numpy.load(path, allow_pickle=False) as data:
+        if 'format' not in data or int(data['format'][0]) != FORMAT:
+            raise ValueError('Not a snapshot of format {}'.format(FORMAT))
+        return str(data['pipeline'])
+
+
+def load(path, analyser):
+    """
+    Adds the results in a snapshot to an Analyser, as merge_partial
+    does for a parsed document. Sentences are interned again, so
+    snapshots of documents sharing sentences merge into one table.
+    A document can only be in one of the snapshots merged.
+    Returns the pipeline the snapshot was parsed with.
+    """
+    pipeline = read_pipeline(path)
+    with analyser.instrumentation.stage('snapshot:read'), \
+            numpy.load(path, allow_pickle=False) as data:
+        names = decode_strings(
+            data['document_name'], data['document_offsets']
+        )
+        for name in names:
+            if name in analyser.document_data:
+                raise ValueError(
+                    'Document {} is in more than one snapshot'.format(name)
+                )
+        sentence_ids = numpy.array(
+            [
+                analyser.intern_sentence(text)
+                for text in decode_strings(
+                    data['sentence_text'], data['sentence_offsets']
+                )
+            ],
+            dtype=numpy.int64
+        )
+        words = decode_strings(data['word_text'], data['word_offsets'])
+        frequencies = data['word_frequency'].tolist()
+        word_sentences = sentence_ids[data['word_sentences']]
+        offsets = data['word_sentence_offsets'].tolist()
+        for i, text in enumerate(words):
+            temp_word = analyser.words[text]
+            temp_word.text = text
+            temp_word.frequency += frequencies[i]
+            temp_word.add_sentences(
+                sorted(word_sentences[offsets[i]:offsets[i + 1]].tolist())
+            )
+
+        hashes = decode_strings(
+            data['content_hash'], data['content_hash_offsets']
+        )
+        document_words = data['document_words'].tolist()
+        document_word_frequency = data['document_word_frequency'].tolist()
+        word_offsets = data['document_word_offsets'].tolist()
+        document_sentences = \
+            sentence_ids[data['document_sentences']].tolist()
+        sentence_counts = data['document_sentence_count'].tolist()
+        sentence_offsets = data['document_sentence_offsets'].tolist()
+        for i, name in enumerate(names):
+            temp_doc = analyser.document_data[name]
+            temp_doc.content_hash = hashes[i]
+            start, end = word_offsets[i], word_offsets[i + 1]
+            for word, frequency in zip(
+                document_words[start:end],
+                document_word_frequency[start:end]
+            ):
+                temp_doc.word_frequency[words[word]] += frequency
+            start, end = sentence_offsets[i], sentence_offsets[i + 1]
+            for sentence_id, count in zip(
+                document_sentences[start:end],
+                sentence_counts[start:end]
+            ):
+                temp_doc.sentences[sentence_id] += count
+    analyser.instrumentation.count('documents', len(names))
+    return pipeline
+
+
+def load_all(paths, analyser):
+    """
+    Merges snapshots into an Analyser.
+    Snapshots parsed with different pipelines would mix
+    incompatible lemmas, so they can't be merged.
+    Returns the pipeline they were parsed with.
+    """
+    pipeline = None
+    for path in paths:
+        if pipeline is not None and read_pipeline(path) != pipeline:
+            raise ValueError(
+                '{} was parsed with a different pipeline'.format(path)
+            )
+        pipeline = load(path, analyser)
+    return pipeline
+
+
+def merge(paths, output):
+    """
+    Merges snapshots into a new one. Merging is associative,
+    so snapshots can be merged in any grouping, e.g. pairwise
+    as nodes finish, and give the same data once loaded.
+    """
+    analyser = Analyser(cache=None)
+    write(analyser, output, load_all(paths, analyser))
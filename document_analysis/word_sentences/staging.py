@@ -0,0 +1,229 @@
+import os
+import shutil
+import tempfile
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+from django.db import DEFAULT_DB_ALIAS, connections
+from . import processes
+from .models import (
+    Word,
+    Sentence,
+    Document,
+    DocumentWord,
+    SentenceOccurrence,
+)
+
+# SQLite attaches at most 10 databases by default.
+MAX_SHARDS = 8
+
+
+def is_supported(using=DEFAULT_DB_ALIAS):
+    """
+    Staging needs SQLite, and attaching files is not allowed
+    inside a transaction.
+    """
+    connection = connections[using]
+    return connection.vendor == 'sqlite' and not connection.in_atomic_block
+
+
+def shard_of(text, shards):
+    """
+    Stable shard of a word, the same in every process and run.
+    """
+    return zlib.crc32(text.encode('utf8')) % shards
+
+
+def partition(analyser, shards):
+    """
+    Splits an Analyser's results into one payload per shard.
+    Words and their rows go to the shard of their lemma,
+    sentences and their occurrences to the shard of their id.
+    """
+    payloads = [
+        {'words': [], 'sentences': [], 'document_words': [], 'occurrences': []}
+        for _ in range(shards)
+    ]
+    document_frequency = defaultdict(int)
+    for name, data in analyser.document_data.items():
+        for text, frequency in data.word_frequency.items():
+            document_frequency[text] += 1
+            payloads[shard_of(text, shards)]['document_words'].append(
+                (name, text, frequency)
+            )
+        for sentence, count in data.sentences.items():
+            payloads[sentence % shards]['occurrences'].append(
+                (name, sentence, count)
+            )
+    for text, word in analyser.words.items():
+        payloads[shard_of(text, shards)]['words'].append(
+            (text, word.frequency, document_frequency[text], word.sentences)
+        )
+    for sentence, text in enumerate(analyser.sentences):
+        payloads[sentence % shards]['sentences'].append((sentence, text))
+    return payloads
+
+
+def stage(analyser, directory, shards, pool=None):
+    """
+    Stages an Analyser's results in one file per shard,
+    written in parallel by a process pool with processes.stage_shard.
+    Returns the paths of the files.
+    """
+    shards = min(shards, MAX_SHARDS)
+    payloads = partition(analyser, shards)
+    paths = [
+        os.path.join(directory, 'shard{}.sqlite3'.format(i))
+        for i in range(shards)
+    ]
+    if pool is None:
+        with processes.pool(shards) as pool:
+            return list(pool.map(processes.stage_shard, paths, payloads))
+    return list(pool.map(processes.stage_shard, paths, payloads))
+
+
+@contextmanager
+def staging_directory():
+    directory = tempfile.mkdtemp(prefix='staging')
+    try:
+        yield directory
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+@contextmanager
+def attached(paths, using=DEFAULT_DB_ALIAS):
+    """
+    Attaches staging files to the main connection, outside any transaction.
+    Yields their schema names.
+    """
+    schemas = ['staging{}'.format(i) for i in range(len(paths))]
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        for path, schema in zip(paths, schemas):
+            cursor.execute('ATTACH DATABASE %s AS {}'.format(schema), [path])
+    try:
+        yield schemas
+    finally:
+        with connection.cursor() as cursor:
+            for schema in schemas:
+                cursor.execute('DETACH DATABASE {}'.format(schema))
+
+
+def merge(schemas, documents, using=DEFAULT_DB_ALIAS):
+    """
+    Merges attached staging files into the main tables
+    with a few INSERT ... SELECT statements per shard.
+    Words and sentences that exist are reused, word frequencies
+    are added to. documents maps names to Document ids.
+    Must run in the transaction of the save.
+    """
+    word = Word._meta.db_table
+    sentence = Sentence._meta.db_table
+    sentence_word = Sentence.words.through._meta.db_table
+    document_word = DocumentWord._meta.db_table
+    occurrence = SentenceOccurrence._meta.db_table
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMP TABLE staged_word_id '
+            '(text TEXT PRIMARY KEY, id INTEGER)'
+        )
+        cursor.execute(
+            'CREATE TEMP TABLE staged_sentence_id '
+            '(sentence INTEGER PRIMARY KEY, id INTEGER)'
+        )
+        cursor.execute(
+            'CREATE TEMP TABLE staged_document_id '
+            '(name TEXT PRIMARY KEY, id INTEGER)'
+        )
+        cursor.executemany(
+            'INSERT INTO temp.staged_document_id VALUES (%s, %s)',
+            list(documents.items())
+        )
+
+        for schema in schemas:
+            cursor.execute(
+                'INSERT OR IGNORE INTO {word} '
+                '(text, total_frequency, document_frequency) '
+                'SELECT text, 0, 0 FROM {schema}.staged_word'
+                .format(word=word, schema=schema)
+            )
+            cursor.execute(
+                'UPDATE {word} SET '
+                'total_frequency = total_frequency + ('
+                'SELECT frequency FROM {schema}.staged_word s '
+                'WHERE s.text = {word}.text), '
+                'document_frequency = document_frequency + ('
+                'SELECT document_frequency FROM {schema}.staged_word s '
+                'WHERE s.text = {word}.text) '
+                'WHERE text IN (SELECT text FROM {schema}.staged_word)'
+                .format(word=word, schema=schema)
+            )
+            cursor.execute(
+                'INSERT INTO temp.staged_word_id '
+                'SELECT w.text, w.id FROM {schema}.staged_word s '
+                'JOIN {word} w ON w.text = s.text'
+                .format(word=word, schema=schema)
+            )
+            cursor.execute(
+                'INSERT OR IGNORE INTO {sentence} (text, text_hash) '
+                'SELECT text, text_hash FROM {schema}.staged_sentence '
+                'ORDER BY id'
+                .format(sentence=sentence, schema=schema)
+            )
+            cursor.execute(
+                'INSERT INTO temp.staged_sentence_id '
+                'SELECT s.id, m.id FROM {schema}.staged_sentence s '
+                'JOIN {sentence} m ON m.text_hash = s.text_hash'
+                .format(sentence=sentence, schema=schema)
+            )
+
+        for schema in schemas:
+            cursor.execute(
+                'INSERT OR IGNORE INTO {sentence_word} (sentence_id, word_id) '
+                'SELECT s.id, w.id FROM {schema}.staged_sentence_word r '
+                'JOIN temp.staged_sentence_id s ON s.sentence = r.sentence '
+                'JOIN temp.staged_word_id w ON w.text = r.text'
+                .format(sentence_word=sentence_word, schema=schema)
+            )
+            cursor.execute(
+                'INSERT INTO {document_word} '
+                '(word_id, document_id, frequency) '
+                'SELECT w.id, d.id, r.frequency '
+                'FROM {schema}.staged_document_word r '
+                'JOIN temp.staged_word_id w ON w.text = r.text '
+                'JOIN temp.staged_document_id d ON d.name = r.document'
+                .format(document_word=document_word, schema=schema)
+            )
+            cursor.execute(
+                'INSERT INTO {occurrence} (document_id, sentence_id, count) '
+                'SELECT d.id, s.id, r.count FROM {schema}.staged_occurrence r '
+                'JOIN temp.staged_sentence_id s ON s.sentence = r.sentence '
+                'JOIN temp.staged_document_id d ON d.name = r.document'
+                .format(occurrence=occurrence, schema=schema)
+            )
+
+        for table in (
+            'staged_word_id',
+            'staged_sentence_id',
+            'staged_document_id'
+        ):
+            cursor.execute('DROP TABLE temp.{}'.format(table))
+
+
+def create_documents(analyser):
+    """
+    Creates the Document records of an Analyser's results.
+    Returns a dict of document name to id.
+    """
+    ids = {}
+    for name, data in analyser.document_data.items():
+        ids[name] = Document.objects.create(
+            name=name,
+            content_hash=data.content_hash,
+            word_count=len(data.word_frequency),
+            token_count=sum(data.word_frequency.values()),
+            sentence_count=len(data.sentences)
+        ).id
+    return ids
@@ -1,16 +1,101 @@
+import csv
+import gzip
+import io
+import json
+import math
+import numpy
 import os
+import pickle
+import tempfile
+import tracemalloc
+import zlib
 import spacy
-from django.test import TestCase
+from array import array
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.http import StreamingHttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
 from spacy.lang.en import English
+from spacy.tokens import Doc
 from spacy.lang.en.stop_words import STOP_WORDS
+from django.urls import reverse
+from django.views.generic.list import ListView
+from django.utils import timezone
 from .models import (
     Word,
     Sentence,
-    Document
+    Document,
+    DocumentWord,
+    SentenceOccurrence,
+    CorpusStats,
+    IngestionJob,
+    IngestionRun,
+    WordAssociation,
+    DocumentKeyword,
 )
-from .analyser import TempWord, Analyser
+from .analyser import TempWord, Analyser, get_nlp
+from . import (
+    api,
+    benchmark,
+    caching,
+    cooccurrence,
+    database,
+    exports,
+    filters,
+    ingestion,
+    processes,
+    search,
+    snapshots,
+    staging,
+    tfidf,
+    views,
+)
+from .instrumentation import Instrumentation
+from .management.commands.benchmark import Command as BenchmarkCommand
+from .parse_cache import ParseCache, parse_mode
+
+# Every test class uses a local memory cache,
+# so tests never read or clear the project's view cache.
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+def merge_document(
+        analyser, name, sentences, words, counts=None, content_hash=None):
+    """
+    Merges a document into an Analyser as if it had been parsed.
+    words maps each word to its frequency and the ids of its sentences.
+    Each sentence occurs once unless counts are given,
+    and the content hash is the name unless one is given.
+    Returns the Analyser.
+    """
+    if counts is None:
+        counts = [1] * len(sentences)
+    if content_hash is None:
+        content_hash = name
+    analyser.merge_partial((
+        name,
+        content_hash,
+        sentences,
+        counts,
+        {
+            word: (frequency, array('I', ids))
+            for word, (frequency, ids) in words.items()
+        }
+    ))
+    return analyser
 
 
+@override_settings(ANALYSER_CACHE_DIR=None, CACHES=TEST_CACHES)
 class AnalyserTests(TestCase):
     """
     Tests the Analyser class
@@ -18,49 +103,49 @@ class AnalyserTests(TestCase):
 
     def test_parse_token(self):
         analyser = Analyser()
-        nlp = spacy.load('en_core_web_sm')
+        nlp = get_nlp()
         doc = nlp("Word.")
         token = doc[0]
         temp_word = analyser.parse_token(token)
         self.assertTrue(isinstance(temp_word, TempWord))
         self.assertEqual(len(analyser.words), 1)
-        self.assertTrue("Word." in temp_word.sentences)
+        self.assertTrue("Word." in analyser.sentence_texts(temp_word.sentences))
         self.assertEqual(temp_word.text, "word")
         self.assertEqual(temp_word.frequency, 1)
 
     def test_parse_two_different_tokens(self):
         analyser = Analyser()
-        nlp = spacy.load('en_core_web_sm')
+        nlp = get_nlp()
         doc = nlp("Word second.")
         word = analyser.parse_token(doc[0])
         second = analyser.parse_token(doc[1])
         self.assertEqual(len(analyser.words), 2)
-        self.assertTrue("Word second." in word.sentences)
+        self.assertTrue("Word second." in analyser.sentence_texts(word.sentences))
         self.assertEqual(word.text, "word")
         self.assertEqual(word.frequency, 1)
-        self.assertTrue("Word second." in second.sentences)
+        self.assertTrue("Word second." in analyser.sentence_texts(second.sentences))
         self.assertEqual(second.text, "second")
         self.assertEqual(second.frequency, 1)
 
     def test_parse_two_same_tokens(self):
         analyser = Analyser()
-        nlp = spacy.load('en_core_web_sm')
+        nlp = get_nlp()
         doc = nlp("Word word.")
         analyser.parse_token(doc[0])
         word = analyser.parse_token(doc[1])
         self.assertEqual(len(analyser.words), 1)
-        self.assertTrue("Word word." in word.sentences)
+        self.assertTrue("Word word." in analyser.sentence_texts(word.sentences))
         self.assertEqual(word.text, "word")
         self.assertEqual(word.frequency, 2)
 
     def test_parse_two_different_tokens_same_lemma(self):
         analyser = Analyser()
-        nlp = spacy.load('en_core_web_sm')
+        nlp = get_nlp()
         doc = nlp("Word words.")
         analyser.parse_token(doc[0])
         word = analyser.parse_token(doc[1])
         self.assertEqual(len(analyser.words), 1)
-        self.assertTrue("Word words." in word.sentences)
+        self.assertTrue("Word words." in analyser.sentence_texts(word.sentences))
         self.assertEqual(word.text, "word")
         self.assertEqual(word.frequency, 2)
 
@@ -71,14 +156,14 @@ class AnalyserTests(TestCase):
         self.assertTrue('raccoon' in analyser.words)
         raccoon = analyser.words['raccoon']
         self.assertTrue(
-            sentence in raccoon.sentences
+            sentence in analyser.sentence_texts(raccoon.sentences)
         )
         self.assertEqual(len(analyser.words), 2)
         self.assertEqual(raccoon.frequency, 1)
         self.assertTrue('dog' in analyser.words)
         dog = analyser.words['dog']
         self.assertTrue(
-            sentence in dog.sentences
+            sentence in analyser.sentence_texts(dog.sentences)
         )
         self.assertEqual(dog.frequency, 1)
 
@@ -97,6 +182,12 @@ class AnalyserTests(TestCase):
         expected = {'raccoon', 'dog'}
         self.assertEqual(expected, output)
 
+    def test_analyser_shares_model(self):
+        first = Analyser()
+        second = Analyser()
+        self.assertIs(first.nlp, second.nlp)
+        self.assertNotIn('ner', first.nlp.pipe_names)
+
     def test_absolute_path(self):
         analyser = Analyser()
         path = 'test_docs/universe.txt'
@@ -110,6 +201,86 @@ class AnalyserTests(TestCase):
         self.assertTrue('Universe' in text)
         self.assertEqual(filename, 'universe.txt')
 
+    def test_get_document_chunks(self):
+        analyser = Analyser()
+        path = 'test_docs/universe.txt'
+        text, _ = analyser.get_document_data(path)
+        chunks = list(analyser.get_document_chunks(path, chunk_size=10))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(''.join(chunks), text)
+
+    def test_get_document_chunks_without_newlines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'long.txt')
+            text = 'The universe is big. ' * 50
+            with open(path, 'w', encoding='utf8') as d:
+                d.write(text)
+            chunks = list(Analyser(cache=None).get_document_chunks(
+                path, chunk_size=10
+            ))
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(all(len(chunk) <= 40 for chunk in chunks))
+        self.assertTrue(all(chunk.endswith(' ') for chunk in chunks))
+        self.assertEqual(''.join(chunks), text)
+
+    def test_get_document_chunks_end_on_sentences(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'long.txt')
+            text = 'The universe is big, and it keeps on growing. ' * 20
+            with open(path, 'w', encoding='utf8') as d:
+                d.write(text.replace('. The', '.\nThe', 5))
+            chunks = list(Analyser(cache=None).get_document_chunks(
+                path, chunk_size=50
+            ))
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(all(
+            chunk.rstrip().endswith('growing.') for chunk in chunks
+        ))
+
+    def assertSameParse(self, analyser, streamed, filename):
+        self.assertEqual(
+            {
+                text: (word.frequency, analyser.sentence_texts(word.sentences))
+                for text, word in analyser.words.items()
+            },
+            {
+                text: (word.frequency, streamed.sentence_texts(word.sentences))
+                for text, word in streamed.words.items()
+            }
+        )
+        self.assertEqual(
+            analyser.sentence_texts(
+                analyser.document_data[filename].sentences),
+            streamed.sentence_texts(
+                streamed.document_data[filename].sentences)
+        )
+
+    @override_settings(ANALYSER_CHUNK_SIZE=100)
+    def test_parse_document_stream_without_newlines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'long.txt')
+            with open(path, 'w', encoding='utf8') as d:
+                d.write(
+                    'The universe is big, and it keeps on growing. ' * 50
+                )
+            analyser = Analyser()
+            analyser.parse_document(path, stream=False)
+            streamed = Analyser()
+            streamed.parse_document(path, stream=True)
+        self.assertEqual(streamed.words['universe'].frequency, 50)
+        self.assertSameParse(analyser, streamed, 'long.txt')
+
+    def test_parse_document_stream(self):
+        analyser = Analyser()
+        analyser.parse_document('test_docs/universe.txt')
+        streamed = Analyser()
+        # Small enough for two chunks, large enough to hold a line.
+        with self.settings(ANALYSER_CHUNK_SIZE=25):
+            streamed.parse_document('test_docs/universe.txt', stream=True)
+        # One read per chunk, and the one that finds the end.
+        self.assertEqual(streamed.instrumentation.calls['read'], 3)
+        self.assertSameParse(analyser, streamed, 'universe.txt')
+
     def test_parse_document(self):
         analyser = Analyser()
         path = 'test_docs/universe.txt'
@@ -119,6 +290,25 @@ class AnalyserTests(TestCase):
         universe = analyser.words['universe']
         self.assertTrue(universe.sentences)
 
+    def test_parse_doc_matches_parse_token(self):
+        analyser = Analyser()
+        analyser.parse_document('test_docs/other_people.txt')
+        text, _ = analyser.get_document_data('test_docs/other_people.txt')
+        by_token = Analyser()
+        for token in get_nlp()(text):
+            if token.is_alpha and token.lower_ not in STOP_WORDS:
+                by_token.parse_token(token)
+        self.assertEqual(
+            {
+                text: (word.frequency, analyser.sentence_texts(word.sentences))
+                for text, word in analyser.words.items()
+            },
+            {
+                text: (word.frequency, by_token.sentence_texts(word.sentences))
+                for text, word in by_token.words.items()
+            }
+        )
+
     def test_parse_two_documents(self):
         analyser = Analyser()
         analyser.parse_document('test_docs/universe.txt')
@@ -138,12 +328,74 @@ class AnalyserTests(TestCase):
         universe = analyser.words['universe']
         self.assertEqual(len(universe.sentences), 2)
 
+    def test_sentences_interned(self):
+        analyser = Analyser()
+        analyser.parse_sentence('Raccoon dog.')
+        raccoon = analyser.words['raccoon']
+        dog = analyser.words['dog']
+        self.assertEqual(list(raccoon.sentences), list(dog.sentences))
+        self.assertEqual(analyser.sentences, ['Raccoon dog.'])
+
+    def test_temp_word_add_sentence(self):
+        word = TempWord()
+        for sentence_id in (0, 0, 2, 1, 2):
+            word.add_sentence(sentence_id)
+        self.assertEqual(list(word.sentences), [0, 1, 2])
+
+    def test_temp_word_add_sentences(self):
+        word = TempWord()
+        word.add_sentences([3, 5])
+        word.add_sentences([6, 8])
+        word.add_sentences([0, 5, 7])
+        self.assertEqual(list(word.sentences), [0, 3, 5, 6, 7, 8])
+
     def test_analyser_document_sents(self):
         analyser = Analyser()
         analyser.parse_document('test_docs/universe.txt')
         self.assertEqual(
             len(analyser.document_data['universe.txt'].sentences), 2)
 
+    def test_merge_partial(self):
+        worker = Analyser()
+        filename = worker.parse_document('test_docs/universe.txt')
+        analyser = Analyser()
+        analyser.parse_document('test_docs/other_people.txt')
+        analyser.merge_partial(worker.partial(filename))
+        universe = analyser.words['universe']
+        self.assertEqual(len(universe.sentences), 2)
+        self.assertEqual(universe.frequency, 2)
+        self.assertEqual(
+            len(analyser.document_data['universe.txt'].sentences), 2)
+
+    def test_parse_documents_in_workers(self):
+        paths = ['test_docs/universe.txt', 'test_docs/other_people.txt']
+        serial = Analyser()
+        list(serial.parse_documents(paths))
+        parallel = Analyser()
+        list(parallel.parse_documents(paths, workers=2))
+        self.assertEqual(parallel.instrumentation.counters['documents'], 2)
+        self.assertEqual(
+            parallel.instrumentation.counters['tokens'],
+            serial.instrumentation.counters['tokens']
+        )
+        self.assertGreater(parallel.instrumentation.counters['tokens'], 0)
+        self.assertEqual(
+            {text: word.frequency for text, word in serial.words.items()},
+            {text: word.frequency for text, word in parallel.words.items()}
+        )
+
+
+    def test_parse_documents_in_spawned_workers(self):
+        paths = ['test_docs/universe.txt', 'test_docs/other_people.txt']
+        serial = Analyser()
+        list(serial.parse_documents(paths))
+        parallel = Analyser()
+        with self.settings(WORKER_START_METHOD='spawn'):
+            list(parallel.parse_documents(paths, workers=2))
+        self.assertEqual(
+            {text: word.frequency for text, word in serial.words.items()},
+            {text: word.frequency for text, word in parallel.words.items()}
+        )
     def test_save_data_single_sentence_document(self):
         analyser = Analyser()
         analyser.parse_document('test_docs/garden.txt')
@@ -154,7 +406,7 @@ class AnalyserTests(TestCase):
         self.assertEqual(len(word.document_set.all()), 1)
         sentence = word.sentence_set.first()
         document = Document.objects.get(name='garden.txt')
-        self.assertEqual(sentence.document, document)
+        self.assertEqual(list(sentence.documents.all()), [document])
 
     def test_save_data_two_documents(self):
         analyser = Analyser()
@@ -168,7 +420,223 @@ class AnalyserTests(TestCase):
         self.assertEqual(len(Document.objects.all()), 2)
         self.assertEqual(len(Sentence.objects.all()), 5)
 
+    def test_save_data_replaces_document(self):
+        for _ in range(2):
+            analyser = Analyser()
+            analyser.parse_document('test_docs/universe.txt')
+            analyser.save_data()
+        universe = Word.objects.get(text='universe')
+        self.assertEqual(universe.total_frequency, 1)
+        self.assertEqual(len(Document.objects.all()), 1)
+        self.assertEqual(len(Sentence.objects.all()), 2)
+        self.assertEqual(CorpusStats.load().documents, 1)
+
+    def test_changed_documents(self):
+        analyser = Analyser()
+        path = analyser.absolute_path('test_docs/universe.txt')
+        self.assertEqual(analyser.changed_documents([path]), [path])
+        Document.objects.create(
+            name='universe.txt',
+            content_hash=analyser.file_hash(path)
+        )
+        self.assertEqual(analyser.changed_documents([path]), [])
+        Document.objects.update(content_hash='outdated')
+        self.assertEqual(analyser.changed_documents([path]), [path])
+
+    def test_save_data_stats(self):
+        analyser = Analyser()
+        analyser.parse_document('test_docs/universe.txt')
+        analyser.parse_document('test_docs/other_people.txt')
+        analyser.save_data()
+        document = Document.objects.get(name='universe.txt')
+        self.assertEqual(document.word_count, 9)
+        self.assertEqual(document.sentence_count, 2)
+        self.assertEqual(
+            document.token_count,
+            sum(analyser.document_data['universe.txt'].word_frequency.values())
+        )
+        corpus = CorpusStats.load()
+        self.assertEqual(corpus.documents, 2)
+        self.assertEqual(corpus.words, Word.objects.count())
+        self.assertEqual(corpus.sentences, 5)
+
+    def test_save_data_twice(self):
+        first = Analyser()
+        first.parse_document('test_docs/universe.txt')
+        first.save_data()
+        second = Analyser()
+        second.parse_document('test_docs/other_people.txt')
+        second.save_data()
+        universe = Word.objects.get(text='universe')
+        self.assertEqual(universe.total_frequency, 2)
+        self.assertEqual(len(universe.sentence_set.all()), 2)
+        self.assertEqual(len(Word.objects.filter(text='universe')), 1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestParseCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ParseCache(self.directory.name, 1024 ** 2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_missing(self):
+        self.assertIsNone(self.cache.get('missing'))
+
+    def test_set_get(self):
+        sentences = ['Raccoon dog.', 'Dog.']
+        words = {
+            'raccoon': (1, array('I', [0])),
+            'dog': (2, array('I', [0, 1])),
+        }
+        self.cache.set('hash', sentences, [1, 1], words)
+        self.assertEqual(
+            self.cache.get('hash'),
+            (sentences, [1, 1], words)
+        )
+
+    def test_evict(self):
+        self.cache.max_size = 0
+        self.cache.set('hash', ['Dog.'], [1], {'dog': (1, array('I', [0]))})
+        self.assertIsNone(self.cache.get('hash'))
+
+    def test_evict_only_over_max_size(self):
+        words = {'dog': (1, array('I', [0]))}
+        with mock.patch.object(
+                self.cache, 'scan', wraps=self.cache.scan) as scan:
+            for i in range(5):
+                self.cache.set('hash{}'.format(i), ['Dog.'], [1], words)
+            self.assertEqual(scan.call_count, 1)
+            size = self.cache.size
+            self.cache.set('hash0', ['Dog.'], [1], words)
+            self.assertEqual(self.cache.size, size)
+            self.cache.max_size = size * 2
+            sentences = ['Dog {}.'.format(i) for i in range(1000)]
+            self.cache.set('large', sentences, [1] * 1000, words)
+            self.assertEqual(scan.call_count, 2)
+        self.assertLessEqual(self.cache.size, self.cache.max_size)
+        self.assertEqual(self.cache.size, self.cache.scan()[1])
+
+    def test_resync_size(self):
+        # Other processes fill the cache without this one's running total
+        # seeing it, each staying under the budget on its own count.
+        other = ParseCache(self.directory.name, self.cache.max_size * 10)
+        words = {'dog': (1, array('I', [0]))}
+        sentences = [os.urandom(50).hex() for i in range(1000)]
+        self.cache.set('hash', ['Dog.'], [1], words)
+        for i in range(40):
+            other.set('other{}'.format(i), sentences, [1] * 1000, words)
+        self.assertGreater(self.cache.scan()[1], self.cache.max_size)
+        for i in range(3):
+            self.cache.set('hash{}'.format(i), sentences, [1] * 1000, words)
+        self.assertLessEqual(self.cache.scan()[1], self.cache.max_size)
+
+    def test_parse_mode(self):
+        words = {'dog': (1, array('I', [0]))}
+        self.cache.set('hash', ['Dog.'], [1], words, parse_mode(False))
+        self.assertIsNotNone(self.cache.get('hash', parse_mode(False)))
+        self.assertIsNone(self.cache.get('hash', parse_mode(True)))
+        with self.settings(ANALYSER_CHUNK_SIZE=1000):
+            self.assertNotEqual(parse_mode(True), parse_mode(None))
+            mode = parse_mode(True)
+        self.assertNotEqual(parse_mode(True), mode)
+
+    def test_no_pickle(self):
+        path = self.cache.path(self.cache.key('hash'))
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(zlib.compress(pickle.dumps(('a', 'b', 'c'))))
+        self.assertIsNone(self.cache.get('hash'))
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(ParseCache.from_settings())
+
+    def test_parse_document_from_cache(self):
+        path = 'test_docs/garden.txt'
+        analyser = Analyser(cache=self.cache)
+        content_hash = analyser.file_hash(path)
+        self.cache.set(
+            content_hash,
+            ['A garden.'],
+            [1],
+            {'garden': (3, array('I', [0]))},
+            parse_mode(None)
+        )
+        analyser.parse_document(path)
+        garden = analyser.words['garden']
+        self.assertEqual(garden.frequency, 3)
+        self.assertEqual(
+            analyser.sentence_texts(garden.sentences),
+            {'A garden.'}
+        )
+        self.assertEqual(
+            analyser.document_data['garden.txt'].content_hash,
+            content_hash
+        )
+        self.assertIsNone(analyser._nlp)
 
+
+@override_settings(CACHES=TEST_CACHES)
+class TestProcesses(TestCase):
+
+    @override_settings(WORKER_START_METHOD='spawn', TOKEN_DENY=['Cat'])
+    def test_spawned_worker_setup(self):
+        # The worker loads the apps and sees the overridden settings.
+        with processes.pool(1) as pool:
+            config = pool.submit(filters.config).result()
+        self.assertEqual(config['deny'], ['cat'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestSentenceOccurrences(TestCase):
+
+    def save(self, *documents):
+        analyser = Analyser(cache=None)
+        for name, sentences, counts in documents:
+            words = {'dog': (sum(counts), range(len(sentences)))}
+            merge_document(analyser, name, sentences, words, counts)
+        analyser.save_data()
+
+    def test_shared_sentence(self):
+        self.save(
+            ('a.txt', ['Dog.', 'A dog.'], [2, 1]),
+            ('b.txt', ['Dog.'], [1])
+        )
+        sentence = Sentence.objects.get(text='Dog.')
+        self.assertEqual(Sentence.objects.count(), 2)
+        self.assertEqual(
+            sorted(d.name for d in sentence.documents.all()),
+            ['a.txt', 'b.txt']
+        )
+        occurrence = SentenceOccurrence.objects.get(
+            sentence=sentence,
+            document__name='a.txt'
+        )
+        self.assertEqual(occurrence.count, 2)
+
+    def test_reingest_keeps_shared_sentence(self):
+        self.save(
+            ('a.txt', ['Dog.', 'A dog.'], [1, 1]),
+            ('b.txt', ['Dog.'], [1])
+        )
+        self.save(('a.txt', ['Dogs.'], [1]))
+        self.assertEqual(
+            sorted(Sentence.objects.values_list('text', flat=True)),
+            ['Dog.', 'Dogs.']
+        )
+        sentence = Sentence.objects.get(text='Dog.')
+        self.assertEqual(
+            [d.name for d in sentence.documents.all()],
+            ['b.txt']
+        )
+        self.assertEqual(Word.objects.get(text='dog').total_frequency, 2)
+        self.assertEqual(CorpusStats.load().version, 2)
+
+
+@override_settings(CACHES=TEST_CACHES)
 class TestSpacy(TestCase):
     """
     Exploratory tests.
@@ -231,6 +699,7 @@ class TestSpacy(TestCase):
         self.assertEqual(token.lemma_, "this")
 
 
+@override_settings(CACHES=TEST_CACHES)
 class TestModels(TestCase):
 
     def test_word_relationships(self):
@@ -247,3 +716,1297 @@ class TestModels(TestCase):
         d.words.add(w)
         self.assertEqual(len(w.sentence_set.all()), 2)
         self.assertEqual(len(w.document_set.all()), 1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestDownload(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # Counted queries are the view's own, not the version lookup.
+        caching.corpus_version()
+        self.document = Document.objects.create(name='doc.txt')
+        other = Document.objects.create(name='other.txt')
+        for text in ('cat', 'dog', 'bird'):
+            w = Word.objects.create(text=text, total_frequency=2)
+            s1 = Sentence.objects.create(text='A {} here. '.format(text))
+            s2 = Sentence.objects.create(text='A {} there.'.format(text))
+            s1.documents.add(self.document)
+            s2.documents.add(other)
+            s1.words.add(w)
+            s2.words.add(w)
+            DocumentWord.objects.create(
+                word=w, document=self.document, frequency=1)
+            DocumentWord.objects.create(
+                word=w, document=other, frequency=1)
+
+    def download(self, doc_id):
+        response = self.client.get(reverse('download', args=[doc_id]))
+        return b''.join(response.streaming_content).decode()
+
+    def test_download_all(self):
+        with self.assertNumQueries(4):
+            out = self.download(0)
+        self.assertTrue(out.startswith('All word data:\n\n'))
+        self.assertIn(
+            'cat\n'
+            '\tFrequency: 2\n'
+            '\tFound in: doc.txt, other.txt\n'
+            '\tSentences:\n',
+            out
+        )
+        self.assertIn('\t\tA cat here.\n', out)
+        self.assertIn('\t\tA cat there.\n', out)
+
+    def test_download_document(self):
+        with self.assertNumQueries(4):
+            out = self.download(self.document.id)
+        self.assertEqual(
+            out,
+            'Word data for doc.txt:\n\n'
+            'cat\n\tFrequency: 1\n\tSentences:\n\t\tA cat here.\n\n'
+            'dog\n\tFrequency: 1\n\tSentences:\n\t\tA dog here.\n\n'
+            'bird\n\tFrequency: 1\n\tSentences:\n\t\tA bird here.\n\n'
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestListViews(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # Counted queries are the view's own, not the version lookup.
+        caching.corpus_version()
+        self.document = Document.objects.create(name='doc.txt', word_count=20)
+        for i in range(20):
+            w = Word.objects.create(
+                text='word{}'.format(i),
+                total_frequency=i % 3
+            )
+            s = Sentence.objects.create(text='Sentence {}.'.format(i))
+            s.documents.add(self.document)
+            s.words.add(w)
+            DocumentWord.objects.create(
+                word=w, document=self.document, frequency=1)
+
+    def test_version_published_while_reading(self):
+        cache.clear()
+        stats = CorpusStats.objects.filter
+
+        def publish(*args, **kwargs):
+            # Another process saves between the read and caching it.
+            caching.set_corpus_version(2)
+            return stats(*args, **kwargs)
+
+        with mock.patch.object(
+                CorpusStats.objects, 'filter', side_effect=publish):
+            self.assertEqual(caching.corpus_version(), 2)
+        self.assertEqual(caching.corpus_version(), 2)
+
+    def test_word_list_queries(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('word-list'))
+        self.assertContains(response, 'Found in: doc.txt')
+        self.assertContains(response, 'Sentence 0.')
+
+    def test_word_list_sort(self):
+        response = self.client.get(reverse('word-list'), {'sort': 'frequency'})
+        words = list(response.context['word_list'])
+        self.assertEqual(words[0].total_frequency, 2)
+        self.assertEqual(words[-1].total_frequency, 1)
+
+    def test_word_list_keyset(self):
+        expected = list(
+            Word.objects.order_by('-total_frequency', 'id')
+            .values_list('text', flat=True)
+        )
+        url = reverse('word-list')
+        response = self.client.get(url, {'sort': 'frequency'})
+        texts = [w.text for w in response.context['word_list']]
+        cursor = response.context['next_cursor']
+        while cursor:
+            with self.assertNumQueries(4):
+                response = self.client.get(
+                    url,
+                    {'sort': 'frequency', 'after': cursor}
+                )
+            texts += [w.text for w in response.context['word_list']]
+            cursor = response.context['next_cursor']
+        self.assertEqual(texts, expected)
+
+    def test_word_list_next_link_uses_cursor(self):
+        response = self.client.get(reverse('word-list'), {'sort': 'frequency'})
+        cursor = response.context['next_cursor']
+        self.assertIsNotNone(cursor)
+        self.assertContains(
+            response,
+            'href="?sort=frequency&after={}"'.format(cursor)
+        )
+        self.assertNotContains(response, '&page=')
+
+    def test_word_list_invalid_cursor(self):
+        response = self.client.get(reverse('word-list'), {'after': 'x'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_document_word_list_queries(self):
+        url = reverse('document-word-list', args=[self.document.id])
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertContains(response, 'Sentence 0.')
+
+    def test_document_list_queries(self):
+        Document.objects.create(name='empty.txt')
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('document-list'))
+        self.assertEqual(response.context['document_list'][0].word_total(), 20)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestSearch(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.document = Document.objects.create(name='doc.txt')
+        for text in ('garden', 'gardener', 'guard', 'regard'):
+            Word.objects.create(text=text)
+        Sentence.objects.create(text='The garden is green.')
+        Sentence.objects.create(text='A guard stood by the gate.')
+        search.index(Word.objects.all())
+        search.index(Sentence.objects.all())
+
+    def texts(self, words):
+        return [w.text for w in words]
+
+    def test_search_words_prefix(self):
+        self.assertEqual(
+            self.texts(search.search_words('gard')),
+            ['garden', 'gardener']
+        )
+
+    def test_search_words_substring(self):
+        self.assertEqual(
+            self.texts(search.search_words('ard', substring=True)),
+            ['garden', 'gardener', 'guard', 'regard']
+        )
+
+    def test_search_sentences(self):
+        sentences = search.search_sentences('the gate')
+        self.assertEqual(
+            [s.text for s in sentences],
+            ['A guard stood by the gate.']
+        )
+
+    def test_is_enabled_once_per_connection(self):
+        search.forget_tables(sender=None, connection=connection)
+        with self.assertNumQueries(1):
+            self.assertTrue(search.is_enabled())
+            self.assertTrue(search.is_enabled())
+
+    def test_match_ids_reads_routed_database(self):
+        aliases = []
+
+        class Connections:
+            def __getitem__(self, alias):
+                aliases.append(alias)
+                return connection
+
+        with mock.patch.object(search, 'connections', Connections()), \
+                mock.patch.object(
+                    search.router, 'db_for_read', return_value='replica'):
+            ids = search.match_ids(Sentence, 'gate', 10)
+        self.assertEqual(aliases, ['replica'])
+        self.assertEqual(len(ids), 1)
+
+    def test_unindex(self):
+        search.unindex(Sentence.objects.filter(text__startswith='A guard'))
+        self.assertEqual(search.search_sentences('gate'), [])
+
+    def test_search_json(self):
+        response = self.client.get(
+            reverse('search-json'),
+            {'q': 'garden', 'mode': 'sentence'}
+        )
+        self.assertEqual(
+            response.json()['sentences'][0]['text'],
+            'The garden is green.'
+        )
+
+    def test_search_view(self):
+        response = self.client.get(reverse('search'), {'q': 'reg'})
+        self.assertContains(response, 'regard')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestIngestion(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(
+            MEDIA_ROOT=os.path.join(self.directory.name, 'media'),
+            ANALYSER_CACHE_DIR=os.path.join(self.directory.name, 'cache')
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.directory.cleanup()
+
+    def upload(self, name, content=b'A dog.', **kwargs):
+        return self.client.post(
+            reverse('upload'),
+            {'files': SimpleUploadedFile(name, content)},
+            **kwargs
+        )
+
+    def test_upload_queues_job(self):
+        response = self.upload('dog.txt', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 202)
+        job = IngestionJob.objects.get()
+        self.assertEqual(response.json()['jobs'][0]['id'], job.id)
+        self.assertEqual(job.name, 'dog.txt')
+        self.assertEqual(job.status, IngestionJob.QUEUED)
+        with job.file.open() as f:
+            self.assertEqual(f.read(), b'A dog.')
+
+    def test_upload_rejects_long_names(self):
+        response = self.upload('a_very_long_name.txt')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(IngestionJob.objects.exists())
+
+    def test_job_status(self):
+        self.upload('a.txt')
+        self.upload('b.txt')
+        job = IngestionJob.objects.get(name='b.txt')
+        response = self.client.get(reverse('job-status', args=[job.id]))
+        self.assertEqual(response.json()['status'], 'queued')
+        self.assertEqual(response.json()['position'], 2)
+
+    def test_claim_jobs(self):
+        for name in ('a.txt', 'b.txt', 'a.txt'):
+            self.upload(name)
+        jobs = ingestion.claim_jobs(3)
+        self.assertEqual([job.name for job in jobs], ['a.txt', 'b.txt'])
+        self.assertEqual(
+            IngestionJob.objects.filter(status=IngestionJob.PARSING).count(),
+            2
+        )
+        jobs = ingestion.claim_jobs(3)
+        self.assertEqual([job.name for job in jobs], ['a.txt'])
+        self.assertEqual(ingestion.claim_jobs(3), [])
+
+    @override_settings(INGEST_JOB_TIMEOUT=60)
+    def test_claim_jobs_requeues_stale_jobs(self):
+        self.upload('a.txt')
+        self.upload('b.txt')
+        stale, recent = ingestion.claim_jobs(2)
+        IngestionJob.objects.update(
+            started=timezone.now() - timedelta(seconds=120)
+        )
+        IngestionJob.objects.filter(id=stale.id).update(
+            status=IngestionJob.SAVING,
+            heartbeat=timezone.now() - timedelta(seconds=61)
+        )
+        # Running longer than the timeout, but with a recent heartbeat.
+        ingestion.heartbeat([recent])
+        jobs = ingestion.claim_jobs(2)
+        self.assertEqual([job.id for job in jobs], [stale.id])
+        recent.refresh_from_db()
+        self.assertEqual(recent.status, IngestionJob.PARSING)
+
+    def test_worker_rebuilds_once_per_interval(self):
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            self.upload(name)
+
+        def process_jobs(jobs, **kwargs):
+            ingestion.set_status(jobs, IngestionJob.DONE)
+            return []
+
+        for interval, rebuilds in ((3600, 1), (0, 3)):
+            IngestionJob.objects.update(status=IngestionJob.QUEUED)
+            with mock.patch.object(
+                    ingestion, 'process_jobs', side_effect=process_jobs), \
+                    mock.patch.object(
+                        ingestion, 'after_ingestion') as after_ingestion:
+                call_command(
+                    'ingest_worker',
+                    batch_size=1,
+                    rebuild_interval=interval,
+                    once=True,
+                    stdout=io.StringIO()
+                )
+            self.assertEqual(after_ingestion.call_count, rebuilds)
+
+    def test_worker_replaces_broken_pool(self):
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            self.upload(name)
+
+        def process_jobs(jobs, **kwargs):
+            if len(jobs) > 1:
+                ingestion.set_status(jobs[:1], IngestionJob.DONE)
+                raise BrokenProcessPool()
+            if jobs[0].name == 'c.txt':
+                raise BrokenProcessPool()
+            ingestion.set_status(jobs, IngestionJob.DONE)
+            return []
+
+        out = io.StringIO()
+        with mock.patch.object(
+                ingestion, 'process_jobs', side_effect=process_jobs), \
+                mock.patch.object(ingestion, 'after_ingestion'), \
+                mock.patch(
+                    'word_sentences.management.commands.ingest_worker'
+                    '.worker_pool') as worker_pool:
+            call_command(
+                'ingest_worker',
+                workers=2,
+                once=True,
+                stdout=out,
+                stderr=io.StringIO()
+            )
+        # The first pool, one after the batch and one after c.txt.
+        self.assertEqual(worker_pool.call_count, 3)
+        self.assertIn('File "b.txt" processed.', out.getvalue())
+        self.assertIn('File "c.txt" failed.', out.getvalue())
+        self.assertEqual(
+            dict(IngestionJob.objects.values_list('name', 'status')),
+            {
+                'a.txt': IngestionJob.DONE,
+                'b.txt': IngestionJob.DONE,
+                'c.txt': IngestionJob.FAILED,
+            }
+        )
+        self.assertIn(
+            'BrokenProcessPool',
+            IngestionJob.objects.get(name='c.txt').error
+        )
+
+    def test_worker_stops_if_pool_cannot_start(self):
+        self.upload('a.txt')
+        self.upload('b.txt')
+        process_jobs = mock.Mock(side_effect=BrokenProcessPool())
+        with mock.patch.object(ingestion, 'process_jobs', process_jobs), \
+                mock.patch(
+                    'word_sentences.management.commands.ingest_worker'
+                    '.worker_pool') as worker_pool:
+            # The first pool starts, its replacement doesn't.
+            worker_pool.return_value.submit.return_value.result.side_effect \
+                = [True, BrokenProcessPool()]
+            with self.assertRaises(CommandError):
+                call_command(
+                    'ingest_worker',
+                    workers=2,
+                    once=True,
+                    stdout=io.StringIO(),
+                    stderr=io.StringIO()
+                )
+        self.assertEqual(process_jobs.call_count, 1)
+        self.assertEqual(
+            set(IngestionJob.objects.values_list('status', flat=True)),
+            {IngestionJob.QUEUED}
+        )
+
+    def test_process_jobs(self):
+        self.upload('dog.txt')
+        self.upload('missing.txt')
+        good, bad = ingestion.claim_jobs(2)
+        ParseCache.from_settings().set(
+            Analyser(cache=None).file_hash(good.file.path),
+            ['A dog.'],
+            [1],
+            {'dog': (1, array('I', [0]))},
+            parse_mode(None)
+        )
+        os.remove(bad.file.path)
+        with self.assertLogs('word_sentences.instrumentation'):
+            self.assertEqual(ingestion.process_jobs([good, bad]), [bad])
+        good.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual(good.status, IngestionJob.DONE)
+        self.assertEqual(bad.status, IngestionJob.FAILED)
+        self.assertIn('FileNotFoundError', bad.error)
+        document = Document.objects.get()
+        self.assertEqual(document.name, 'dog.txt')
+        self.assertEqual(Word.objects.get(text='dog').total_frequency, 1)
+        run = IngestionRun.objects.get()
+        self.assertEqual(run.documents, 1)
+        self.assertEqual(run.report['jobs'], [good.id])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestApi(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.document = Document.objects.create(name='doc.txt', word_count=3)
+        for i, text in enumerate(('cat', 'dog', 'bird')):
+            w = Word.objects.create(text=text, total_frequency=i)
+            s = Sentence.objects.create(text='A {}.'.format(text))
+            s.words.add(w)
+            s.documents.add(self.document)
+            DocumentWord.objects.create(
+                word=w, document=self.document, frequency=i)
+
+    def get(self, name, *args, **kwargs):
+        return self.client.get(reverse(name, args=args), kwargs)
+
+    def test_serialize_required(self):
+        class View(api.JsonListMixin, ListView):
+            model = Word
+
+        with self.assertRaises(TypeError):
+            View()
+
+    def test_words(self):
+        data = self.get('api-words', limit=2).json()
+        self.assertEqual([w['text'] for w in data['results']], ['bird', 'cat'])
+        data = self.get('api-words', limit=2, after=data['next']).json()
+        self.assertEqual([w['text'] for w in data['results']], ['dog'])
+        self.assertIsNone(data['next'])
+
+    def test_documents(self):
+        data = self.get('api-documents').json()
+        self.assertEqual(data['results'][0]['name'], 'doc.txt')
+        self.assertEqual(data['corpus']['version'], 0)
+
+    def test_document_words(self):
+        data = self.get('api-document-words', self.document.id).json()
+        self.assertEqual(
+            [(w['text'], w['frequency']) for w in data['results']],
+            [('bird', 2), ('dog', 1), ('cat', 0)]
+        )
+        response = self.get('api-document-words', self.document.id + 1)
+        self.assertEqual(response.status_code, 404)
+
+    def test_sentences(self):
+        word = Word.objects.get(text='dog')
+        data = self.get('api-sentences', word=word.id).json()
+        self.assertEqual(data['results'][0]['text'], 'A dog.')
+        data = self.get('api-sentences', document=self.document.id).json()
+        self.assertEqual(len(data['results']), 3)
+
+    def test_cached_response(self):
+        first = self.get('api-words')
+        with self.assertNumQueries(0):
+            second = self.get('api-words')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_not_modified(self):
+        etag = self.get('api-words')['ETag']
+        response = self.client.get(
+            reverse('api-words'),
+            HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_version_bump(self):
+        etag = self.get('api-words')['ETag']
+        Word.objects.create(text='eel')
+        caching.set_corpus_version(1)
+        response = self.get('api-words')
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('eel', [w['text'] for w in response.json()['results']])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestExports(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(EXPORT_DIR=self.directory.name)
+        self.settings.enable()
+        documents = [
+            Document.objects.create(name='a.txt'),
+            Document.objects.create(name='b.txt'),
+        ]
+        for i, text in enumerate(('cat', 'dog')):
+            w = Word.objects.create(text=text, total_frequency=3)
+            s = Sentence.objects.create(text='A {}.'.format(text))
+            s.words.add(w)
+            for document in documents[i:]:
+                s.documents.add(document)
+                DocumentWord.objects.create(
+                    word=w, document=document, frequency=i + 1)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.directory.cleanup()
+
+    def download(self, export_format):
+        response = self.client.get(
+            reverse('download', args=[0]),
+            {'format': export_format}
+        )
+        return response, b''.join(response.streaming_content)
+
+    def test_txt_matches_streamed(self):
+        _, streamed = self.download('txt')
+        exports.write_exports(0)
+        response, content = self.download('txt')
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertTrue(response.filename.endswith('.txt'))
+        self.assertEqual(content, streamed)
+
+    def test_csv_and_jsonl(self):
+        exports.write_exports(0)
+        _, content = self.download('csv')
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(rows, [
+            ['word', 'document', 'frequency'],
+            ['cat', 'a.txt', '1'],
+            ['cat', 'b.txt', '1'],
+            ['dog', 'b.txt', '2'],
+        ])
+        _, content = self.download('jsonl')
+        lines = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual(lines[1]['word'], 'dog')
+        self.assertEqual(lines[1]['documents'], ['b.txt'])
+        self.assertEqual(lines[1]['sentences'], ['A dog.'])
+
+    def test_matrix(self):
+        exports.write_exports(0)
+        _, content = self.download('npz')
+        data = numpy.load(io.BytesIO(content))
+        matrix = numpy.zeros((len(data['words']), len(data['documents'])))
+        matrix[data['word_index'], data['document_index']] = data['frequency']
+        self.assertEqual(list(data['words']), ['cat', 'dog'])
+        self.assertEqual(matrix.tolist(), [[1, 1], [0, 2]])
+
+    def test_empty_matrix(self):
+        DocumentWord.objects.all().delete()
+        f = io.BytesIO()
+        exports.write_matrix(f)
+        f.seek(0)
+        data = numpy.load(f)
+        self.assertEqual(len(data['word_index']), 0)
+        self.assertEqual(len(data['words']), 2)
+
+    def test_sentences_in_id_order(self):
+        for prefetch in exports.word_prefetches():
+            self.assertEqual(prefetch.queryset.query.order_by, ('id',))
+        prefetch = views.document_sentences(1)
+        self.assertEqual(prefetch.queryset.query.order_by, ('id',))
+
+    def test_gzip(self):
+        with override_settings(EXPORT_COMPRESSION='gzip'):
+            exports.write_exports(0)
+            response, content = self.download('csv')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertTrue(response.filename.endswith('.csv.gz'))
+        self.assertTrue(gzip.decompress(content).startswith(b'word,'))
+
+    def test_not_written(self):
+        response, _ = self.download('txt')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            reverse('download', args=[0]),
+            {'format': 'csv'}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_old_versions_removed(self):
+        exports.write_exports(0)
+        exports.write_exports(1)
+        self.assertIsNotNone(exports.export_path(0, 'txt'))
+        exports.remove_exports(1)
+        self.assertEqual(os.listdir(self.directory.name), ['1'])
+        self.assertIsNone(exports.export_path(0, 'txt'))
+
+    def test_previous_version_served_until_written(self):
+        exports.write_exports(0)
+        path = exports.export_path(0, 'csv')
+        self.assertEqual(exports.export_path(1, 'csv'), path)
+        caching.bump_corpus_version()
+        response, _ = self.download('csv')
+        self.assertEqual(response.status_code, 200)
+        exports.write_exports(1)
+        self.assertNotEqual(exports.export_path(1, 'csv'), path)
+        self.assertEqual(exports.export_path(0, 'csv'), path)
+
+    def test_after_ingestion_only_when_changed(self):
+        with mock.patch.object(exports, 'write_exports') as write_exports:
+            self.assertFalse(ingestion.after_ingestion())
+            write_exports.assert_not_called()
+            caching.bump_corpus_version()
+            self.assertTrue(ingestion.after_ingestion())
+            self.assertEqual(write_exports.call_count, 1)
+            self.assertFalse(ingestion.after_ingestion())
+            self.assertTrue(ingestion.after_ingestion(force=True))
+
+    def test_after_ingestion_writes_exports_before_publishing(self):
+        caching.bump_corpus_version()
+        version = caching.corpus_version()
+
+        def write_exports(next_version):
+            self.assertEqual(caching.corpus_version(), version)
+            self.assertIsNotNone(exports.export_path(version, 'txt'))
+            written.append(next_version)
+
+        exports.write_exports(version)
+        written = []
+        with mock.patch.object(
+                exports, 'write_exports', side_effect=write_exports):
+            ingestion.after_ingestion()
+        self.assertEqual(written, [version + 1])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestReadEigen(TestCase):
+
+    def test_unchanged_documents_are_not_saved(self):
+        out = io.StringIO()
+        with mock.patch.object(
+                Analyser, 'changed_documents', return_value=[]), \
+                mock.patch.object(Analyser, 'save_data') as save_data, \
+                mock.patch.object(ingestion, 'after_ingestion') as after, \
+                self.assertLogs('word_sentences.instrumentation'):
+            call_command('read_eigen', stdout=out)
+        save_data.assert_not_called()
+        after.assert_not_called()
+        self.assertIn('nothing to save', out.getvalue())
+        self.assertFalse(CorpusStats.objects.exists())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestBenchmark(TestCase):
+
+    def test_generate_corpus(self):
+        with tempfile.TemporaryDirectory() as a, \
+                tempfile.TemporaryDirectory() as b:
+            paths = benchmark.generate_corpus(a, documents=3, size=5000)
+            same = benchmark.generate_corpus(b, documents=3, size=5000)
+            self.assertEqual(len(paths), 3)
+            for path, other in zip(paths, same):
+                with open(path) as f, open(other) as g:
+                    text = f.read()
+                    self.assertEqual(text, g.read())
+                self.assertGreaterEqual(len(text), 5000)
+
+    @override_settings(ANALYSER_CACHE_DIR=None, EXPORT_DIR=None)
+    def test_run_benchmarks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = benchmark.generate_corpus(
+                directory, documents=2, size=500)
+            characters = sum(os.path.getsize(path) for path in paths)
+            results = BenchmarkCommand().run_benchmarks(
+                paths,
+                characters,
+                {'workers': 1, 'save_shards': 1, 'repeat': 1}
+            )
+        self.assertEqual(results['parse_document']['documents'], 2)
+        self.assertIn('view:api_words', results)
+        for result in results.values():
+            self.assertGreater(result['peak_memory'], 0)
+        self.assertEqual(Document.objects.count(), 2)
+
+    def test_timing_not_traced(self):
+        with benchmark.Measurement() as m:
+            tracing = tracemalloc.is_tracing()
+        self.assertFalse(tracing)
+        self.assertIsNone(m.result()['peak_memory'])
+        with benchmark.Measurement(trace_memory=True) as memory:
+            [0] * 10000
+        self.assertGreater(m.result(memory)['peak_memory'], 0)
+
+    def test_compare(self):
+        old = {'results': {'save_data': {'seconds': 1.0, 'queries': 10}}}
+        new = {'results': {
+            'save_data': {'seconds': 1.1, 'queries': 20},
+            'parse_document': {'seconds': 5.0},
+        }}
+        self.assertEqual(
+            benchmark.compare(old, new, threshold=0.2),
+            [('save_data', 'queries', 10, 20)]
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestInstrumentation(TestCase):
+
+    def test_nested_stages_are_exclusive(self):
+        instrumentation = Instrumentation()
+        with instrumentation.stage('outer'):
+            with instrumentation.stage('inner'):
+                pass
+            with instrumentation.stage('inner'):
+                pass
+        report = instrumentation.report()
+        self.assertEqual(report['stages']['inner']['calls'], 2)
+        self.assertEqual(report['stages']['outer']['calls'], 1)
+        self.assertLessEqual(
+            report['stages']['inner']['seconds']
+            + report['stages']['outer']['seconds'],
+            report['seconds']
+        )
+
+    def test_timed(self):
+        instrumentation = Instrumentation()
+        self.assertEqual(list(instrumentation.timed('read', [1, 2])), [1, 2])
+        self.assertEqual(instrumentation.calls['read'], 3)
+
+    def test_merge(self):
+        a = Instrumentation()
+        b = Instrumentation()
+        for instrumentation in (a, b):
+            with instrumentation.stage('nlp'):
+                instrumentation.count('tokens', 5)
+        a.merge(b.report())
+        self.assertEqual(a.counters['tokens'], 10)
+        self.assertEqual(a.calls['nlp'], 2)
+
+    def test_save_data(self):
+        analyser = merge_document(
+            Analyser(cache=None),
+            'a.txt',
+            ['Dog.', 'A cat.'],
+            {'dog': (1, [0]), 'cat': (1, [1])}
+        )
+        analyser.save_data()
+        report = analyser.instrumentation.report()
+        for stage in ('merge', 'save:words', 'save:sentences',
+                      'save:documents'):
+            self.assertIn(stage, report['stages'])
+        self.assertGreater(report['counters']['queries'], 0)
+        # 2 words, 2 sentences, 2 links, 1 document, 2 occurrences,
+        # 2 document words and the corpus totals at least.
+        self.assertGreaterEqual(report['counters']['rows_written'], 12)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestCooccurrence(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        analyser = Analyser(cache=None)
+        merge_document(analyser, 'a.txt', ['Dog and cat.', 'Dog alone.'], {
+            'dog': (2, [0, 1]),
+            'cat': (1, [0]),
+        })
+        merge_document(
+            analyser,
+            'b.txt',
+            ['Dog and cat.', 'A bird and a cat.'],
+            {'dog': (1, [0]), 'cat': (2, [0, 1]), 'bird': (1, [1])}
+        )
+        analyser.save_data()
+
+    def association(self, word, other):
+        return WordAssociation.objects.get(word__text=word, other__text=other)
+
+    def test_build(self):
+        self.assertEqual(cooccurrence.build(min_count=1), 4)
+        # Four sentence occurrences, 'Dog and cat.' is in both documents.
+        dog_cat = self.association('dog', 'cat')
+        self.assertEqual(dog_cat.sentence_count, 2)
+        self.assertEqual(dog_cat.document_count, 2)
+        self.assertAlmostEqual(dog_cat.pmi, math.log(2 * 4 / (3 * 3)))
+        cat_bird = self.association('cat', 'bird')
+        self.assertEqual(cat_bird.sentence_count, 1)
+        self.assertEqual(cat_bird.document_count, 1)
+        self.assertAlmostEqual(cat_bird.pmi, math.log(4 / 3))
+        self.assertFalse(WordAssociation.objects.filter(
+            word__text='dog',
+            other__text='bird'
+        ))
+
+    def test_min_count_and_top(self):
+        self.assertEqual(cooccurrence.build(min_count=2), 2)
+        cooccurrence.build(top=1, min_count=1)
+        cat = WordAssociation.objects.filter(word__text='cat')
+        self.assertEqual([a.other.text for a in cat], ['bird'])
+
+    def test_empty(self):
+        Word.objects.all().delete()
+        self.assertEqual(cooccurrence.build(), 0)
+
+    def test_related_words_api(self):
+        cooccurrence.build(min_count=1)
+        cat = Word.objects.get(text='cat')
+        url = reverse('api-related-words', args=[cat.id])
+        # The corpus version and the associations.
+        with self.assertNumQueries(2):
+            data = self.client.get(url).json()
+        self.assertEqual(
+            [w['text'] for w in data['results']],
+            ['bird', 'dog']
+        )
+        response = self.client.get(reverse('word-related', args=[cat.id]))
+        self.assertContains(response, 'Words related to cat')
+
+
+@override_settings(CACHES=TEST_CACHES, KEYWORD_REBUILD_GROWTH=1)
+class TestTfidf(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        tfidf.matrices.clear()
+        self.add('a.txt', 'a', {'dog': 2, 'cat': 1})
+        self.add('b.txt', 'b', {'dog': 1, 'cat': 2, 'bird': 1})
+        self.add('c.txt', 'c', {'fish': 3})
+
+    def add(self, name, content_hash, counts):
+        merge_document(
+            Analyser(cache=None),
+            name,
+            ['A sentence.'],
+            {word: (count, [0]) for word, count in counts.items()},
+            content_hash=content_hash
+        ).save_data()
+
+    def keywords(self, name):
+        return [
+            (k.word.text, k.score)
+            for k in DocumentKeyword.objects.filter(
+                document__name=name
+            ).order_by('-score')
+        ]
+
+    def test_keywords(self):
+        self.assertEqual(tfidf.update_keywords(), 3)
+        self.assertEqual(CorpusStats.load().keyword_documents, 3)
+        keywords = self.keywords('b.txt')
+        self.assertEqual([w for w, _ in keywords], ['cat', 'bird', 'dog'])
+        # Two in three documents have 'cat', one has 'bird'.
+        cat = 2 * (math.log(4 / 3) + 1)
+        bird = math.log(4 / 2) + 1
+        dog = math.log(4 / 3) + 1
+        norm = math.sqrt(cat ** 2 + bird ** 2 + dog ** 2)
+        self.assertAlmostEqual(keywords[0][1], cat / norm)
+        self.assertAlmostEqual(keywords[1][1], bird / norm)
+        self.assertEqual(self.keywords('c.txt'), [('fish', 1.0)])
+
+    def test_top_n(self):
+        tfidf.update_keywords(top=1)
+        self.assertEqual(
+            [w for w, _ in self.keywords('b.txt')],
+            ['cat']
+        )
+
+    def test_incremental_update(self):
+        tfidf.update_keywords()
+        before = self.keywords('a.txt')
+        self.add('d.txt', 'd', {'fish': 1, 'cat': 1})
+        # Only the new document, the corpus has not doubled.
+        self.assertEqual(tfidf.update_keywords(), 1)
+        self.assertEqual(self.keywords('a.txt'), before)
+        self.assertEqual(len(self.keywords('d.txt')), 2)
+        self.assertEqual(tfidf.update_keywords(), 0)
+        self.assertEqual(tfidf.update_keywords(full=True), 4)
+        self.assertNotEqual(self.keywords('a.txt'), before)
+        self.assertEqual(CorpusStats.load().keyword_documents, 4)
+
+    def test_similar_documents(self):
+        a = Document.objects.get(name='a.txt')
+        similar = tfidf.similar_documents(a.id)
+        self.assertEqual([d.name for d, _ in similar], ['b.txt'])
+        self.assertTrue(0 < similar[0][1] < 1)
+        self.assertEqual(tfidf.similar_documents(0), [])
+
+    def test_similar_after_new_version(self):
+        a = Document.objects.get(name='a.txt')
+        tfidf.similar_documents(a.id)
+        self.add('d.txt', 'd', {'dog': 1})
+        caching.set_corpus_version(CorpusStats.load().version)
+        self.assertEqual(
+            [d.name for d, _ in tfidf.similar_documents(a.id)],
+            ['d.txt', 'b.txt']
+        )
+
+    def test_api(self):
+        tfidf.update_keywords()
+        b = Document.objects.get(name='b.txt')
+        data = self.client.get(
+            reverse('api-document-keywords', args=[b.id])
+        ).json()
+        self.assertEqual(
+            [w['text'] for w in data['results']],
+            ['cat', 'bird', 'dog']
+        )
+        data = self.client.get(
+            reverse('api-similar-documents', args=[b.id])
+        ).json()
+        self.assertEqual([d['name'] for d in data['results']], ['a.txt'])
+        response = self.client.get(
+            reverse('api-similar-documents', args=[0])
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('document-similar', args=[b.id]))
+        self.assertContains(response, 'Keywords and similar documents')
+        self.assertContains(response, 'a.txt')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestDatabase(TestCase):
+
+    @override_settings(SQLITE_PRAGMAS={'cache_size': -1234})
+    def test_pragmas(self):
+        database.configure_connection(sender=None, connection=connection)
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -1234)
+
+    def test_router_without_replica(self):
+        router = database.ReadReplicaRouter()
+        with database.reading_replica():
+            self.assertIsNone(router.db_for_read(Word))
+        self.assertEqual(router.db_for_write(Word), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'word_sentences'))
+
+    def test_router_with_replica(self):
+        router = database.ReadReplicaRouter()
+        replica = {database.REPLICA: dict(connection.settings_dict)}
+        with mock.patch.dict(connections.databases, replica):
+            self.assertIsNone(router.db_for_read(Word))
+            with database.reading_replica():
+                self.assertEqual(router.db_for_read(Word), 'replica')
+            self.assertIsNone(router.db_for_read(Word))
+
+    def test_streaming_content_reads_replica(self):
+        def content():
+            yield str(getattr(database.state, 'replica', False))
+
+        response = database.replica_content(StreamingHttpResponse(content()))
+        self.assertEqual(b''.join(response.streaming_content), b'True')
+        self.assertFalse(getattr(database.state, 'replica', False))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestStaging(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def analyser(self, *documents):
+        analyser = Analyser(cache=None)
+        for name, sentences, words in documents:
+            merge_document(analyser, name, sentences, words)
+        return analyser
+
+    def first_batch(self):
+        return self.analyser(
+            ('a.txt', ['Dog and cat.', 'Dog alone.'], {
+                'dog': (2, [0, 1]),
+                'cat': (1, [0]),
+            }),
+            ('b.txt', ['Dog and cat.', 'A bird.'], {
+                'dog': (1, [0]),
+                'cat': (1, [0]),
+                'bird': (1, [1]),
+            }),
+        )
+
+    def second_batch(self):
+        return self.analyser(
+            ('c.txt', ['A bird.', 'A fish.'], {
+                'bird': (1, [0]),
+                'fish': (1, [1]),
+            }),
+        )
+
+    def snapshot(self):
+        return {
+            'words': sorted(Word.objects.values_list(
+                'text', 'total_frequency', 'document_frequency'
+            )),
+            'sentence_words': sorted(
+                Sentence.words.through.objects.values_list(
+                    'sentence__text', 'word__text'
+                )
+            ),
+            'document_words': sorted(DocumentWord.objects.values_list(
+                'document__name', 'word__text', 'frequency'
+            )),
+            'occurrences': sorted(SentenceOccurrence.objects.values_list(
+                'document__name', 'sentence__text', 'count'
+            )),
+            'sentences': Sentence.objects.count(),
+            'stats': CorpusStats.objects.values_list(
+                'documents', 'words', 'tokens', 'sentences'
+            ).get(),
+        }
+
+    def test_shard_of(self):
+        self.assertEqual(
+            staging.shard_of('dog', 4),
+            staging.shard_of('dog', 4)
+        )
+        self.assertLess(staging.shard_of('cat', 3), 3)
+
+    def test_partition(self):
+        payloads = staging.partition(self.first_batch(), 2)
+        self.assertEqual(sum(len(p['words']) for p in payloads), 3)
+        self.assertEqual(sum(len(p['sentences']) for p in payloads), 3)
+        self.assertEqual(sum(len(p['document_words']) for p in payloads), 5)
+        self.assertEqual(sum(len(p['occurrences']) for p in payloads), 4)
+        for i, payload in enumerate(payloads):
+            for text, _, _, _ in payload['words']:
+                self.assertEqual(staging.shard_of(text, 2), i)
+
+    def test_sharded_save_matches_serial_save(self):
+        self.first_batch().save_data()
+        self.second_batch().save_data()
+        expected = self.snapshot()
+        Document.objects.all().delete()
+        Sentence.objects.all().delete()
+        Word.objects.all().delete()
+        CorpusStats.objects.all().delete()
+
+        analyser = self.first_batch()
+        analyser.save_data(shards=3)
+        self.assertIn('save:merge', analyser.instrumentation.stages)
+        self.assertNotIn('save:words', analyser.instrumentation.stages)
+        self.second_batch().save_data(shards=2)
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_sharded_save_in_spawned_workers(self):
+        self.first_batch().save_data()
+        expected = self.snapshot()
+        Document.objects.all().delete()
+        Sentence.objects.all().delete()
+        Word.objects.all().delete()
+        CorpusStats.objects.all().delete()
+
+        with self.settings(WORKER_START_METHOD='spawn'):
+            self.first_batch().save_data(shards=2)
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_sharded_save_replaces_document(self):
+        self.first_batch().save_data(shards=2)
+        self.analyser(
+            ('a.txt', ['A fish.'], {'fish': (2, [0])}),
+        ).save_data(shards=2)
+        self.assertEqual(
+            sorted(Word.objects.values_list('text', 'total_frequency')),
+            [('bird', 1), ('cat', 1), ('dog', 1), ('fish', 2)]
+        )
+        self.assertEqual(Document.objects.count(), 2)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestSnapshots(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def analyser(self, name, sentences, words):
+        return merge_document(
+            Analyser(cache=None),
+            name,
+            sentences,
+            words,
+            content_hash=name + '-hash'
+        )
+
+    def snapshot(self, name, sentences, words):
+        path = self.path(name + '.snapshot')
+        snapshots.write(self.analyser(name, sentences, words), path)
+        return path
+
+    def documents(self):
+        return [
+            self.snapshot('a.txt', ['Dog and cat.', 'Dog alone.'], {
+                'dog': (2, [0, 1]),
+                'cat': (1, [0]),
+            }),
+            self.snapshot('b.txt', ['Dog and cat.', 'A bird.'], {
+                'dog': (1, [0]),
+                'cat': (1, [0]),
+                'bird': (1, [1]),
+            }),
+            self.snapshot('c.txt', ['A bird.'], {
+                'bird': (2, [0]),
+            }),
+        ]
+
+    def state(self, analyser):
+        """
+        The Analyser's results with sentence ids replaced by their text.
+        """
+        texts = analyser.sentences
+        return (
+            {
+                text: (w.frequency, sorted(texts[i] for i in w.sentences))
+                for text, w in analyser.words.items()
+            },
+            {
+                name: (
+                    d.content_hash,
+                    dict(d.word_frequency),
+                    {texts[i]: count for i, count in d.sentences.items()},
+                )
+                for name, d in analyser.document_data.items()
+            },
+        )
+
+    def load(self, *paths):
+        analyser = Analyser(cache=None)
+        snapshots.load_all(paths, analyser)
+        return analyser
+
+    def test_round_trip(self):
+        original = self.analyser('a.txt', ['Dog and cat.', 'Dog alone.'], {
+            'dog': (2, [0, 1]),
+            'cat': (1, [0]),
+        })
+        path = self.path('a.snapshot')
+        snapshots.write(original, path)
+        self.assertEqual(self.state(self.load(path)), self.state(original))
+
+    def test_merge_is_associative(self):
+        a, b, c = self.documents()
+        snapshots.merge([a, b], self.path('ab'))
+        snapshots.merge([self.path('ab'), c], self.path('ab_c'))
+        snapshots.merge([b, c], self.path('bc'))
+        snapshots.merge([a, self.path('bc')], self.path('a_bc'))
+        expected = self.state(self.load(a, b, c))
+        self.assertEqual(self.state(self.load(self.path('ab_c'))), expected)
+        self.assertEqual(self.state(self.load(self.path('a_bc'))), expected)
+        words, documents = expected
+        self.assertEqual(words['dog'], (3, ['Dog alone.', 'Dog and cat.']))
+        self.assertEqual(words['bird'], (3, ['A bird.']))
+        self.assertEqual(documents['c.txt'][2], {'A bird.': 1})
+
+    def test_document_in_two_snapshots(self):
+        a, _, _ = self.documents()
+        with self.assertRaises(ValueError):
+            self.load(a, a)
+
+    def test_not_a_snapshot(self):
+        path = self.path('other.npz')
+        numpy.savez(path, values=numpy.zeros(3))
+        with self.assertRaises(ValueError):
+            self.load(path)
+
+    def test_different_pipelines(self):
+        a, b, _ = self.documents()
+        snapshots.write(self.load(b), self.path('other'), pipeline='other')
+        with self.assertRaises(ValueError):
+            self.load(a, self.path('other'))
+
+    @override_settings(EXPORT_DIR=None)
+    def test_load_snapshot_command(self):
+        a, b, c = self.documents()
+        out = io.StringIO()
+        call_command('merge_snapshots', self.path('ab'), a, b, stdout=out)
+        with self.assertLogs('word_sentences.instrumentation'):
+            call_command('load_snapshot', self.path('ab'), c, stdout=out)
+        self.assertEqual(
+            sorted(Word.objects.values_list('text', 'total_frequency')),
+            [('bird', 3), ('cat', 2), ('dog', 3)]
+        )
+        self.assertEqual(Document.objects.count(), 3)
+        self.assertEqual(Sentence.objects.count(), 3)
+        run = IngestionRun.objects.get(command='load_snapshot')
+        self.assertEqual(run.documents, 3)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestTokenFilter(TestCase):
+
+    def setUp(self):
+        self.nlp = English()
+
+    def doc(self):
+        # Annotations are set per token, as spaCy 2 Doc takes only words.
+        doc = Doc(
+            self.nlp.vocab,
+            words=['The', 'cats', 'were', 'running', 'fast', '42', '.']
+        )
+        lemmas = ['the', 'cat', 'be', 'run', 'fast', '42', '.']
+        pos = ['DET', 'NOUN', 'AUX', 'VERB', 'ADV', 'NUM', 'PUNCT']
+        for token, lemma, tag in zip(doc, lemmas, pos):
+            token.lemma_ = lemma
+            token.pos_ = tag
+            token.is_sent_start = token.i == 0
+        return doc
+
+    def words(self):
+        analyser = Analyser(nlp=self.nlp, cache=None)
+        analyser.parse_doc(self.doc(), 'a.txt')
+        return sorted(analyser.words)
+
+    def test_default(self):
+        # 'the' and 'were' are spaCy stop words, '42' is not alphabetic.
+        self.assertEqual(self.words(), ['cat', 'fast', 'run'])
+
+    @override_settings(TOKEN_STOP_WORDS=['cats', 'Fast'])
+    def test_stop_words(self):
+        self.assertEqual(self.words(), ['be', 'run', 'the'])
+
+    def test_stop_words_file(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as f:
+            f.write('running\n\nthe\n')
+            f.flush()
+            with self.settings(TOKEN_STOP_WORDS=f.name):
+                self.assertEqual(self.words(), ['be', 'cat', 'fast'])
+            with self.settings(TOKEN_STOP_WORDS=Path(f.name)):
+                self.assertEqual(self.words(), ['be', 'cat', 'fast'])
+
+    def test_cache_miss_reuses_filter(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'a.txt')
+            with open(path, 'w', encoding='utf8') as f:
+                f.write('The cats were running fast.')
+            analyser = Analyser(
+                nlp=self.nlp,
+                cache=ParseCache(os.path.join(directory, 'cache'), 1024 ** 2)
+            )
+            with mock.patch.object(
+                    filters, 'TokenFilter',
+                    wraps=filters.TokenFilter) as token_filter:
+                analyser.parse_document(path)
+                Analyser(
+                    nlp=self.nlp,
+                    cache=None,
+                    token_filter=analyser.token_filter
+                ).parse_document(path)
+        self.assertEqual(token_filter.call_count, 1)
+
+    @override_settings(TOKEN_POS=['NOUN', 'VERB'])
+    def test_pos(self):
+        self.assertEqual(self.words(), ['cat', 'run'])
+
+    @override_settings(TOKEN_MIN_LENGTH=4, TOKEN_MAX_LENGTH=100)
+    def test_length(self):
+        self.assertEqual(self.words(), ['fast'])
+        self.assertEqual(filters.config()['max_length'], 45)
+
+    @override_settings(TOKEN_ALLOW=['the'], TOKEN_DENY=['run'])
+    def test_allow_and_deny(self):
+        self.assertEqual(self.words(), ['cat', 'fast', 'the'])
+
+    @override_settings(TOKEN_POS=['NOUN'])
+    def test_keep_token(self):
+        token_filter = filters.TokenFilter(self.nlp.vocab.strings)
+        self.assertEqual(
+            [token_filter.keep_token(token) for token in self.doc()],
+            [False, True, False, False, False, False, False]
+        )
+
+    def test_cache_key(self):
+        with tempfile.TemporaryDirectory() as directory:
+            default = ParseCache(directory, 0).key('hash')
+            with self.settings(TOKEN_DENY=['cat']):
+                self.assertNotEqual(
+                    ParseCache(directory, 0).key('hash'),
+                    default
+                )
+
+    def test_save_checks_word_length(self):
+        analyser = merge_document(
+            Analyser(nlp=self.nlp, cache=None),
+            'a.txt',
+            ['A sentence.'],
+            {'x' * 46: (1, [0])}
+        )
+        with self.assertRaises(ValueError):
+            analyser.save_data()
+        self.assertFalse(Document.objects.exists())
@@ -0,0 +1,154 @@
+import numpy
+from django.conf import settings
+from django.db import transaction
+from scipy import sparse
+from . import caching
+from .analyser import BATCH_SIZE
+from .cooccurrence import id_columns, top_k
+from .models import CorpusStats, Document, DocumentKeyword, DocumentWord, Word
+
+# L2-normalised TF-IDF matrix of the corpus, by corpus version.
+matrices = {}
+
+
+def idf(document_frequency, documents):
+    """
+    Smoothed inverse document frequency.
+    """
+    return numpy.log((1 + documents) / (1 + document_frequency)) + 1
+
+
+def document_matrix(document_ids=None):
+    """
+    Returns the TF-IDF matrix of some documents, or all of them,
+    with each row normalised to unit length,
+    and the document ids and word ids of its rows and columns.
+    Document frequencies are the ones kept on Word by the Analyser.
+    """
+    if document_ids is None:
+        documents, words, frequencies = id_columns(
+            DocumentWord.objects.all(),
+            ('document_id', 'word_id', 'frequency')
+        )
+    else:
+        parts = [
+            id_columns(
+                DocumentWord.objects.filter(
+                    document_id__in=document_ids[i:i + BATCH_SIZE]
+                ),
+                ('document_id', 'word_id', 'frequency')
+            )
+            for i in range(0, len(document_ids), BATCH_SIZE)
+        ]
+        documents, words, frequencies = (
+            numpy.concatenate([part[i] for part in parts])
+            if parts else numpy.zeros(0, dtype=numpy.int64)
+            for i in range(3)
+        )
+
+    word_ids, document_frequency = id_columns(
+        Word.objects.order_by('id'),
+        ('id', 'document_frequency')
+    )
+    columns = numpy.searchsorted(word_ids, words)
+    weights = frequencies * idf(
+        document_frequency[columns],
+        Document.objects.count()
+    )
+    row_ids, rows = numpy.unique(documents, return_inverse=True)
+    norms = numpy.sqrt(numpy.bincount(rows, weights ** 2))
+    matrix = sparse.csr_matrix(
+        (weights / norms[rows], (rows, columns)),
+        shape=(len(row_ids), len(word_ids))
+    )
+    return matrix, row_ids, word_ids
+
+
+def update_keywords(full=None, top=None):
+    """
+    Stores the top keywords of documents that have none yet,
+    i.e. those added since the last update.
+    Scores depend on the whole corpus, so all documents are
+    recomputed once the corpus has grown by KEYWORD_REBUILD_GROWTH
+    since the last full update, or if full is True.
+    Returns the number of documents updated.
+    """
+    if top is None:
+        top = getattr(settings, 'KEYWORD_TOP_N', 10)
+    growth = getattr(settings, 'KEYWORD_REBUILD_GROWTH', 0.25)
+    total = Document.objects.count()
+    if full is None:
+        stats = CorpusStats.load()
+        full = total > stats.keyword_documents * (1 + growth)
+
+    if full:
+        document_ids = None
+    else:
+        document_ids = list(
+            Document.objects.filter(
+                keywords__isnull=True
+            ).values_list('id', flat=True)
+        )
+        if not document_ids:
+            return 0
+    matrix, documents, words = document_matrix(document_ids)
+    scores = matrix.tocoo()
+    best = top_k(scores.row, scores.data, scores.data, top)
+    keywords = [
+        DocumentKeyword(document_id=document_id, word_id=word_id, score=score)
+        for document_id, word_id, score in zip(
+            documents[scores.row[best]].tolist(),
+            words[scores.col[best]].tolist(),
+            scores.data[best].tolist()
+        )
+    ]
+
+    with transaction.atomic():
+        if full:
+            DocumentKeyword.objects.all().delete()
+            CorpusStats.objects.get_or_create(pk=CorpusStats.PK)
+            CorpusStats.objects.filter(pk=CorpusStats.PK).update(
+                keyword_documents=total
+            )
+        else:
+            DocumentKeyword.objects.filter(
+                document_id__in=document_ids
+            ).delete()
+        DocumentKeyword.objects.bulk_create(keywords, batch_size=BATCH_SIZE)
+    return len(documents)
+
+
+def corpus_matrix():
+    """
+    Returns the TF-IDF matrix of all documents and their ids,
+    built once per corpus version in each process.
+    """
+    version = caching.corpus_version()
+    if version not in matrices:
+        matrix, documents, _ = document_matrix()
+        matrices.clear()
+        matrices[version] = matrix, documents
+    return matrices[version]
+
+
+def similar_documents(document_id, limit=10):
+    """
+    Returns (document, cosine similarity) for the documents most
+    similar to a document, best first.
+    """
+    matrix, documents = corpus_matrix()
+    index = numpy.searchsorted(documents, document_id)
+    if index == len(documents) or documents[index] != document_id:
+        return []
+    scores = (matrix @ matrix[index].T).toarray().ravel()
+    scores[index] = 0
+    best = numpy.argsort(-scores, kind='stable')[:limit]
+    best = best[scores[best] > 0]
+    objects = Document.objects.in_bulk(documents[best].tolist())
+    return [
+        (objects[document], score)
+        for document, score in zip(
+            documents[best].tolist(),
+            scores[best].tolist()
+        )
+    ]
@@ -6,25 +6,143 @@ from .models import (
     Word,
     Document,
     DocumentWord,
+    DocumentKeyword,
+    Sentence,
+    CorpusStats,
+    IngestionJob,
+    WordAssociation,
 )
 from django.conf import settings
-from django.http import HttpResponse
+from django.db.models import Prefetch, Q
+from django.http import (
+    FileResponse,
+    Http404,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.decorators import method_decorator
+from . import exports, ingestion, search, tfidf
+from .caching import corpus_version, versioned
+from .exports import all_word_data, iterate_in_chunks
+from .forms import UploadForm
+
+
+def document_sentences(doc_id):
+    """
+    Prefetches the sentences of each DocumentWord's word
+    that belong to the document, in id order,
+    as word.document_sentences.
+    """
+    return Prefetch(
+        'word__sentence_set',
+        queryset=Sentence.objects.filter(documents=doc_id).order_by('id'),
+        to_attr='document_sentences'
+    )
+
+
+class KeysetPaginationMixin:
+    """
+    Orders a ListView by one of sort_options, chosen with ?sort=.
+    With ?after=<id of the last object seen> the page is found by seeking
+    the sort index instead of with OFFSET, and without counting the rows,
+    so deep pages cost the same as the first one.
+    Without it, normal page number pagination is used, but the next
+    page is still linked with a cursor, so paging on stays keyset.
+    """
+    sort_options = {}
+    default_sort = None
 
+    def get_sort(self):
+        sort = self.request.GET.get('sort')
+        if sort in self.sort_options:
+            return sort
+        return self.default_sort
 
-class WordListView(ListView):
+    def get_ordering(self):
+        return (self.sort_options[self.get_sort()], 'id')
+
+    def keyset_filter(self, queryset, after):
+        """
+        Returns the objects that come after the object with id after.
+        """
+        ordering = self.sort_options[self.get_sort()]
+        field = ordering.lstrip('-')
+        value = queryset.filter(id=after).values_list(field, flat=True).first()
+        if value is None:
+            raise Http404('Invalid cursor')
+        if ordering.startswith('-'):
+            return queryset.filter(
+                Q(**{field + '__lt': value})
+                | Q(**{field: value, 'id__gt': after}),
+                **{field + '__lte': value}
+            )
+        return queryset.filter(
+            Q(**{field + '__gt': value})
+            | Q(**{field: value, 'id__gt': after}),
+            **{field + '__gte': value}
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        after = self.request.GET.get('after')
+        if after is None:
+            paginator, page, objects, is_paginated = \
+                super().paginate_queryset(queryset, page_size)
+            if page.has_next():
+                self.next_cursor = objects[len(objects) - 1].id
+            return paginator, page, objects, is_paginated
+        try:
+            after = int(after)
+        except ValueError:
+            raise Http404('Invalid cursor')
+        objects = list(self.keyset_filter(queryset, after)[:page_size + 1])
+        if len(objects) > page_size:
+            objects = objects[:page_size]
+            self.next_cursor = objects[-1].id
+        return (None, None, objects, False)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['sort'] = self.get_sort()
+        context['sort_options'] = list(self.sort_options)
+        context['next_cursor'] = getattr(self, 'next_cursor', None)
+        context['is_keyset'] = 'after' in self.request.GET
+        return context
+
+
+@method_decorator(versioned, name='dispatch')
+class WordListView(KeysetPaginationMixin, ListView):
     """
     List view for all Word objects.
     """
     model = Word
     template_name = 'word_list.html'
     paginate_by = 12
+    sort_options = {
+        'alphabetical': 'text',
+        'frequency': '-total_frequency',
+        'documents': '-document_frequency',
+    }
+    default_sort = 'alphabetical'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['heading'] ='All words'
+        version = corpus_version()
+        context['export_formats'] = [
+            export_format for export_format in exports.FORMATS
+            if export_format != 'txt'
+            and exports.export_path(version, export_format)
+        ]
         return context
 
+    def get_queryset(self):
+        return Word.objects.prefetch_related(
+            *exports.word_prefetches()
+        ).order_by(*self.get_ordering())
 
+
+@method_decorator(versioned, name='dispatch')
 class DocumentListView(ListView):
     """
     List view for all Document objects.
@@ -32,56 +150,255 @@ class DocumentListView(ListView):
     model = Document
     template_name = 'document_list.html'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['corpus'] = CorpusStats.objects.filter(
+            pk=CorpusStats.PK
+        ).first()
+        return context
 
-class DocumentWordListView(ListView):
+    def get_queryset(self):
+        return Document.objects.order_by('id')
+
+
+@method_decorator(versioned, name='dispatch')
+class DocumentWordListView(KeysetPaginationMixin, ListView):
     """
     List view for Docuement Word objetcs
     """
     model = DocumentWord
     template_name = 'document_word_list.html'
     paginate_by = 12
+    sort_options = {
+        'frequency': '-frequency',
+        'alphabetical': 'word__text',
+    }
+    default_sort = 'frequency'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        doc = Document.objects.get(id=self.kwargs['doc_id'])
+        doc = get_object_or_404(Document, id=self.kwargs['doc_id'])
         context['doc_id'] = doc.id
         context['heading'] = 'Words from {}'.format(doc.name)
         return context
 
     def get_queryset(self):
-        return DocumentWord.objects.filter(document__id=self.kwargs['doc_id'])
+        doc_id = self.kwargs['doc_id']
+        return DocumentWord.objects.filter(
+            document__id=doc_id
+        ).select_related('word').prefetch_related(
+            document_sentences(doc_id)
+        ).order_by(*self.get_ordering())
 
 
+def search_results(request):
+    """
+    Returns the search query and results for a request's GET parameters.
+    q is the query, mode is 'prefix' or 'substring' for words
+    and 'sentence' for sentence phrase search.
+    """
+    query = request.GET.get('q', '').strip()
+    mode = request.GET.get('mode', 'prefix')
+    words = []
+    sentences = []
+    if query:
+        if mode == 'sentence':
+            sentences = search.search_sentences(query)
+        else:
+            words = search.search_words(query, substring=mode == 'substring')
+    return query, mode, words, sentences
+
+
+@versioned
+def search_view(request):
+    """
+    Searches for words by prefix or substring, or sentences by phrase.
+    """
+    query, mode, words, sentences = search_results(request)
+    return render(request, 'search.html', {
+        'heading': 'Search',
+        'query': query,
+        'mode': mode,
+        'word_list': words,
+        'sentence_list': sentences,
+    })
+
+
+@versioned
+def search_json(request):
+    """
+    JSON version of search_view.
+    """
+    query, mode, words, sentences = search_results(request)
+    return JsonResponse({
+        'query': query,
+        'mode': mode,
+        'words': [
+            {
+                'id': w.id,
+                'text': w.text,
+                'total_frequency': w.total_frequency,
+            }
+            for w in words
+        ],
+        'sentences': [{'id': s.id, 'text': s.text} for s in sentences],
+    })
+
+
+def related_words(word_id):
+    """
+    Returns the words most associated with a word, best first,
+    read from the precomputed associations in one query.
+    """
+    return list(
+        WordAssociation.objects.filter(
+            word_id=word_id
+        ).select_related('other').order_by('-pmi')
+    )
+
+
+@versioned
+def word_related(request, word_id):
+    """
+    Lists the words that occur most often with a word.
+    """
+    word = get_object_or_404(Word, id=word_id)
+    return render(request, 'related_words.html', {
+        'heading': 'Words related to {}'.format(word.text),
+        'word': word,
+        'associations': related_words(word_id),
+    })
+
+
+def document_keywords(doc_id):
+    """
+    Returns the stored keywords of a document, best first.
+    """
+    return list(
+        DocumentKeyword.objects.filter(
+            document_id=doc_id
+        ).select_related('word').order_by('-score')
+    )
+
+
+@versioned
+def document_similar(request, doc_id):
+    """
+    Shows the keywords of a document and the documents most like it.
+    """
+    document = get_object_or_404(Document, id=doc_id)
+    return render(request, 'document_similar.html', {
+        'heading': 'Keywords and similar documents for {}'.format(
+            document.name
+        ),
+        'document': document,
+        'keywords': document_keywords(doc_id),
+        'similar': tfidf.similar_documents(doc_id),
+    })
+
+
+def document_word_data(document):
+    """
+    Yields the download text for the words of a document,
+    one word at a time.
+    """
+    yield 'Word data for {}:\n\n'.format(document.name)
+    document_words = DocumentWord.objects.filter(
+        document=document
+    ).select_related('word').prefetch_related(
+        document_sentences(document.id)
+    )
+    for w in iterate_in_chunks(document_words):
+        out = w.word.text + '\n'
+        out += '\tFrequency: ' + str(w.frequency) + '\n'
+        out += '\tSentences:\n'
+        for s in w.word.document_sentences:
+            out += '\t\t' + s.text.strip() + '\n'
+        out += '\n'
+        yield out
+
+
+@versioned
 def download(request, doc_id):
     """
-    Response downloads a .txt file
-    Containing the word data corresponding to a document,
-    or all word data if the passed id is 0
+    Response downloads the word data corresponding to a document,
+    or all word data if the passed id is 0.
+    All word data is served from the exports written after ingestion,
+    in the format chosen with ?format= (txt, csv, jsonl or npz),
+    those of the previous version while the current one is written.
+    Until any are written the text is streamed,
+    so memory use doesn't grow with the data.
     """
     if doc_id == 0:
-        name = 'all_documents_{}.txt'.format(datetime.now())
-        out = 'All word data:\n\n'
-        for w in Word.objects.all():
-            out += w.text + '\n'
-            out += '\tFrequency: ' + str(w.total_frequency) + '\n'
-            out += '\t' + w.documents() + '\n'
-            out += '\tSentences:\n'
-            for s in w.sentence_set.all():
-                out += '\t\t' + s.text.strip() + '\n'
-            out += '\n'
+        export_format = request.GET.get('format', 'txt')
+        if export_format not in exports.FORMATS:
+            raise Http404('Unknown format')
+        path = exports.export_path(corpus_version(), export_format)
+        name = 'all_documents_{}.{}'.format(datetime.now(), export_format)
+        if path is not None:
+            content_type = exports.FORMATS[export_format]
+            if path.endswith('.gz'):
+                name += '.gz'
+                content_type = 'application/gzip'
+            return FileResponse(
+                open(path, 'rb'),
+                as_attachment=True,
+                filename=name,
+                content_type=content_type
+            )
+        if export_format != 'txt':
+            raise Http404('Export not written yet')
+        out = all_word_data()
     else:
-        d = Document.objects.get(id=doc_id)
-        out = 'Word data for {}:\n\n'.format(d.name)
+        d = get_object_or_404(Document, id=doc_id)
         name = 'document_{}_words_{}.txt'.format(d.id, datetime.now())
-        for w in DocumentWord.objects.filter(document__id=doc_id):
-            out += w.word.text + '\n'
-            out += '\tFrequency: ' + str(w.frequency) + '\n'
-            out += '\tSentences:\n'
-            for s in w.word.sentence_set.all():
-                if s.document.id == w.document.id:
-                    out += '\t\t' + s.text.strip() + '\n'
-            out += '\n'
-
-    response = HttpResponse(out ,content_type='text/csv')
+        out = document_word_data(d)
+
+    response = StreamingHttpResponse(out, content_type='text/plain')
     response['Content-Disposition'] = 'attachment; filename="{}"'.format(name)
     return response
+
+
+def wants_json(request):
+    return 'application/json' in request.headers.get('Accept', '')
+
+
+def upload(request):
+    """
+    Queues uploaded documents for the ingest worker and returns at once.
+    Clients asking for JSON get the new jobs with a 202 status,
+    the form redirects back to the list of recent jobs.
+    """
+    if request.method == 'POST':
+        form = UploadForm(request.POST, request.FILES)
+        if form.is_valid():
+            jobs = [ingestion.enqueue(f) for f in form.cleaned_data['files']]
+            if wants_json(request):
+                return JsonResponse(
+                    {'jobs': [job.as_dict() for job in jobs]},
+                    status=202
+                )
+            return redirect('upload')
+        if wants_json(request):
+            return JsonResponse({'errors': form.errors}, status=400)
+    else:
+        form = UploadForm()
+    return render(request, 'upload.html', {
+        'form': form,
+        'jobs': IngestionJob.objects.order_by('-id')[:20],
+    })
+
+
+def job_status(request, job_id):
+    """
+    Returns the status of an ingestion job as JSON,
+    with its place in the queue while it waits.
+    """
+    job = get_object_or_404(IngestionJob, id=job_id)
+    data = job.as_dict()
+    if job.status == IngestionJob.QUEUED:
+        data['position'] = IngestionJob.objects.filter(
+            status=IngestionJob.QUEUED,
+            id__lt=job.id
+        ).count() + 1
+    return JsonResponse(data)